@@ -6,6 +6,9 @@
 set -e
 
 MODELS_PATH="/run/media/garuda/73cf9511-0af0-4ac4-9d83-ee21eb17ff5d/models"
+THROUGHPUT_FILE="$HOME/.ollama-code-checker/throughput.json"  # Learned by the GUI
+MAX_ATTEMPTS=4          # Tries per request for transient failures
+CIRCUIT_THRESHOLD=3     # Consecutive failed files before giving up on the model
 
 # Colors
 RED='\033[0;31m'
@@ -39,6 +42,48 @@ WARNING: This tool modifies your files! Always use version control.
 EOF
 }
 
+# Per-request deadline in seconds from the prompt size and the model's learned
+# throughput (prompt-eval and generation rates), bounded to 30-1800s
+request_timeout() {
+    local model="$1"
+    local prompt_chars="$2"
+    local output_tokens="${3:-1024}"
+    
+    python3 - "$THROUGHPUT_FILE" "$model" "$prompt_chars" "$output_tokens" 2>/dev/null << 'PYEOF' || echo 120
+import json, sys
+path, model, chars, output_tokens = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+rates = {'prompt_rate': 100.0, 'gen_rate': 10.0, 'load_time': 30.0}
+try:
+    with open(path) as f:
+        rates.update(json.load(f).get(model, {}))
+except (OSError, ValueError):
+    pass
+expected = (chars // 4 + 1) / rates['prompt_rate'] + output_tokens / rates['gen_rate'] + rates['load_time']
+print(int(min(1800, max(30, expected * 2 + 15))))
+PYEOF
+}
+
+# Run one prompt under a deadline, retrying transient failures with jittered
+# exponential backoff (timeouts are not retried; the deadline is adaptive)
+run_model() {
+    local model="$1"
+    local prompt="$2"
+    local deadline="$3"
+    local attempt=1
+    local status
+    
+    while true; do
+        status=0
+        timeout "$deadline" ollama run "$model" "$prompt" < /dev/null 2>/dev/null || status=$?
+        if [[ $status -eq 0 || $status -eq 124 || $attempt -ge $MAX_ATTEMPTS ]]; then
+            return $status
+        fi
+        # Full jitter: sleep a random 0..2^(attempt-1) seconds
+        sleep $(( RANDOM % (2 ** (attempt - 1) + 1) ))
+        attempt=$((attempt + 1))
+    done
+}
+
 autofix_file() {
     local file="$1"
     local model="$2"
@@ -96,12 +141,20 @@ Return ONLY the fixed code in \`\`\`$language code blocks. No explanations."
     
     # Run Ollama analysis
     export OLLAMA_MODELS="$MODELS_PATH"
-    export CUDA_VISIBLE_DEVICES=0
+    
+    # The answer is about as long as the file itself
+    local deadline
+    deadline=$(request_timeout "$model" "${#prompt}" $(( ${#content} / 4 + 256 )))
     
     local response
-    if ! response=$(timeout 120 ollama run "$model" "$prompt" 2>/dev/null); then
+    local status=0
+    response=$(run_model "$model" "$prompt" "$deadline") || status=$?
+    if [[ $status -eq 124 ]]; then
+        echo -e "${RED}❌ AI analysis timed out after ${deadline}s for $(basename "$file")${NC}"
+        return 2
+    elif [[ $status -ne 0 ]]; then
         echo -e "${RED}❌ AI analysis failed for $(basename "$file")${NC}"
-        return 1
+        return 2
     fi
     
     # Extract fixed code from response
@@ -249,12 +302,24 @@ main() {
     echo -e "${GREEN}Found $total_count files to process${NC}"
     echo ""
     
-    # Process each file
+    # Process each file; stop early if the model keeps failing (circuit breaker)
+    local consecutive_failures=0
     for file in "${files_to_fix[@]}"; do
-        if autofix_file "$file" "$model" "$fix_type" "$dry_run"; then
+        local status=0
+        autofix_file "$file" "$model" "$fix_type" "$dry_run" || status=$?
+        if [[ $status -eq 0 ]]; then
             ((fixed_count++)) || true
         fi
+        if [[ $status -eq 2 ]]; then
+            consecutive_failures=$((consecutive_failures + 1))
+        else
+            consecutive_failures=0
+        fi
         echo ""
+        if [[ $consecutive_failures -ge $CIRCUIT_THRESHOLD ]]; then
+            echo -e "${RED}❌ $model failed $consecutive_failures times in a row; skipping the remaining files${NC}"
+            break
+        fi
     done
     
     echo -e "${BLUE}===================${NC}"
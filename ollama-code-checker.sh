@@ -9,6 +9,10 @@ set -e
 MODELS_PATH="/run/media/garuda/73cf9511-0af0-4ac4-9d83-ee21eb17ff5d/models"
 CONFIG_FILE="$HOME/.ollama-code-checker.conf"
 TEMP_DIR="/tmp/ollama-analysis"
+THROUGHPUT_FILE="$HOME/.ollama-code-checker/throughput.json"  # Learned by the GUI
+MAX_ATTEMPTS=4          # Tries per request for transient failures
+CIRCUIT_THRESHOLD=3     # Consecutive failed files before pausing the model
+CIRCUIT_COOLDOWN=120    # Seconds to pause before one trial request
 
 # Colors for output
 RED='\033[0;31m'
@@ -183,6 +187,49 @@ list_available_models() {
     return 0
 }
 
+# Per-request deadline in seconds from the prompt size and the model's learned
+# throughput (prompt-eval and generation rates), bounded to 30-1800s
+request_timeout() {
+    local model="$1"
+    local prompt_chars="$2"
+    local output_tokens="${3:-1024}"
+    
+    python3 - "$THROUGHPUT_FILE" "$model" "$prompt_chars" "$output_tokens" 2>/dev/null << 'PYEOF' || echo 300
+import json, sys
+path, model, chars, output_tokens = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+rates = {'prompt_rate': 100.0, 'gen_rate': 10.0, 'load_time': 30.0}
+try:
+    with open(path) as f:
+        rates.update(json.load(f).get(model, {}))
+except (OSError, ValueError):
+    pass
+expected = (chars // 4 + 1) / rates['prompt_rate'] + output_tokens / rates['gen_rate'] + rates['load_time']
+print(int(min(1800, max(30, expected * 2 + 15))))
+PYEOF
+}
+
+# Run one prompt under a deadline. Transient failures (server starting, busy,
+# connection dropped) are retried with jittered exponential backoff; timeouts
+# are not retried because the deadline already accounts for the model's speed.
+run_model() {
+    local model="$1"
+    local prompt="$2"
+    local deadline="$3"
+    local attempt=1
+    local status
+    
+    while true; do
+        status=0
+        timeout "$deadline" env OLLAMA_MODELS="$MODELS_PATH" ollama run "$model" "$prompt" < /dev/null 2>/dev/null || status=$?
+        if [[ $status -eq 0 || $status -eq 124 || $attempt -ge $MAX_ATTEMPTS ]]; then
+            return $status
+        fi
+        # Full jitter: sleep a random 0..2^(attempt-1) seconds
+        sleep $(( RANDOM % (2 ** (attempt - 1) + 1) ))
+        attempt=$((attempt + 1))
+    done
+}
+
 get_file_content() {
     local file="$1"
     local max_lines=500
@@ -332,6 +379,9 @@ Structure your response clearly with priorities and specific recommendations."
     local temp_file="$TEMP_DIR/analysis_$(basename "$file")_$(date +%s).md"
     mkdir -p "$TEMP_DIR"
     
+    local deadline
+    deadline=$(request_timeout "$MODEL" "${#prompt}")
+    
     {
         echo "# Code Analysis Report"
         echo "**File:** $file"
@@ -341,18 +391,24 @@ Structure your response clearly with priorities and specific recommendations."
         echo "**Date:** $(date)"
         echo ""
         
-        if timeout 300 env OLLAMA_MODELS="$MODELS_PATH" CUDA_VISIBLE_DEVICES=0 ollama run "$MODEL" "$prompt" 2>/dev/null; then
+        local status=0
+        run_model "$MODEL" "$prompt" "$deadline" || status=$?
+        if [[ $status -eq 0 ]]; then
             echo ""
             echo "---"
             echo "Analysis completed successfully."
+        elif [[ $status -eq 124 ]]; then
+            echo "Error: Analysis timed out after ${deadline}s."
+            return 1
         else
-            echo "Error: Analysis failed or timed out."
+            echo "Error: Analysis failed after $MAX_ATTEMPTS attempts."
             return 1
         fi
     } | tee "$temp_file"
+    local analysis_status=${PIPESTATUS[0]}
     
     echo -e "${GREEN}Analysis saved to: $temp_file${NC}"
-    return 0
+    return $analysis_status
 }
 
 analyze_directory() {
@@ -428,6 +484,7 @@ analyze_directory() {
     
     local success_count=0
     local total_count=0
+    local consecutive_failures=0
     
     while IFS= read -r file; do
         [[ -z "$file" ]] && continue
@@ -435,8 +492,22 @@ analyze_directory() {
         ((total_count++))
         echo -e "${PURPLE}[$total_count/$file_count] Processing: $(basename "$file")${NC}"
         
+        # Circuit breaker: a model that keeps failing gets a cooldown and one
+        # trial request; if that fails too, stop instead of burning the run
+        if [[ $consecutive_failures -ge $CIRCUIT_THRESHOLD ]]; then
+            if [[ $consecutive_failures -gt $CIRCUIT_THRESHOLD ]]; then
+                echo -e "${RED}Model $MODEL keeps failing; skipping the remaining files.${NC}"
+                break
+            fi
+            echo -e "${YELLOW}⚠️  $consecutive_failures failures in a row; pausing ${CIRCUIT_COOLDOWN}s before retrying $MODEL${NC}"
+            sleep "$CIRCUIT_COOLDOWN"
+        fi
+        
         if analyze_file "$file" "$analysis_type"; then
             ((success_count++))
+            consecutive_failures=0
+        else
+            consecutive_failures=$((consecutive_failures + 1))
         fi
         
         echo
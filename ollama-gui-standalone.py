@@ -1,16 +1,4867 @@
 #!/usr/bin/env python3
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+from tkinter import ttk, filedialog, messagebox, simpledialog
+import tkinter.font as tkfont
 import subprocess
 import threading
 import os
+import sys
+import argparse
 from pathlib import Path
 import json
 import datetime
+import hashlib
+import re
+import time
+import random
+import socket
+import sqlite3
+import ast
+import itertools
+import shutil
+from array import array
+import http.client
+import http.server
+import urllib.parse
+import gzip
+import ctypes
+import ctypes.util
+import select
+import struct
+import statistics
+import functools
+import contextlib
+import marshal
+import tracemalloc
+import concurrent.futures
+import multiprocessing
+import zlib
+import queue
 
-class OllamaCodeCheckerGUI:
-    def __init__(self, root):
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Related-code retrieval needs numpy; everything else works without it
+
+# Per-user state (run journals, caches) lives next to the shell checker's config
+STATE_DIR = os.path.expanduser("~/.ollama-code-checker")
+JOURNAL_DIR = os.path.join(STATE_DIR, "runs")
+THROUGHPUT_FILE = os.path.join(STATE_DIR, "throughput.json")
+FINDINGS_DB = os.path.join(STATE_DIR, "findings.db")
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+SYMBOLS_DB = os.path.join(STATE_DIR, "symbols.db")
+CLONES_DB = os.path.join(STATE_DIR, "clones.db")
+EMBEDDINGS_DIR = os.path.join(STATE_DIR, "embeddings")
+PROFILES_FILE = os.path.join(STATE_DIR, "profiles.json")
+MINIFY_RULES_FILE = os.path.join(STATE_DIR, "minify.json")
+PROFILE_DIR = os.path.join(STATE_DIR, "profiles")
+
+# Same variable the ollama CLI uses to find the server
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST', '127.0.0.1:11434')
+
+# Typical length of an analysis answer, used to size request deadlines
+ANALYSIS_OUTPUT_TOKENS = 1024
+
+# Files the analyzer looks at, and directories it never enters
+CODE_EXTENSIONS = ('.rs', '.ts', '.tsx', '.js', '.jsx', '.py', '.go', '.java', '.cpp', '.c', '.h')
+SKIP_DIRS = ('node_modules', 'target', 'build', 'dist', '.git', '__pycache__')
+
+# Model used for related-code retrieval (ollama pull nomic-embed-text)
+EMBED_MODEL = os.environ.get('OLLAMA_EMBED_MODEL', 'nomic-embed-text')
+
+class PipelineProfiler:
+    """Where a run's time and memory go, stage by stage.
+
+    Code marks its stage with profile_stage() or @profiled; time is charged
+    to the innermost stage of each thread. A sampler thread records the
+    stacks of threads inside a stage every few milliseconds, which become
+    per-stage pstats files (pstats.Stats(path)) and collapsed-stack files for
+    flamegraph tools. tracemalloc tracks net allocations per stage and dumps
+    a snapshot when each stage first finishes and at the end
+    (tracemalloc.Snapshot.load(path)).
+    """
+    
+    active = None  # The running profiler; at most one at a time
+    INTERVAL = 0.005
+    MODEL_STAGES = ('inference', 'embedding', 'queued')  # Waiting on the server (or a request slot) rather than working
+    
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(PROFILE_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+        self.lock = threading.Lock()
+        self.stacks = {}  # thread id -> [[stage, time charged up to], ...]
+        self.seconds = {}  # stage -> exclusive thread-seconds
+        self.entries = {}  # stage -> times entered
+        self.allocated = {}  # stage -> net bytes allocated (inclusive)
+        self.samples = {}  # stage -> {stack: count}
+        self.snapshotted = set()
+        self.stopped = threading.Event()
+    
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(10)
+        self.started = time.monotonic()
+        self.ticks = 0
+        self.sampler = threading.Thread(target=self.sample_loop, daemon=True)
+        self.sampler.start()
+        PipelineProfiler.active = self
+        return self
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.stacks.setdefault(threading.get_ident(), [])
+        now = time.monotonic()
+        if stack:
+            self.charge(stack[-1], now)
+        stack.append([name, now])
+        memory_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            self.charge(stack.pop(), now)
+            if stack:
+                stack[-1][1] = now
+            with self.lock:
+                self.entries[name] = self.entries.get(name, 0) + 1
+                self.allocated[name] = self.allocated.get(name, 0) + tracemalloc.get_traced_memory()[0] - memory_before
+                first = name not in self.snapshotted
+                self.snapshotted.add(name)
+            if first and tracemalloc.is_tracing():
+                tracemalloc.take_snapshot().dump(os.path.join(self.directory, f"{name}.snapshot"))
+    
+    def charge(self, frame, now):
+        name, since = frame
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + now - since
+        frame[1] = now
+    
+    def sample_loop(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.INTERVAL):
+            frames = sys._current_frames()
+            self.ticks += 1
+            for thread_id, stack in list(self.stacks.items()):
+                if thread_id == own or not stack or thread_id not in frames:
+                    continue
+                calls = []
+                frame = frames[thread_id]
+                while frame is not None and len(calls) < 64:
+                    code = frame.f_code
+                    calls.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                with self.lock:
+                    by_stack = self.samples.setdefault(stack[-1][0], {})
+                    key = tuple(reversed(calls))
+                    by_stack[key] = by_stack.get(key, 0) + 1
+    
+    def finish(self):
+        """Stop profiling, write the files and return the summary text"""
+        PipelineProfiler.active = None
+        self.stopped.set()
+        self.sampler.join()
+        wall = time.monotonic() - self.started
+        interval = wall / max(self.ticks, 1)
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(os.path.join(self.directory, "final.snapshot"))
+            top = snapshot.statistics('lineno')[:10]
+            peak = tracemalloc.get_traced_memory()[1]
+            if self.started_tracing:
+                tracemalloc.stop()
+        else:
+            top, peak = [], 0
+        
+        with open(os.path.join(self.directory, "all.collapsed"), 'w', encoding='utf-8') as combined:
+            for name, by_stack in self.samples.items():
+                self.write_pstats(os.path.join(self.directory, f"{name}.prof"), by_stack, interval)
+                with open(os.path.join(self.directory, f"{name}.collapsed"), 'w', encoding='utf-8') as f:
+                    for calls, count in by_stack.items():
+                        line = ';'.join(f"{func} ({os.path.basename(path)}:{line})" for path, line, func in calls)
+                        f.write(f"{line} {count}\n")
+                        combined.write(f"{name};{line} {count}\n")
+        
+        total = sum(self.seconds.values()) or 1e-9
+        model = sum(self.seconds.get(name, 0.0) for name in self.MODEL_STAGES)
+        lines = [f"📈 Profile of a {wall:.1f}s run (stage times are thread-seconds, exclusive of nested stages)",
+                 f"   {'stage':<14}{'seconds':>10}{'share':>8}{'entries':>9}{'samples':>9}{'net alloc':>12}"]
+        for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            samples = sum(self.samples.get(name, {}).values())
+            lines.append(f"   {name:<14}{seconds:>10.2f}{100 * seconds / total:>7.1f}%{self.entries.get(name, 0):>9}"
+                         f"{samples:>9}{self.allocated.get(name, 0) / 1e6:>+10.2f}MB")
+        lines.append(f"   Waiting on the model: {model:.1f}s; everything else: {total - model:.1f}s "
+                     f"({100 * (total - model) / total:.0f}% of staged time)")
+        if peak:
+            lines.append(f"   Peak traced memory: {peak / 1e6:.1f}MB; largest live allocations at the end:")
+            lines.extend(f"     {stat}" for stat in top[:5])
+        lines.append(f"   Files: {self.directory} (*.prof for pstats, *.collapsed for flamegraphs, *.snapshot for tracemalloc)")
+        text = '\n'.join(lines) + '\n'
+        with open(os.path.join(self.directory, "summary.txt"), 'w', encoding='utf-8') as f:
+            f.write(text)
+        return text
+    
+    @staticmethod
+    def write_pstats(path, by_stack, interval):
+        """Sampled stacks in the marshalled format pstats.Stats loads"""
+        stats = {}  # function -> [primitive calls, calls, own time, cumulative time, callers]
+        for calls, count in by_stack.items():
+            seconds = count * interval
+            seen = set()
+            for depth, func in enumerate(calls):
+                entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+                leaf = depth == len(calls) - 1
+                if func not in seen:
+                    seen.add(func)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if leaf:
+                    entry[2] += seconds
+                if depth:
+                    caller = entry[4].setdefault(calls[depth - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += count
+                    caller[1] += count
+                    caller[2] += seconds if leaf else 0.0
+                    caller[3] += seconds
+        with open(path, 'wb') as f:
+            marshal.dump({func: (cc, nc, tt, ct, {c: tuple(v) for c, v in callers.items()})
+                          for func, (cc, nc, tt, ct, callers) in stats.items()}, f)
+
+def profile_stage(name):
+    """Attribute the enclosed work to a pipeline stage while a profiler runs"""
+    profiler = PipelineProfiler.active
+    return profiler.stage(name) if profiler else contextlib.nullcontext()
+
+def profiled(name):
+    """Decorator form of profile_stage"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for code)"""
+    return len(text) // 4 + 1
+
+def git_blob_hash(data):
+    """Content hash of raw file bytes, identical to git's blob id"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def file_content_hash(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return git_blob_hash(f.read())
+    except OSError:
+        return None
+
+def file_stamp(file_path):
+    """(size, mtime in ns) of a file, None when it can't be stat'ed"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def normalized_content_hash(data):
+    """Hash that ignores whitespace within lines but keeps the line structure,
+    so line numbers in a result stay valid for every file sharing the hash"""
+    text = data.decode('utf-8', errors='ignore')
+    lines = [' '.join(line.split()) for line in text.splitlines()]
+    while lines and not lines[-1]:
+        lines.pop()
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+def group_duplicates(files, normalize=False, token=None):
+    """Map each representative file to the other files with the same content.
+
+    Files only group with files of the same extension, because the prompt
+    names the language. Representatives keep the order of files.
+    """
+    groups = {}
+    for file_path in files:
+        if token:
+            token.check()
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            groups[(file_path,)] = [file_path]  # Unreadable: let analysis report it
+            continue
+        digest = normalized_content_hash(data) if normalize else git_blob_hash(data)
+        groups.setdefault((os.path.splitext(file_path)[1], digest), []).append(file_path)
+    return {paths[0]: paths[1:] for paths in groups.values()}
+
+# (line comment, block start, block end) per extension
+_C_COMMENTS = ('//', '/*', '*/')
+COMMENT_SYNTAX = {
+    '.py': ('#', None, None),
+    '.rs': _C_COMMENTS, '.ts': _C_COMMENTS, '.tsx': _C_COMMENTS, '.js': _C_COMMENTS, '.jsx': _C_COMMENTS,
+    '.go': _C_COMMENTS, '.java': _C_COMMENTS, '.cpp': _C_COMMENTS, '.c': _C_COMMENTS, '.h': _C_COMMENTS,
+}
+
+# Comments that carry meaning for tools or reviewers are never dropped
+KEEP_COMMENT = re.compile(r'TODO|FIXME|XXX|HACK|SAFETY|noqa|type:|pragma|eslint|nolint|^#!', re.IGNORECASE)
+LICENSE_WORDS = re.compile(r'licen[cs]e|copyright|spdx', re.IGNORECASE)
+
+# Input minifier rules per analysis type. Style analysis sees the file as is;
+# cleanup keeps comments because commented-out code and TODOs are findings.
+# Override in ~/.ollama-code-checker/minify.json, e.g. {"errors": ["license"]}.
+MINIFY_RULES = {
+    'style': [],
+    'cleanup': ['license', 'blank_runs', 'trailing_space'],
+    'all': ['license', 'blank_runs', 'trailing_space'],
+    'errors': ['license', 'comments', 'blank_lines', 'trailing_space', 'indent'],
+    'security': ['license', 'comments', 'blank_lines', 'trailing_space', 'indent'],
+    'performance': ['license', 'comments', 'blank_lines', 'trailing_space', 'indent'],
+}
+
+def load_minify_rules(path=MINIFY_RULES_FILE):
+    rules = dict(MINIFY_RULES)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            rules.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return rules
+
+@profiled('prompt')
+def minify_source(text, file_path, rules):
+    """Drop low-signal lines and condense whitespace of a file for a prompt.
+
+    Returns (text, line_map) where line_map[i] is the original line number of
+    line i + 1 of the minified text, or None when no line was dropped.
+    Rules: license (leading license/copyright header), comments (whole-line
+    comments), blank_lines, blank_runs (collapse to one), trailing_space,
+    indent (one space per indentation level).
+    """
+    if not rules:
+        return text, None
+    lines = text.split('\n')
+    drop = [False] * len(lines)
+    line_comment, block_start, block_end = COMMENT_SYNTAX.get(os.path.splitext(file_path)[1], (None, None, None))
+    
+    def comment_kind(stripped, in_block):
+        """'comment' for a line that is only comment, 'open' when a block stays open"""
+        if in_block:
+            if block_end in stripped:
+                return 'comment' if stripped.endswith(block_end) else None
+            return 'open'
+        if line_comment and stripped.startswith(line_comment):
+            return 'comment'
+        if block_start and stripped.startswith(block_start):
+            rest = stripped[len(block_start):]
+            if block_end in rest:
+                return 'comment' if rest.endswith(block_end) else None
+            return 'open'
+        return None
+    
+    if 'license' in rules:
+        header, in_block = [], False
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if i == 0 and stripped.startswith('#!'):
+                continue
+            kind = comment_kind(stripped, in_block)
+            if kind is None and stripped:
+                break
+            header.append(i)
+            in_block = kind == 'open'
+        if header and LICENSE_WORDS.search('\n'.join(lines[i] for i in header)):
+            for i in header:
+                drop[i] = True
+    
+    if 'comments' in rules:
+        in_block = False
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            kind = comment_kind(stripped, in_block)
+            if in_block and kind != 'open':
+                in_block = False
+                if kind == 'comment':
+                    drop[i] = True
+                continue
+            if kind == 'open':
+                in_block = True
+                drop[i] = True
+            elif kind == 'comment' and not KEEP_COMMENT.search(stripped):
+                drop[i] = True
+    
+    kept, line_map = [], []
+    indents = [0]
+    for i, line in enumerate(lines):
+        if drop[i]:
+            continue
+        if 'trailing_space' in rules:
+            line = line.rstrip()
+        if not line.strip():
+            if 'blank_lines' in rules or ('blank_runs' in rules and kept and not kept[-1].strip()):
+                continue
+            line = ''
+        elif 'indent' in rules:
+            width = len(line.expandtabs(8)) - len(line.expandtabs(8).lstrip())
+            while width < indents[-1]:
+                indents.pop()
+            if width > indents[-1]:
+                indents.append(width)
+            line = ' ' * (len(indents) - 1) + line.lstrip()
+        kept.append(line)
+        line_map.append(i + 1)
+    
+    if len(line_map) == len(lines):
+        return '\n'.join(kept), None
+    return '\n'.join(kept), line_map
+
+def truncate_source(content, line_map, limit=15000):
+    """Cut minified content to the prompt limit; returns (content, line_map, cut)
+
+    cut is the first original line the model doesn't fully see, or None when
+    nothing was cut.
+    """
+    if len(content) <= limit:
+        return content, line_map, None
+    content = content[:limit]
+    shown = content.count('\n')  # Complete lines; the last one is partial
+    cut = line_map[shown] if line_map else shown + 1
+    return content, line_map[:shown + 1] if line_map else line_map, cut
+
+def remap_line_numbers(text, line_map):
+    """Rewrite "line N" / "lines N-M" references from minified to original numbering"""
+    if not line_map:
+        return text
+    return rewrite_line_numbers(text, lambda number: line_map[number - 1] if 1 <= number <= len(line_map) else number)
+
+def rewrite_line_numbers(text, convert):
+    """Replace the numbers of every "line N" / "lines N-M" reference with convert(N)"""
+    
+    def replace(match):
+        found = match.group(0)
+        start, end = match.start(1) - match.start(0), match.end(1) - match.start(0)
+        if match.group(2) is None:
+            return found[:start] + str(convert(int(match.group(1)))) + found[end:]
+        second_start, second_end = match.start(2) - match.start(0), match.end(2) - match.start(0)
+        return (found[:start] + str(convert(int(match.group(1)))) + found[end:second_start]
+                + str(convert(int(match.group(2)))) + found[second_end:])
+    
+    return LINE_REFERENCE.sub(replace, text)
+
+# Finding item: a list entry or heading in the model's answer
+FINDING_START = re.compile(r'^(?:\s{0,2}(?:[-*•]|\d+[.)])|#{1,6})\s+')
+LINE_REFERENCE = re.compile(r'\blines?\s*(?:numbers?)?\s*:?\s*(\d+)(?:\s*(?:-|–|to)\s*(\d+))?', re.IGNORECASE)
+SEVERITY_WORD = re.compile(r'\b(critical|high|medium|moderate|low)\b', re.IGNORECASE)
+CATEGORY_WORD = re.compile(r'\b(error|bug|style|security|performance|cleanup)\b', re.IGNORECASE)
+
+def parse_findings(text, analysis_type):
+    """Split a model answer into findings that cite line numbers.
+
+    Every top-level list item or heading starts a block; indented sub-bullets
+    belong to it. A block counts as a finding when it references a line.
+    """
+    blocks = []
+    for line in text.split('\n'):
+        if FINDING_START.match(line) or not blocks:
+            blocks.append([line])
+        else:
+            blocks[-1].append(line)
+    
+    findings = []
+    for block in blocks:
+        body = '\n'.join(block)
+        line_match = LINE_REFERENCE.search(body)
+        if not line_match:
+            continue
+        line_start = int(line_match.group(1))
+        line_end = int(line_match.group(2) or line_start)
+        
+        severity = 'unrated'
+        severity_match = SEVERITY_WORD.search(body)
+        if severity_match:
+            severity = severity_match.group(1).lower()
+            severity = {'critical': 'high', 'moderate': 'medium'}.get(severity, severity)
+        
+        category = analysis_type
+        if analysis_type == 'all':
+            category_match = CATEGORY_WORD.search(body)
+            category = category_match.group(1).lower() if category_match else 'general'
+            category = {'bug': 'errors', 'error': 'errors'}.get(category, category)
+        
+        message = FINDING_START.sub('', block[0]).replace('**', '').strip()
+        if not message:
+            message = body.replace('**', '').strip().split('\n')[0]
+        findings.append({
+            'category': category,
+            'severity': severity,
+            'line_start': line_start,
+            'line_end': max(line_start, line_end),
+            'message': message[:300],
+        })
+    return findings
+
+def under_path(column, path):
+    """SQL condition and parameters matching path and everything below it.
+
+    LIKE wildcards in the path are escaped, and the prefix ends at a
+    separator so /repo/a doesn't match /repo/abc.
+    """
+    path = os.path.abspath(path)
+    prefix = path.rstrip(os.sep) + os.sep
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"({column} = ? OR {column} LIKE ? ESCAPE '\\')", [path, escaped + '%']
+
+class FindingsDB:
+    """Indexed SQLite store of runs, analyzed files and their findings.
+
+    Every analyzed file gets a row with its content hash and raw result; the
+    findings parsed out of the result are stored with category, severity and
+    line range. Rows of the newest analysis of each path carry latest = 1 so
+    queries and the fix work list don't have to scan the whole history.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            mode TEXT, target TEXT, analysis_type TEXT, model TEXT,
+            started TEXT, finished TEXT
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER REFERENCES runs(id),
+            path TEXT, content_hash TEXT, status TEXT, result TEXT,
+            analyzed_at TEXT, latest INTEGER DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS findings (
+            id INTEGER PRIMARY KEY,
+            file_id INTEGER REFERENCES files(id),
+            run_id INTEGER, path TEXT, content_hash TEXT,
+            category TEXT, severity TEXT, line_start INTEGER, line_end INTEGER,
+            message TEXT, created_at TEXT, resolved_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_files_path ON files(path, latest);
+        CREATE INDEX IF NOT EXISTS idx_files_run ON files(run_id);
+        CREATE INDEX IF NOT EXISTS idx_files_hash ON files(content_hash);
+        CREATE INDEX IF NOT EXISTS idx_findings_filter ON findings(severity, category, created_at);
+        CREATE INDEX IF NOT EXISTS idx_findings_file ON findings(file_id);
+        CREATE INDEX IF NOT EXISTS idx_findings_path ON findings(path);
+        CREATE TABLE IF NOT EXISTS unit_results (
+            key TEXT PRIMARY KEY, findings TEXT, created_at TEXT
+        );
+    """
+    
+    def __init__(self, path=FINDINGS_DB):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        # Shared by the GUI thread and the worker thread, serialized by the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(self.SCHEMA)
+            self.conn.commit()
+    
+    @staticmethod
+    def now():
+        return datetime.datetime.now().isoformat(timespec='seconds')
+    
+    def start_run(self, mode, target, analysis_type, model):
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO runs (mode, target, analysis_type, model, started) VALUES (?, ?, ?, ?, ?)',
+                (mode, os.path.abspath(target or ''), analysis_type, model, self.now()))
+            self.conn.commit()
+            return cursor.lastrowid
+    
+    def finish_run(self, run_id):
+        with self.lock:
+            self.conn.execute('UPDATE runs SET finished = ? WHERE id = ?', (self.now(), run_id))
+            self.conn.commit()
+    
+    @profiled('record')
+    def record_analysis(self, run_id, file_path, status, result, analysis_type, content_hash=None):
+        """Store one analyzed file and the findings parsed from its result"""
+        path = os.path.abspath(file_path)
+        content_hash = content_hash or file_content_hash(path)
+        findings = parse_findings(result, analysis_type) if result else []
+        now = self.now()
+        with self.lock:
+            self.conn.execute('UPDATE files SET latest = 0 WHERE path = ? AND latest = 1', (path,))
+            cursor = self.conn.execute(
+                'INSERT INTO files (run_id, path, content_hash, status, result, analyzed_at, latest) '
+                'VALUES (?, ?, ?, ?, ?, ?, 1)',
+                (run_id, path, content_hash, status, result, now))
+            file_id = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT INTO findings (file_id, run_id, path, content_hash, category, severity, '
+                'line_start, line_end, message, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(file_id, run_id, path, content_hash, f['category'], f['severity'],
+                  f['line_start'], f['line_end'], f['message'], now) for f in findings])
+            self.conn.commit()
+        return len(findings)
+    
+    def cached_result(self, content_hash, analysis_type, model):
+        """Result of an earlier analysis of identical content, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT f.result FROM files f JOIN runs r ON r.id = f.run_id '
+                'WHERE f.content_hash = ? AND r.analysis_type = ? AND r.model = ? AND f.status = ? '
+                'ORDER BY f.id DESC LIMIT 1',
+                (content_hash, analysis_type, model, 'analyzed')).fetchone()
+        return row[0] if row else None
+    
+    def unit_results(self, keys):
+        """Stored findings of analyzed definitions: {key: [finding, ...]}"""
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, findings FROM unit_results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((row[0], json.loads(row[1])) for row in rows)
+        return found
+    
+    def store_unit_results(self, results):
+        """Remember the findings of analyzed definitions, {key: [finding, ...]}"""
+        now = self.now()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO unit_results (key, findings, created_at) VALUES (?, ?, ?)',
+                [(key, json.dumps(findings), now) for key, findings in results.items()])
+            self.conn.commit()
+    
+    def mark_fixed(self, file_path):
+        """A fix rewrote the file: its open findings no longer apply"""
+        with self.lock:
+            self.conn.execute(
+                'UPDATE findings SET resolved_at = ? WHERE resolved_at IS NULL AND file_id IN '
+                '(SELECT id FROM files WHERE path = ? AND latest = 1)',
+                (self.now(), os.path.abspath(file_path)))
+            self.conn.commit()
+    
+    def query(self, severity=None, category=None, since=None, changed_since=None,
+              path_prefix=None, include_resolved=False, limit=1000):
+        """Findings from the latest analysis of each file, filtered.
+
+        since          -- only findings recorded at or after this ISO date
+        changed_since  -- only files whose content differs from the version
+                          analyzed before this ISO date (or that are new since)
+        """
+        sql = ['SELECT fi.* FROM findings fi JOIN files f ON f.id = fi.file_id WHERE f.latest = 1']
+        params = []
+        if severity:
+            sql.append('AND fi.severity = ?')
+            params.append(severity)
+        if category:
+            sql.append('AND fi.category = ?')
+            params.append(category)
+        if since:
+            sql.append('AND fi.created_at >= ?')
+            params.append(since)
+        if path_prefix:
+            condition, condition_params = under_path('fi.path', path_prefix)
+            sql.append('AND ' + condition)
+            params.extend(condition_params)
+        if not include_resolved:
+            sql.append('AND fi.resolved_at IS NULL')
+        if changed_since:
+            sql.append('AND NOT EXISTS (SELECT 1 FROM files old WHERE old.path = f.path '
+                       'AND old.analyzed_at < ? AND old.content_hash = f.content_hash)')
+            params.append(changed_since)
+        sql.append('ORDER BY fi.path, fi.line_start LIMIT ?')
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(' '.join(sql), params)]
+    
+    def recent_runs(self, mode='analysis', limit=50):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT r.*, COUNT(DISTINCT f.id) AS file_count, COUNT(fi.id) AS finding_count '
+                'FROM runs r LEFT JOIN files f ON f.run_id = r.id '
+                'LEFT JOIN findings fi ON fi.file_id = f.id '
+                'WHERE r.mode = ? GROUP BY r.id ORDER BY r.id DESC LIMIT ?',
+                (mode, limit))
+            return [dict(row) for row in rows]
+    
+    def run_results(self, run_id):
+        """(path, status, result) of every file analyzed in a run"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path, status, result FROM files WHERE run_id = ? ORDER BY id', (run_id,))
+            return [tuple(row) for row in rows]
+    
+    def work_list(self, run_id=None, target=None):
+        """Files whose latest analysis has open findings, for fix mode"""
+        sql = ('SELECT DISTINCT f.path FROM files f JOIN findings fi ON fi.file_id = f.id '
+               'WHERE f.latest = 1 AND fi.resolved_at IS NULL')
+        params = []
+        if run_id is not None:
+            sql += ' AND f.run_id = ?'
+            params.append(run_id)
+        if target:
+            condition, condition_params = under_path('f.path', target)
+            sql += ' AND ' + condition
+            params.extend(condition_params)
+        with self.lock:
+            return [row[0] for row in self.conn.execute(sql + ' ORDER BY f.id', params)]
+    
+    def open_finding_counts(self, target=None):
+        """{path: open findings in its latest analysis}, optionally under target"""
+        sql = ('SELECT f.path, COUNT(fi.id) FROM files f JOIN findings fi ON fi.file_id = f.id '
+               'WHERE f.latest = 1 AND fi.resolved_at IS NULL')
+        params = []
+        if target:
+            condition, params = under_path('f.path', target)
+            sql += ' AND ' + condition
+        with self.lock:
+            return dict(self.conn.execute(sql + ' GROUP BY f.path', params).fetchall())
+
+IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+
+# Definition patterns for languages without a parser in the standard library
+_JS_DEFINITIONS = [
+    (re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'), 'function'),
+    (re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)'), 'class'),
+    (re.compile(r'^\s*(?:export\s+)?(?:interface|type|enum)\s+([A-Za-z_$][\w$]*)'), 'type'),
+    (re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*='), 'variable'),
+]
+_C_DEFINITIONS = [
+    (re.compile(r'^(?!\s)(?!(?:if|for|while|switch|return|else)\b)[A-Za-z_][\w\s\*&:<>,]*?[\s\*&]\**([A-Za-z_]\w*)\s*\([^;]*$'), 'function'),
+    (re.compile(r'^\s*(?:typedef\s+)?(?:struct|class|enum|union)\s+([A-Za-z_]\w*)\s*(?:[:{]|$)'), 'type'),
+    (re.compile(r'^\s*#\s*define\s+([A-Za-z_]\w*)'), 'macro'),
+]
+DEFINITION_PATTERNS = {
+    '.js': _JS_DEFINITIONS, '.jsx': _JS_DEFINITIONS, '.ts': _JS_DEFINITIONS, '.tsx': _JS_DEFINITIONS,
+    '.rs': [
+        (re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?(?:extern\s+"[^"]*"\s+)?fn\s+(\w+)'), 'function'),
+        (re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|type|union)\s+(\w+)'), 'type'),
+        (re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:const|static)\s+(?:mut\s+)?(\w+)\s*:'), 'variable'),
+        (re.compile(r'^\s*macro_rules!\s*(\w+)'), 'macro'),
+    ],
+    '.go': [
+        (re.compile(r'^func\s+(?:\([^)]*\)\s*)?(\w+)'), 'function'),
+        (re.compile(r'^type\s+(\w+)'), 'type'),
+        (re.compile(r'^(?:var|const)\s+(\w+)'), 'variable'),
+    ],
+    '.java': [
+        (re.compile(r'^\s*(?:(?:public|protected|private|static|final|abstract|sealed)\s+)*(?:class|interface|enum|record)\s+(\w+)'), 'class'),
+        (re.compile(r'^\s*(?:(?:public|protected|private|static|final|abstract|synchronized|native)\s+)+[\w<>\[\], ?]+\s+(\w+)\s*\('), 'method'),
+    ],
+    '.c': _C_DEFINITIONS, '.h': _C_DEFINITIONS, '.cpp': _C_DEFINITIONS,
+    '.py': [
+        (re.compile(r'^\s*(?:async\s+)?def\s+(\w+)'), 'function'),
+        (re.compile(r'^\s*class\s+(\w+)'), 'class'),
+    ],
+}
+
+# Files that can reference each other's symbols
+LANGUAGE_FAMILIES = [('.py',), ('.js', '.jsx', '.ts', '.tsx'), ('.c', '.h', '.cpp'), ('.rs',), ('.go',), ('.java',)]
+
+# Called by the runtime rather than by name
+ENTRY_POINTS = {'main'}
+
+def extract_symbols(file_path, text):
+    """Return (definitions, references) of one source file.
+
+    definitions: [(name, kind, line)]
+    references:  {name: [count, [line, ...]]}, excluding the defining occurrence
+    Python is parsed with ast; other languages use line-based patterns.
+    """
+    if file_path.endswith('.py'):
+        try:
+            return _python_symbols(ast.parse(text))
+        except (SyntaxError, ValueError):
+            pass  # Fall back to patterns for files that don't parse
+    
+    patterns = DEFINITION_PATTERNS.get(os.path.splitext(file_path)[1], [])
+    definitions = []
+    references = {}
+    for line_no, line in enumerate(text.splitlines(), 1):
+        defined = None
+        for pattern, kind in patterns:
+            match = pattern.match(line)
+            if match:
+                defined = match.group(1)
+                definitions.append((defined, kind, line_no))
+                break
+        for match in IDENTIFIER.finditer(line):
+            name = match.group(0)
+            if name == defined:
+                defined = None  # The definition itself is not a reference
+                continue
+            entry = references.setdefault(name, [0, []])
+            entry[0] += 1
+            if len(entry[1]) < 5:
+                entry[1].append(line_no)
+    return definitions, references
+
+def _python_symbols(tree):
+    definitions = []
+    references = {}
+    
+    def add_reference(name, line_no):
+        entry = references.setdefault(name, [0, []])
+        entry[0] += 1
+        if len(entry[1]) < 5:
+            entry[1].append(line_no)
+    
+    def visit_body(body, in_class):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                definitions.append((node.name, 'method' if in_class else 'function', node.lineno))
+            elif isinstance(node, ast.ClassDef):
+                definitions.append((node.name, 'class', node.lineno))
+                visit_body(node.body, True)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)) and not in_class:
+                for alias in node.names:
+                    if alias.name != '*':
+                        name = alias.asname or alias.name.split('.')[0]
+                        definitions.append((name, 'import', node.lineno))
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and not in_class:
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name):
+                        definitions.append((target.id, 'variable', node.lineno))
+    
+    visit_body(tree.body, False)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Store):
+            add_reference(node.id, node.lineno)
+        elif isinstance(node, ast.Attribute):
+            add_reference(node.attr, node.lineno)
+        elif isinstance(node, ast.ImportFrom):
+            # "from module import name" uses a name defined in another file
+            for alias in node.names:
+                add_reference(alias.name, node.lineno)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and node.value.isidentifier():
+            # __all__ entries, getattr() and registry keys name symbols as strings
+            add_reference(node.value, node.lineno)
+    return definitions, references
+
+def code_units(file_path, text):
+    """Split a file into the definitions a result cache can key on.
+
+    Returns [(name, [line, ...])]: one unit per top-level function and per
+    method of a top-level class, plus '<module>' for all remaining lines.
+    Python is parsed with ast; other languages use the definition patterns
+    and brace matching. A file that can't be split is a single unit.
+    """
+    lines = text.split('\n')
+    spans = []
+    if file_path.endswith('.py'):
+        try:
+            tree = ast.parse(text)
+        except (SyntaxError, ValueError):
+            return [('<module>', list(range(1, len(lines) + 1)))]
+        functions = (ast.FunctionDef, ast.AsyncFunctionDef)
+        
+        def add(node, name):
+            start = min([decorator.lineno for decorator in node.decorator_list] + [node.lineno])
+            spans.append((name, start, node.end_lineno))
+        
+        for node in tree.body:
+            if isinstance(node, functions):
+                add(node, node.name)
+            elif isinstance(node, ast.ClassDef):
+                for member in node.body:
+                    if isinstance(member, functions):
+                        add(member, f"{node.name}.{member.name}")
+    else:
+        # Classes are not units: their methods are, the rest goes to '<module>'
+        patterns = [pattern for pattern, kind in DEFINITION_PATTERNS.get(os.path.splitext(file_path)[1], [])
+                    if kind in ('function', 'method', 'type')]
+        i = 0
+        while i < len(lines):
+            match = next((m for m in (pattern.match(lines[i]) for pattern in patterns) if m), None)
+            end = _brace_block_end(lines, i) if match else None
+            if end is None:
+                i += 1
+                continue
+            spans.append((match.group(1), i + 1, end + 1))
+            i = end + 1
+    
+    units = [(name, list(range(start, end + 1))) for name, start, end in spans]
+    covered = {line for _, numbers in units for line in numbers}
+    rest = [line for line in range(1, len(lines) + 1) if line not in covered]
+    return ([('<module>', rest)] if rest else []) + units
+
+def unit_keys(file_path, text, analysis_type, model):
+    """[(name, lines, key)] of the code units of a file, or None when it
+    doesn't split. Keys ignore whitespace, blank lines and where in the file
+    a definition moved to."""
+    units = code_units(file_path, text)
+    if len(units) < 2:
+        return None
+    lines = text.split('\n')
+    ext = os.path.splitext(file_path)[1]
+    keyed = []
+    for name, numbers in units:
+        normalized = '\n'.join(filter(None, (' '.join(lines[line - 1].split()) for line in numbers)))
+        key = hashlib.sha1(json.dumps([analysis_type, model, ext, name, normalized]).encode()).hexdigest()
+        keyed.append((name, numbers, key))
+    return keyed
+
+def _brace_block_end(lines, start, lookahead=10):
+    """Index of the line closing the brace block of the definition at
+    lines[start], or None for declarations without a body"""
+    depth = 0
+    quote = None
+    in_comment = False
+    for i in range(start, len(lines)):
+        line = lines[i]
+        j = 0
+        while j < len(line):
+            char, pair = line[j], line[j:j + 2]
+            if in_comment:
+                if pair == '*/':
+                    in_comment = False
+                    j += 1
+            elif quote:
+                if char == '\\':
+                    j += 1
+                elif char == quote:
+                    quote = None
+            elif pair == '//':
+                break
+            elif pair == '/*':
+                in_comment = True
+                j += 1
+            elif char in '"`':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth <= 0:
+                    return i if depth == 0 else None
+            elif char == ';' and depth == 0:
+                return None
+            j += 1
+        if quote == '"':
+            quote = None  # Unterminated string; don't let it swallow the file
+        if depth == 0 and i - start >= lookahead:
+            return None
+    return None
+
+def prepare_source(file_path, analysis_type, model, rules, unit_cache, source=None):
+    """Everything analyze_file does to a file before the prompt, as a compact
+    record: read and decode, minify, split into code units.
+
+    Runs in Preprocessor worker processes, or inline when a run has none.
+    The record keeps the full text only when excerpts of it may be needed,
+    and the file_stamp taken before reading it.
+    """
+    started = time.process_time()
+    record = {'path': file_path, 'analysis_type': analysis_type, 'model': model, 'error': None, 'stamp': None}
+    try:
+        if source is None:
+            record['stamp'] = file_stamp(file_path)
+            with profile_stage('read'), open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                source = f.read()
+    except Exception as e:
+        record['error'] = str(e)
+        return record
+    
+    record['empty'] = not source.strip()
+    if not record['empty']:
+        content, line_map = minify_source(source, file_path, rules.get(analysis_type, []))
+        tokens = (estimate_tokens(source), estimate_tokens(content))
+        content, line_map, cut = truncate_source(content, line_map)
+        units = unit_keys(file_path, source, analysis_type, model) if unit_cache else None
+        record.update(size=len(source), content=content, line_map=line_map, cut=cut, tokens=tokens,
+                      units=units, text=source if units else None)
+    record['seconds'] = time.process_time() - started
+    return record
+
+def prepare_chunk(jobs, rules, unit_cache):
+    """Preprocessor work item: prepare_source for (path, analysis_type, model) jobs"""
+    return [prepare_source(path, analysis_type, model, rules, unit_cache) for path, analysis_type, model in jobs]
+
+class Preprocessor:
+    """Prepares a run's files on a pool of processes while the model works.
+
+    Jobs are (path, analysis_type, model). They go to the pool in chunks, in
+    run order, and only as fast as inference takes the records: at most
+    `ahead` records wait at any time, unless a worker thread is already
+    waiting for one. A job whose chunk failed, or whose file changed since
+    it was read, yields None, and the caller prepares that file inline.
+    """
+    
+    MIN_JOBS = 16  # Fewer files don't pay for starting the processes
+    
+    def __init__(self, jobs, rules, unit_cache, workers):
+        self.jobs = jobs
+        self.keys = set(jobs)
+        self.rules = rules
+        self.unit_cache = unit_cache
+        self.workers = workers
+        self.chunk_size = max(1, min(32, len(jobs) // (workers * 4)))
+        self.ahead = max(256, self.chunk_size * workers * 4)
+        self.records = {}
+        self.in_flight = 0  # Chunks submitted and not yet collected
+        self.wanted = 0  # Threads waiting in take()
+        self.closed = False
+        self.finished = False
+        self.cpu_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.prepared = 0
+        self.stale = 0  # Records dropped because their file changed after reading
+        self.started = time.monotonic()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    @classmethod
+    def start(cls, jobs, rules, unit_cache):
+        """A running Preprocessor for jobs, or None when inline is cheaper"""
+        try:
+            workers = len(os.sched_getaffinity(0))
+        except AttributeError:
+            workers = os.cpu_count() or 1
+        jobs = list(dict.fromkeys(jobs))
+        if workers < 2 or len(jobs) < cls.MIN_JOBS:
+            return None
+        return cls(jobs, rules, unit_cache, workers)
+    
+    def run(self):
+        # spawn: forking a process that runs Tk and worker threads isn't safe
+        context = multiprocessing.get_context('spawn')
+        try:
+            with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+                for start in range(0, len(self.jobs), self.chunk_size):
+                    chunk = self.jobs[start:start + self.chunk_size]
+                    with self.cond:
+                        self.cond.wait_for(lambda: self.closed or (
+                            self.in_flight < self.workers * 2
+                            and (self.wanted or len(self.records) + self.in_flight * self.chunk_size < self.ahead)))
+                        if self.closed:
+                            break
+                        self.in_flight += 1
+                    future = pool.submit(prepare_chunk, chunk, self.rules, self.unit_cache)
+                    future.add_done_callback(functools.partial(self.collect, chunk))
+                if self.closed:
+                    pool.shutdown(cancel_futures=True)
+        except Exception:
+            pass  # A broken pool; take() returns None and files are prepared inline
+        finally:
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+    
+    def collect(self, chunk, future):
+        try:
+            records = future.result()
+        except BaseException:
+            records = []
+        with self.cond:
+            for job in chunk:
+                self.records[job] = None
+            for record in records:
+                self.records[(record['path'], record['analysis_type'], record['model'])] = record
+                self.cpu_seconds += record.get('seconds', 0.0)
+                self.prepared += 1
+            self.in_flight -= 1
+            self.cond.notify_all()
+    
+    def take(self, path, analysis_type, model):
+        """The prepared record of a job, waiting for it if needed; None when
+        the job isn't part of this run or couldn't be prepared"""
+        key = (path, analysis_type, model)
+        if key not in self.keys:
+            return None
+        started = time.monotonic()
+        with self.cond:
+            self.wanted += 1
+            self.cond.notify_all()
+            try:
+                self.cond.wait_for(lambda: key in self.records or self.finished)
+            finally:
+                self.wanted -= 1
+            self.keys.discard(key)
+            self.wait_seconds += time.monotonic() - started
+            self.cond.notify_all()
+            record = self.records.pop(key, None)
+        if record is not None and record['stamp'] != file_stamp(path):
+            with self.cond:
+                self.stale += 1
+            return None
+        return record
+    
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+    
+    def describe(self):
+        return (f"Preprocessed {self.prepared} files on {self.workers} processes "
+                f"({self.cpu_seconds:.1f}s CPU over {time.monotonic() - self.started:.1f}s); "
+                f"analysis threads waited {self.wait_seconds:.1f}s in total for them"
+                + (f"; {self.stale} changed since and were read again" if self.stale else ""))
+
+class SymbolIndex:
+    """Repository-wide index of definitions and references, kept in SQLite.
+
+    Files are re-parsed only when their size or mtime changed, so refreshing
+    before every run is cheap. Reachability questions ("is this function used
+    anywhere?") are answered locally and handed to the model as facts.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS symbol_files (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL
+        );
+        CREATE TABLE IF NOT EXISTS definitions (
+            path TEXT, name TEXT, kind TEXT, line INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS symbol_refs (
+            path TEXT, name TEXT, count INTEGER, lines TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_definitions_path ON definitions(path);
+        CREATE INDEX IF NOT EXISTS idx_symbol_refs_name ON symbol_refs(name, path);
+        CREATE INDEX IF NOT EXISTS idx_symbol_refs_path ON symbol_refs(path);
+    """
+    
+    MAX_LISTED = 40      # Symbols per section of a prompt
+    CALL_SITES = 2       # Example call sites shown per used symbol
+    
+    def __init__(self, path=SYMBOLS_DB):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(self.SCHEMA)
+            self.conn.commit()
+    
+    def _forget(self, path):
+        for table in ('symbol_files', 'definitions', 'symbol_refs'):
+            self.conn.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+    
+    def refresh(self, root, files, token=None):
+        """Bring the index for root up to date with files; returns files re-parsed"""
+        condition, params = under_path('path', root)
+        files = {os.path.abspath(f) for f in files}
+        with self.lock:
+            known = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+                'SELECT path, size, mtime FROM symbol_files WHERE ' + condition, params)}
+        
+        parsed = 0
+        for path in sorted(files):
+            if token:
+                token.check()
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    definitions, references = extract_symbols(path, f.read())
+            except OSError:
+                continue
+            with self.lock:
+                self._forget(path)
+                self.conn.execute('INSERT INTO symbol_files VALUES (?, ?, ?)',
+                                  (path, stat.st_size, stat.st_mtime))
+                self.conn.executemany('INSERT INTO definitions VALUES (?, ?, ?, ?)',
+                                      [(path, name, kind, line) for name, kind, line in definitions])
+                self.conn.executemany('INSERT INTO symbol_refs VALUES (?, ?, ?, ?)',
+                                      [(path, name, count, ','.join(map(str, lines)))
+                                       for name, (count, lines) in references.items()])
+                self.conn.commit()
+            parsed += 1
+        
+        with self.lock:
+            for path in set(known) - files:
+                self._forget(path)
+            self.conn.commit()
+        return parsed
+    
+    def usage(self, file_path, root):
+        """Usage of each symbol defined in file_path across the files under root"""
+        path = os.path.abspath(file_path)
+        under_root, root_params = under_path('path', root)
+        with self.lock:
+            definitions = self.conn.execute(
+                'SELECT name, kind, line FROM definitions WHERE path = ? ORDER BY line', (path,)).fetchall()
+            local = {row[0]: row[1] for row in self.conn.execute(
+                'SELECT name, count FROM symbol_refs WHERE path = ?', (path,))}
+            ext = os.path.splitext(path)[1]
+            family = next((f for f in LANGUAGE_FAMILIES if ext in f), (ext,))
+            usage = []
+            for name, kind, line in definitions:
+                if name in ENTRY_POINTS or (name.startswith('__') and name.endswith('__')):
+                    continue  # Called by the language, not by name
+                external = [row for row in self.conn.execute(
+                    'SELECT path, count, lines FROM symbol_refs WHERE name = ? AND path != ? AND ' + under_root,
+                    [name, path] + root_params) if row[0].endswith(family)]
+                usage.append({
+                    'name': name, 'kind': kind, 'line': line,
+                    'internal': local.get(name, 0),
+                    'external': sum(row[1] for row in external),
+                    'external_files': len(external),
+                    'call_sites': [(row[0], int(row[2].split(',')[0])) for row in external[:self.CALL_SITES]],
+                })
+        return usage
+    
+    def prompt_context(self, file_path, root):
+        """Compact usage facts for a prompt, or '' when the file isn't indexed"""
+        usage = self.usage(file_path, root)
+        if not usage:
+            return ''
+        
+        unused_imports = [u for u in usage if u['kind'] == 'import' and not u['internal']]
+        symbols = [u for u in usage if u['kind'] != 'import']
+        unreferenced = [u for u in symbols if not u['internal'] and not u['external']]
+        local_only = [u for u in symbols if u['internal'] and not u['external']]
+        shared = [u for u in symbols if u['external']]
+        
+        def names(items):
+            listed = ', '.join(f"{u['name']} ({u['kind']}, line {u['line']})" for u in items[:self.MAX_LISTED])
+            if len(items) > self.MAX_LISTED:
+                listed += f", and {len(items) - self.MAX_LISTED} more"
+            return listed
+        
+        lines = ["", "", "CROSS-FILE USAGE (from a repository-wide symbol index; rely on it instead of guessing",
+                 "about code outside this file. Names used only dynamically may be missing):"]
+        if unused_imports:
+            lines.append(f"- Imported but never used in this file: {names(unused_imports)}")
+        if unreferenced:
+            lines.append(f"- Not referenced anywhere in the repository: {names(unreferenced)}")
+        if local_only:
+            lines.append(f"- Used only inside this file: {names(local_only)}")
+        if shared:
+            lines.append("- Used from other files (do not remove or rename):")
+            for u in shared[:self.MAX_LISTED]:
+                sites = '; '.join(f"{os.path.relpath(site_path, root)}:{site_line} `{source_line(site_path, site_line)}`"
+                                  for site_path, site_line in u['call_sites'])
+                lines.append(f"  - {u['name']} (line {u['line']}): {u['external']} references in "
+                             f"{u['external_files']} files, e.g. {sites}")
+        return '\n'.join(lines) + '\n\n'
+
+def source_line(file_path, line_no, width=100):
+    """One stripped, shortened source line for quoting in a prompt"""
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            line = next(itertools.islice(f, line_no - 1, None), '')
+    except OSError:
+        return ''
+    line = ' '.join(line.split())
+    return line if len(line) <= width else line[:width - 3] + '...'
+
+# Clone detection compares token streams in which names and literals lose their spelling
+CLONE_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|\d[\w.]*|[A-Za-z_$][\w$]*|[^\s\w]')
+CLONE_KEYWORDS = frozenset("""
+    if else elif for while do return break continue switch case default try except catch finally throw
+    throws raise def fn func function class struct enum impl trait interface let var const mut static pub
+    public private protected import from use package new delete in is not and or None null nil true false
+    True False self this async await yield lambda with as match go defer select
+""".split())
+
+def clone_tokens(lines, ext):
+    """Normalized tokens of source lines: keywords and punctuation are kept,
+    identifiers become 'x', numbers '0' and strings '""'; comment lines drop out"""
+    comment = '#' if ext == '.py' else '//'
+    tokens = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith((comment, '/*', '* ', '*/')):
+            continue
+        for token in CLONE_TOKEN.findall(line):
+            if token in CLONE_KEYWORDS:
+                tokens.append(token)
+            elif token[0].isdigit():
+                tokens.append('0')
+            elif token[0] in '"\'':
+                tokens.append('""')
+            elif token[0].isalpha() or token[0] in '_$':
+                tokens.append('x')
+            else:
+                tokens.append(token)
+    return tokens
+
+# Fixed MinHash permutations (a * x + b) mod p, so stored signatures stay comparable
+MINHASH_PRIME = (1 << 31) - 1
+_minhash_random = random.Random(0xC10E)
+MINHASH_HASHES = [(_minhash_random.randrange(1, MINHASH_PRIME), _minhash_random.randrange(MINHASH_PRIME))
+                  for _ in range(64)]
+
+class CloneIndex:
+    """Near-duplicate functions and blocks across a repository, kept in SQLite.
+
+    Every definition (code_units) and every BLOCK_LINES run of top-level code
+    is reduced to normalized tokens, shingled and summarized by a MinHash
+    signature. Files are re-hashed only when their size or mtime changed.
+    Finding clones bands the signatures (LSH), so only fragments that share
+    a band bucket are compared: near-linear in the size of the repository.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS clone_files (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL
+        );
+        CREATE TABLE IF NOT EXISTS fragments (
+            path TEXT, name TEXT, line_start INTEGER, line_end INTEGER, tokens INTEGER, signature BLOB
+        );
+        CREATE INDEX IF NOT EXISTS idx_fragments_path ON fragments(path);
+    """
+    
+    SHINGLE = 5          # Tokens per shingle
+    PERMUTATIONS = len(MINHASH_HASHES)  # MinHash signature length
+    BANDS = 16           # LSH bands of PERMUTATIONS // BANDS rows each
+    THRESHOLD = 0.8      # Estimated Jaccard similarity that makes a clone
+    MIN_TOKENS = 40      # Smaller fragments are too generic to compare
+    BLOCK_LINES = 25
+    MAX_PAIRS = 5        # Clone pairs attached to one prompt
+    PRIME = MINHASH_PRIME
+    HASHES = MINHASH_HASHES
+    
+    def __init__(self, path=CLONES_DB):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(self.SCHEMA)
+            self.conn.commit()
+        self.pairs = {}  # path -> [(similarity, fragment, other fragment)] of the roots searched
+    
+    @classmethod
+    def fragments(cls, file_path, text):
+        """(name, line_start, line_end, tokens) of the functions and top-level
+        blocks of a file that are big enough to compare"""
+        ext = os.path.splitext(file_path)[1]
+        lines = text.split('\n')
+        spans = []
+        for name, numbers in code_units(file_path, text):
+            if name != '<module>':
+                spans.append((name, numbers))
+                continue
+            # Top-level code: contiguous runs, cut into blocks
+            runs = []
+            for line in numbers:
+                if runs and line == runs[-1][-1] + 1:
+                    runs[-1].append(line)
+                else:
+                    runs.append([line])
+            for run in runs:
+                for start in range(0, len(run), cls.BLOCK_LINES):
+                    spans.append(('', run[start:start + cls.BLOCK_LINES]))
+        
+        fragments = []
+        for name, numbers in spans:
+            tokens = clone_tokens([lines[line - 1] for line in numbers], ext)
+            if len(tokens) >= cls.MIN_TOKENS:
+                fragments.append((name, numbers[0], numbers[-1], tokens))
+        return fragments
+    
+    @classmethod
+    def signature(cls, tokens):
+        """MinHash signature of the token shingles, as array('I')"""
+        shingles = {zlib.crc32(' '.join(tokens[i:i + cls.SHINGLE]).encode())
+                    for i in range(len(tokens) - cls.SHINGLE + 1)}
+        if np is not None:
+            values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+            a = np.array([a for a, _ in cls.HASHES], dtype=np.uint64)[:, None]
+            b = np.array([b for _, b in cls.HASHES], dtype=np.uint64)[:, None]
+            return array('I', ((a * values + b) % cls.PRIME).min(axis=1).tolist())
+        return array('I', [min((a * value + b) % cls.PRIME for value in shingles) for a, b in cls.HASHES])
+    
+    def _forget(self, path):
+        for table in ('clone_files', 'fragments'):
+            self.conn.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+    
+    def refresh(self, root, files, token=None):
+        """Bring the index for root up to date with files; returns files re-hashed"""
+        condition, params = under_path('path', root)
+        files = {os.path.abspath(f) for f in files}
+        with self.lock:
+            known = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+                'SELECT path, size, mtime FROM clone_files WHERE ' + condition, params)}
+        
+        hashed = 0
+        for path in sorted(files):
+            if token:
+                token.check()
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    fragments = self.fragments(path, f.read())
+            except OSError:
+                continue
+            rows = [(path, name, start, end, len(tokens), self.signature(tokens).tobytes())
+                    for name, start, end, tokens in fragments]
+            with self.lock:
+                self._forget(path)
+                self.conn.execute('INSERT INTO clone_files VALUES (?, ?, ?)', (path, stat.st_size, stat.st_mtime))
+                self.conn.executemany('INSERT INTO fragments VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.conn.commit()
+            hashed += 1
+        
+        with self.lock:
+            for path in set(known) - files:
+                self._forget(path)
+            self.conn.commit()
+        return hashed
+    
+    def find(self, root, token=None):
+        """Clone groups under root, largest duplication first.
+
+        Returns [{'similarity', 'fragments': [(path, name, start, end, tokens)]}]
+        and remembers each fragment's clone pairs for prompt_context().
+        """
+        root_prefix = os.path.abspath(root).rstrip(os.sep) + os.sep
+        condition, params = under_path('path', root)
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path, name, line_start, line_end, tokens, signature FROM fragments WHERE ' + condition,
+                params).fetchall()
+        fragments = [row[:5] for row in rows]
+        signatures = [array('I', row[5]) for row in rows]
+        
+        # Fragments sharing any band bucket are candidates; each bucket is
+        # checked against its first member, so big buckets stay linear
+        width = 4 * self.PERMUTATIONS // self.BANDS
+        buckets = {}
+        for i, row in enumerate(rows):
+            for band in range(self.BANDS):
+                buckets.setdefault((band, row[5][band * width:(band + 1) * width]), []).append(i)
+        
+        parent = list(range(len(rows)))
+        
+        def find_root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        
+        checked = set()
+        pairs = []
+        for members in buckets.values():
+            if token:
+                token.check()
+            first = members[0]
+            for other in members[1:]:
+                if (first, other) in checked:
+                    continue
+                checked.add((first, other))
+                similarity = sum(x == y for x, y in zip(signatures[first], signatures[other])) / self.PERMUTATIONS
+                if similarity >= self.THRESHOLD:
+                    pairs.append((similarity, first, other))
+                    parent[find_root(other)] = find_root(first)
+        
+        self.pairs = {path: found for path, found in self.pairs.items() if not path.startswith(root_prefix)}
+        for similarity, first, other in pairs:
+            for one, two in ((first, other), (other, first)):
+                self.pairs.setdefault(fragments[one][0], []).append((similarity, fragments[one], fragments[two]))
+        
+        members = {}
+        scores = {}
+        for similarity, first, other in pairs:
+            group = find_root(first)
+            members.setdefault(group, set()).update((first, other))
+            scores.setdefault(group, []).append(similarity)
+        groups = [{'similarity': statistics.mean(scores[group]),
+                   'fragments': sorted(fragments[i] for i in indexes)}
+                  for group, indexes in members.items()]
+        # Tokens beyond the first copy are what a refactoring would remove
+        groups.sort(key=lambda g: -sum(sorted(f[4] for f in g['fragments'])[:-1]))
+        return groups
+    
+    def prompt_context(self, file_path, root):
+        """The most relevant clone pairs of a file for a prompt, or ''"""
+        pairs = self.pairs.get(os.path.abspath(file_path))
+        if not pairs:
+            return ''
+        best = {}
+        for similarity, fragment, other in pairs:
+            key = fragment[1:4]
+            if key not in best or (similarity, other[4]) > (best[key][0], best[key][2][4]):
+                best[key] = (similarity, fragment, other)
+        chosen = sorted(best.values(), key=lambda p: -p[0] * p[1][4])[:self.MAX_PAIRS]
+        
+        def describe(fragment):
+            return f"`{fragment[1]}`" if fragment[1] else "top-level code"
+        
+        lines = ["", "", "NEAR-DUPLICATE CODE (from a repository-wide clone search on normalized tokens, so names",
+                 "and literals may differ). Report real duplication and say which copy should reuse the other:"]
+        for similarity, fragment, other in chosen:
+            where = ("elsewhere in this file" if other[0] == fragment[0]
+                     else f"in {os.path.relpath(other[0], root)}")
+            lines.append(f"- {describe(fragment)} (lines {fragment[2]}-{fragment[3]}) is {similarity:.0%} similar to "
+                         f"{describe(other)} {where} (lines {other[2]}-{other[3]}): "
+                         f"`{source_line(other[0], other[2])}`")
+        return '\n'.join(lines) + '\n\n'
+
+class EmbeddingIndex:
+    """Embedding vectors of repository chunks for related-code retrieval.
+
+    Files are cut into CHUNK_LINES-line chunks; vectors are L2-normalized and
+    stored as a float16 matrix (vectors.npy) with a JSON row table next to it.
+    Refreshing re-embeds only chunks whose text hash is new, and unchanged
+    files are not even re-chunked. Search is a blocked matrix product.
+    """
+    
+    CHUNK_LINES = 40
+    BATCH = 32          # Texts per embedding request
+    SEARCH_BLOCK = 32768
+    SAVE_EVERY = 50     # Batches between checkpoints during a long first build
+    MIN_SCORE = 0.2     # Cosine similarity below this is noise, not context
+    
+    def __init__(self, root, model=EMBED_MODEL, directory=EMBEDDINGS_DIR):
+        self.root = os.path.abspath(root)
+        self.model = model
+        key = hashlib.sha1(f"{self.root}\0{model}".encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, key)
+        self.rows = []       # [path, start_line, end_line, text_hash]
+        self.file_hashes = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float16)
+        self.matrix = None   # float32 copy of vectors used for search
+        try:
+            with open(os.path.join(self.path, 'rows.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(self.path, 'vectors.npy'))
+            if len(vectors) == len(meta['rows']):
+                self.rows, self.file_hashes, self.vectors = meta['rows'], meta['files'], vectors
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, 'vectors.tmp.npy')
+        np.save(tmp_path, self.vectors)
+        os.replace(tmp_path, os.path.join(self.path, 'vectors.npy'))
+        tmp_path = os.path.join(self.path, 'rows.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model, 'root': self.root, 'rows': self.rows, 'files': self.file_hashes}, f)
+        os.replace(tmp_path, os.path.join(self.path, 'rows.json'))
+    
+    def chunks(self, path, text):
+        """(start_line, end_line, embedded_text) for each non-blank chunk"""
+        lines = text.splitlines()
+        relative = os.path.relpath(path, self.root)
+        for start in range(0, len(lines), self.CHUNK_LINES):
+            body = '\n'.join(lines[start:start + self.CHUNK_LINES])
+            if body.strip():
+                yield start + 1, min(len(lines), start + self.CHUNK_LINES), f"{relative}\n{body}"
+    
+    def refresh(self, client, files, token, progress=None):
+        """Bring the index up to date with files; returns the number of chunks embedded"""
+        by_hash = {row[3]: i for i, row in enumerate(self.rows)}
+        by_path = {}
+        for i, row in enumerate(self.rows):
+            by_path.setdefault(row[0], []).append(i)
+        
+        rows, sources, pending = [], [], []   # sources: old row index or None (pending)
+        file_hashes = {}
+        for path in files:
+            token.check()
+            path = os.path.abspath(path)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            digest = git_blob_hash(data)
+            file_hashes[path] = digest
+            if self.file_hashes.get(path) == digest and path in by_path:
+                for i in by_path[path]:
+                    rows.append(self.rows[i])
+                    sources.append(i)
+                continue
+            for start, end, text in self.chunks(path, data.decode('utf-8', errors='ignore')):
+                text_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                rows.append([path, start, end, text_hash])
+                if text_hash in by_hash:
+                    sources.append(by_hash[text_hash])
+                else:
+                    sources.append(None)
+                    pending.append((len(rows) - 1, text))
+        
+        # Build the new matrix from reused rows, then fill in new vectors batch by batch
+        dimension = self.vectors.shape[1] if len(self.vectors) else 0
+        vectors = None
+        if dimension:
+            vectors = np.zeros((len(rows), dimension), dtype=np.float16)
+            reused = [(i, source) for i, source in enumerate(sources) if source is not None]
+            if reused:
+                targets, old = zip(*reused)
+                vectors[list(targets)] = self.vectors[list(old)]
+        
+        embedded = 0
+        try:
+            for batch_no, offset in enumerate(range(0, len(pending), self.BATCH), 1):
+                token.check()
+                batch = pending[offset:offset + self.BATCH]
+                result = np.asarray(client.embed(self.model, [text for _, text in batch], token), dtype=np.float32)
+                result /= np.maximum(np.linalg.norm(result, axis=1, keepdims=True), 1e-12)
+                if vectors is None:
+                    vectors = np.zeros((len(rows), result.shape[1]), dtype=np.float16)
+                vectors[[i for i, _ in batch]] = result
+                embedded += len(batch)
+                if progress:
+                    progress(embedded, len(pending))
+                if batch_no % self.SAVE_EVERY == 0:
+                    self.commit(rows, vectors, file_hashes, offset + len(batch), pending)
+        finally:
+            # Keep whatever was embedded, even when the run is stopped
+            if vectors is not None:
+                self.commit(rows, vectors, file_hashes, embedded, pending)
+        return embedded
+    
+    def commit(self, rows, vectors, file_hashes, embedded_upto, pending):
+        """Adopt the rows that have vectors; files with missing chunks are redone next time"""
+        missing = {rows[i][0] for i, _ in pending[embedded_upto:]}
+        keep = [i for i, row in enumerate(rows) if row[0] not in missing]
+        self.rows = [rows[i] for i in keep]
+        self.vectors = vectors[keep]
+        self.matrix = None
+        self.file_hashes = {path: digest for path, digest in file_hashes.items() if path not in missing}
+        self.save()
+    
+    def search(self, queries, k):
+        """Top-k (row, score) lists for each row of a (q, d) query matrix"""
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.matrix is None or len(self.matrix) != len(self.vectors):
+            # float16 has no BLAS path; widen once and reuse for every query
+            self.matrix = self.vectors.astype(np.float32)
+        scores = np.empty((len(queries), len(self.matrix)), dtype=np.float32)
+        for offset in range(0, len(self.matrix), self.SEARCH_BLOCK):
+            block = self.matrix[offset:offset + self.SEARCH_BLOCK]
+            scores[:, offset:offset + len(block)] = queries @ block.T
+        k = min(k, scores.shape[1])
+        if not k:
+            return [[] for _ in queries]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q, candidates in enumerate(top):
+            order = candidates[np.argsort(-scores[q, candidates])]
+            results.append([(int(i), float(scores[q, i])) for i in order])
+        return results
+    
+    def related(self, file_path, token_budget, k=20):
+        """Chunks from other files most similar to file_path, within a token budget"""
+        path = os.path.abspath(file_path)
+        own = [i for i, row in enumerate(self.rows) if row[0] == path]
+        if not own:
+            return []
+        query = self.vectors[own].astype(np.float32).mean(axis=0)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        
+        picked, used = [], 0
+        for i, score in self.search(query[None, :], k + len(own))[0]:
+            row_path, start, end, _ = self.rows[i]
+            if row_path == path or score < self.MIN_SCORE:
+                continue
+            try:
+                with open(row_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    text = ''.join(itertools.islice(f, start - 1, end))
+            except OSError:
+                continue
+            cost = estimate_tokens(text)
+            if used + cost > token_budget:
+                continue
+            picked.append((row_path, start, end, score, text))
+            used += cost
+        return picked
+
+class GitObjectReader:
+    """Reads objects through one long-lived `git cat-file --batch` process.
+
+    Works on bare clones and never touches a working tree; several readers
+    (one per process or ref) can share a repository.
+    """
+    
+    def __init__(self, repo):
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=repo,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.lock = threading.Lock()
+    
+    def read(self, object_id):
+        """Return (type, data) of an object"""
+        with self.lock:
+            self.process.stdin.write(object_id.encode('ascii') + b'\n')
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().split()
+            if not header:
+                raise OSError("git cat-file exited")
+            if header[-1] == b'missing':
+                raise KeyError(object_id)
+            data = self.process.stdout.read(int(header[2]))
+            self.process.stdout.read(1)  # Newline after the contents
+            return header[1].decode('ascii'), data
+    
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+class RunJournal:
+    """Append-only per-run journal so interrupted runs can resume where they stopped.
+
+    The first line is a header with the run metadata and the ordered work list,
+    followed by one record per finished file. An active run lives at
+    runs/<key>.jsonl; once the run completes it is archived with a timestamp.
+    """
+    
+    # Outcomes that are worth another attempt when a run is resumed
+    RETRY_STATUSES = ('timeout', 'error')
+    
+    def __init__(self, path):
+        self.path = path
+        self.header = {}
+        self.records = {}
+        self.lock = threading.Lock()  # Pool workers record concurrently
+        self.load()
+    
+    @staticmethod
+    def run_key(mode, target, analysis_type, model):
+        """Stable key identifying 'the same run' across restarts"""
+        raw = json.dumps([mode, os.path.abspath(target or ''), analysis_type, model])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+    
+    @classmethod
+    def active_path(cls, key):
+        return os.path.join(JOURNAL_DIR, f"{key}.jsonl")
+    
+    @classmethod
+    def find_incomplete(cls, key):
+        """Return the unfinished journal for this run key, if any"""
+        path = cls.active_path(key)
+        if os.path.exists(path):
+            journal = cls(path)
+            if journal.header:
+                return journal
+        return None
+    
+    @classmethod
+    def latest_incomplete(cls, mode):
+        """Return the most recently touched unfinished journal for a mode"""
+        if not os.path.isdir(JOURNAL_DIR):
+            return None
+        candidates = []
+        for name in os.listdir(JOURNAL_DIR):
+            # Archived journals carry a timestamp suffix: <key>-<stamp>.jsonl
+            if name.endswith('.jsonl') and '-' not in name:
+                path = os.path.join(JOURNAL_DIR, name)
+                candidates.append((os.path.getmtime(path), path))
+        for _, path in sorted(candidates, reverse=True):
+            journal = cls(path)
+            if journal.header.get('mode') == mode:
+                return journal
+        return None
+    
+    @classmethod
+    def create(cls, key, mode, target, analysis_type, model, files, **extra):
+        """Start a fresh journal for a run, replacing any abandoned one"""
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        path = cls.active_path(key)
+        header = {
+            'type': 'header',
+            'key': key,
+            'mode': mode,
+            'target': target,
+            'analysis_type': analysis_type,
+            'model': model,
+            'files': list(files),
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        header.update(extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return cls(path)
+    
+    def load(self):
+        """Read header and file records, tolerating a torn last line"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line from a crash
+                    if entry.get('type') == 'header':
+                        self.header = entry
+                    elif entry.get('type') == 'file':
+                        self.records[entry['path']] = entry
+        except OSError:
+            pass
+    
+    @property
+    def files(self):
+        return self.header.get('files', [])
+    
+    @profiled('record')
+    def append(self, entry):
+        """Append one entry and force it to disk so a reboot can't lose it"""
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def record(self, file_path, status, result='', **extra):
+        """Record a finished file together with its result text"""
+        try:
+            stat = os.stat(file_path)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = None, None
+        entry = {
+            'type': 'file',
+            'path': file_path,
+            'status': status,
+            'result': result,
+            'size': size,
+            'mtime': mtime,
+            'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        entry.update(extra)
+        self.append(entry)
+        self.records[file_path] = entry
+    
+    def is_done(self, file_path):
+        """True if the file was finished and has not changed on disk since"""
+        entry = self.records.get(file_path)
+        if not entry or entry.get('status') in self.RETRY_STATUSES:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return True  # File is gone; nothing left to do for it
+        return entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime
+    
+    def mark_complete(self):
+        """Archive the journal once every file has been processed"""
+        self.append({'type': 'complete',
+                     'finished': datetime.datetime.now().isoformat(timespec='seconds')})
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        archived = self.path[:-len('.jsonl')] + f"-{stamp}.jsonl"
+        os.replace(self.path, archived)
+        self.path = archived
+    
+    def discard(self):
+        """Drop an unfinished journal the user chose not to resume"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class Cancelled(BaseException):
+    """The run was stopped by the user.
+
+    Derives from BaseException (like KeyboardInterrupt) so the many
+    'except Exception' blocks around per-file work don't swallow it.
+    """
+
+class CancelToken:
+    """Cooperative cancellation shared by every stage of a run.
+
+    Long-running work either polls check() at safe points or registers an
+    on_cancel() callback that interrupts it (killing a git process, shutting
+    down an HTTP stream so the server stops generating).
+    """
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = {}
+        self.next_handle = 0
+    
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+    
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks = list(self.callbacks.values())
+            self.callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # Interrupting is best effort; the worker still sees the flag
+    
+    def on_cancel(self, callback):
+        """Run callback on cancel (immediately if already cancelled); returns a handle"""
+        with self.lock:
+            if not self.event.is_set():
+                self.next_handle += 1
+                self.callbacks[self.next_handle] = callback
+                return self.next_handle
+        callback()
+        return None
+    
+    def remove(self, handle):
+        with self.lock:
+            self.callbacks.pop(handle, None)
+    
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled()
+    
+    def sleep(self, seconds):
+        """Sleep that wakes up (and raises) as soon as the run is cancelled"""
+        if self.event.wait(seconds):
+            raise Cancelled()
+
+class StreamSanitizer:
+    """Single-pass removal of terminal control sequences from streamed text.
+
+    Escape sequences may be split across chunks, so the parser state carries
+    over between feed() calls.
+    """
+    
+    SPINNER_CHARS = frozenset('⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏')
+    
+    def __init__(self):
+        self.state = 'text'
+    
+    def feed(self, chunk):
+        out = []
+        state = self.state
+        for ch in chunk:
+            if state == 'text':
+                if ch == '\x1b':
+                    state = 'esc'
+                elif ch in self.SPINNER_CHARS or (ch < ' ' and ch not in '\n\t'):
+                    pass
+                else:
+                    out.append(ch)
+            elif state == 'esc':
+                # CSI and string sequences (OSC, DCS, ...) run until their terminator;
+                # other escapes are intermediate bytes (ESC ( B) then one final byte
+                if ' ' <= ch <= '/':
+                    state = 'intermediate'
+                else:
+                    state = {'[': 'csi', ']': 'osc', 'P': 'osc', 'X': 'osc', '^': 'osc', '_': 'osc'}.get(ch, 'text')
+            elif state == 'intermediate':
+                if not ' ' <= ch <= '/':
+                    state = 'text'
+            elif state == 'csi':
+                if '@' <= ch <= '~':
+                    state = 'text'
+            elif state == 'osc':
+                if ch == '\x07':
+                    state = 'text'
+                elif ch == '\x1b':
+                    state = 'esc'
+        self.state = state
+        return ''.join(out)
+
+class CodeBlockStream:
+    """Sanitizes a streamed fix answer and tracks ``` fences line by line.
+
+    feed() returns True once the first fenced block has closed, so the
+    client can stop the generation instead of paying for the commentary
+    models like to add after the code.
+    """
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """Forget everything seen so far (the request is being retried)"""
+        self.sanitizer = StreamSanitizer()
+        self.pending = ''
+        self.in_block = False
+        self.lines = []
+        self.code = None
+    
+    def feed(self, chunk):
+        if self.code is None:
+            self.pending += self.sanitizer.feed(chunk)
+            while self.code is None and '\n' in self.pending:
+                line, self.pending = self.pending.split('\n', 1)
+                self.take_line(line)
+        return self.code is not None
+    
+    def take_line(self, line):
+        stripped = line.strip()
+        if not self.in_block:
+            if stripped.startswith('```'):
+                self.in_block = True
+                self.lines = []
+        elif stripped == '```':
+            self.code = '\n'.join(self.lines)
+        else:
+            self.lines.append(line)
+    
+    def finish(self):
+        """The code of the first complete block, or None"""
+        if self.code is None and self.in_block:
+            # The closing fence may be the last thing sent, without a newline
+            tail = self.pending.rstrip()
+            if tail.endswith('```'):
+                self.lines.append(tail[:-3])
+                self.code = '\n'.join(self.lines).rstrip('\n')
+        return self.code
+
+class OllamaError(Exception):
+    """A request to the Ollama server failed"""
+
+class OllamaTransientError(OllamaError):
+    """Failure worth retrying (server starting, busy or connection dropped)"""
+
+class OllamaTimeout(OllamaError):
+    """The request ran past its deadline"""
+
+class CircuitOpenError(OllamaError):
+    """The model failed too often recently; requests are paused"""
+
+class ThroughputModel:
+    """Per-model prompt-eval/generation rates learned from Ollama's timing stats.
+
+    Rates are smoothed with an exponential moving average and saved to
+    throughput.json so deadlines are right from the first request of a run.
+    """
+    
+    # Modest numbers for a model we have never measured (~6 minutes for a big file)
+    DEFAULT_RATES = {'prompt_rate': 100.0, 'gen_rate': 10.0, 'load_time': 30.0, 'output_tokens': 500.0}
+    SMOOTHING = 0.3
+    MIN_DEADLINE = 30
+    MAX_DEADLINE = 1800
+    
+    def __init__(self, path=THROUGHPUT_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.models = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.models = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    def rates(self, model):
+        rates = dict(self.DEFAULT_RATES)
+        rates.update(self.models.get(model, {}))
+        return rates
+    
+    def update(self, model, stats):
+        """Fold the timing stats of a finished request into the model's rates"""
+        samples = {}
+        if stats.get('prompt_eval_count') and stats.get('prompt_eval_duration'):
+            samples['prompt_rate'] = stats['prompt_eval_count'] / (stats['prompt_eval_duration'] / 1e9)
+        if stats.get('eval_count') and stats.get('eval_duration'):
+            samples['gen_rate'] = stats['eval_count'] / (stats['eval_duration'] / 1e9)
+            samples['output_tokens'] = stats['eval_count']
+        # A warm model reports a near-zero load time; only learn from real loads
+        if stats.get('load_duration', 0) > 1e9:
+            samples['load_time'] = stats['load_duration'] / 1e9
+        if not samples:
+            return
+        
+        with self.lock:
+            current = self.models.setdefault(model, {})
+            for key, value in samples.items():
+                if key in current:
+                    current[key] = (1 - self.SMOOTHING) * current[key] + self.SMOOTHING * value
+                else:
+                    current[key] = value
+            current['samples'] = current.get('samples', 0) + 1
+            self.save()
+    
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.models, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # Learning is best effort
+    
+    def expected_seconds(self, model, prompt_tokens, output_tokens, include_load=False):
+        rates = self.rates(model)
+        seconds = prompt_tokens / rates['prompt_rate'] + output_tokens / rates['gen_rate']
+        if include_load:
+            seconds += rates['load_time']
+        return seconds
+    
+    def deadline(self, model, prompt_tokens, output_tokens, include_load=False):
+        """Generous but bounded deadline: twice the expected time plus slack"""
+        expected = self.expected_seconds(model, prompt_tokens, output_tokens, include_load)
+        return min(self.MAX_DEADLINE, max(self.MIN_DEADLINE, expected * 2 + 15))
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class RunProgress:
+    """Progress and ETA of a run, weighted by each file's predicted cost.
+
+    A file's cost comes from its prompt size and the model's learned
+    prompt-eval and generation rates (throughput.json), so the estimate is
+    meaningful from the first file and follows the rates as they are
+    updated. Predictions are scaled by how the finished files compared with
+    theirs. Items are (path, model) in processing order.
+    """
+    
+    PROMPT_OVERHEAD = 250  # Instructions and context around the code
+    MAX_SOURCE_CHARS = 15000  # analyze_file truncates longer files
+    
+    def __init__(self, throughput, items, warm=()):
+        self.throughput = throughput
+        self.remaining = {}  # path -> (model, prompt tokens), in processing order
+        for file_path, model in items:
+            self.remaining[file_path] = (model, self.prompt_tokens(file_path))
+        self.total = len(self.remaining)
+        self.cold = {model for model, _ in self.remaining.values()} - set(warm)
+        self.started = self.last_finished = time.monotonic()
+        self.done_files = 0
+        self.done_tokens = 0
+        self.done_predicted = 0.0
+        # The correction starts out as if three average files had gone as predicted
+        costs = [self.predict(model, tokens) for model, tokens in self.remaining.values()]
+        self.prior = 3 * sum(costs) / len(costs) if costs else 0.0
+    
+    @classmethod
+    def prompt_tokens(cls, file_path):
+        """Expected prompt size of analyzing a file"""
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        return min(size, cls.MAX_SOURCE_CHARS) // 4 + cls.PROMPT_OVERHEAD
+    
+    def predict(self, model, prompt_tokens):
+        output_tokens = self.throughput.rates(model)['output_tokens']
+        return self.throughput.expected_seconds(model, prompt_tokens, output_tokens)
+    
+    def finish(self, file_path):
+        model, prompt_tokens = self.remaining.pop(file_path, (None, 0))
+        if model is None:
+            return
+        self.done_files += 1
+        self.done_tokens += prompt_tokens + int(self.throughput.rates(model)['output_tokens'])
+        self.done_predicted += self.predict(model, prompt_tokens)
+        if model in self.cold:
+            self.cold.discard(model)
+            self.done_predicted += self.throughput.rates(model)['load_time']
+        self.last_finished = time.monotonic()
+    
+    def correction(self):
+        """How much slower (>1) or faster than predicted the finished files were"""
+        if not self.done_predicted:
+            return 1.0
+        elapsed = self.last_finished - self.started
+        return (elapsed + self.prior) / (self.done_predicted + self.prior)
+    
+    def remaining_seconds(self):
+        costs = [self.predict(model, tokens) for model, tokens in self.remaining.values()]
+        pending_models = {model for model, _ in self.remaining.values()}
+        loads = sum(self.throughput.rates(model)['load_time'] for model in self.cold & pending_models)
+        factor = self.correction()
+        # Credit the file in flight with the time it has been running, up to its prediction
+        in_flight = min(time.monotonic() - self.last_finished, costs[0] * factor) if costs else 0.0
+        return max(0.0, (sum(costs) + loads) * factor - in_flight)
+    
+    def fraction(self):
+        elapsed = time.monotonic() - self.started
+        remaining = self.remaining_seconds()
+        return 1.0 if not self.remaining else elapsed / max(elapsed + remaining, 1e-9)
+    
+    def describe(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        text = f"{self.done_files}/{self.total} files, {100 * self.fraction():.0f}%"
+        if self.remaining:
+            text += f", ETA {format_duration(self.remaining_seconds())}"
+        if self.done_files:
+            text += f" | {self.done_files / elapsed:.2f} files/s, {self.done_tokens / elapsed:.0f} tok/s"
+        return text
+
+class OptionProfiles:
+    """Per-host, per-model Ollama options applied to every request.
+
+    num_ctx is sized to the prompt plus the expected answer, rounded up to a
+    power of two. Ollama reloads a model whenever num_ctx changes, so a
+    model keeps its current context while it is big enough and not wildly
+    oversized. num_thread and num_batch come from calibration (or a hand
+    edit of profiles.json); num_predict is capped per analysis type.
+    """
+    
+    DEFAULTS = {
+        'min_ctx': 2048,
+        'max_ctx': 32768,
+        'num_predict': {'errors': 1024, 'style': 1024, 'security': 1024,
+                        'performance': 1024, 'cleanup': 1024, 'all': 2048},
+    }
+    OVERSIZE = 4  # Keep the loaded context while it is at most this many times too big
+    
+    def __init__(self, path=PROFILES_FILE, host=OLLAMA_HOST):
+        self.path = path
+        self.host = self.host_key(host)
+        self.lock = threading.Lock()
+        self.current_ctx = {}
+        self.profiles = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.profiles = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    @staticmethod
+    def host_key(host):
+        """Local servers are keyed by machine name so a shared home directory works"""
+        name = urllib.parse.urlsplit(host if '://' in host else 'http://' + host).hostname or ''
+        if name in ('127.0.0.1', 'localhost', '::1', '0.0.0.0'):
+            return socket.gethostname()
+        return name
+    
+    def profile(self, model):
+        """Effective settings: defaults, then host-wide, then model-specific"""
+        host = self.profiles.get(self.host, {})
+        settings = dict(self.DEFAULTS)
+        settings['num_predict'] = dict(self.DEFAULTS['num_predict'])
+        for layer in (host.get('defaults', {}), host.get('models', {}).get(model, {})):
+            for key, value in layer.items():
+                if key == 'num_predict':
+                    settings['num_predict'].update(value)
+                else:
+                    settings[key] = value
+        return settings
+    
+    def num_predict(self, model, analysis_type):
+        return self.profile(model)['num_predict'].get(analysis_type)
+    
+    def options(self, model, prompt_tokens, output_tokens, analysis_type=None):
+        """Options for one request"""
+        settings = self.profile(model)
+        options = {}
+        cap = settings['num_predict'].get(analysis_type)
+        if cap:
+            options['num_predict'] = cap
+            output_tokens = min(output_tokens, cap)
+        
+        # chars/4 undercounts some code; leave a margin for the template too
+        needed = int(prompt_tokens * 1.1) + output_tokens + 64
+        ctx = settings['min_ctx']
+        while ctx < needed and ctx < settings['max_ctx']:
+            ctx *= 2
+        ctx = min(ctx, settings['max_ctx'])
+        with self.lock:
+            current = self.current_ctx.get(model)
+            if current and needed <= current <= max(ctx, needed * self.OVERSIZE) and current <= settings['max_ctx']:
+                ctx = current
+            self.current_ctx[model] = ctx
+        options['num_ctx'] = ctx
+        
+        for key in ('num_thread', 'num_batch', 'num_gpu'):
+            if settings.get(key):
+                options[key] = settings[key]
+        return options
+    
+    def save_model(self, model, values):
+        with self.lock:
+            host = self.profiles.setdefault(self.host, {})
+            host.setdefault('models', {}).setdefault(model, {}).update(values)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.profiles, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+
+class CircuitBreaker:
+    """Stops sending work to a model after repeated consecutive failures.
+
+    After FAILURE_THRESHOLD failures in a row the circuit opens and requests
+    fail fast for COOLDOWN seconds; the next request after that is a trial
+    that either closes the circuit again or re-opens it. Only one trial runs
+    at a time; one that never reports back (cancelled) expires after another
+    COOLDOWN. Shared by the pool's worker threads, serialized by the lock.
+    """
+    
+    FAILURE_THRESHOLD = 3
+    COOLDOWN = 120
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+    
+    def check(self, model):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = self.COOLDOWN - (now - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"{model} failed {self.failures} times in a row; paused for another {remaining:.0f}s")
+            if self.trial_started is not None and now - self.trial_started < self.COOLDOWN:
+                raise CircuitOpenError(
+                    f"{model} failed {self.failures} times in a row; waiting for a trial request")
+            self.trial_started = now
+    
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started = None
+    
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.FAILURE_THRESHOLD:
+                self.opened_at = time.monotonic()
+                self.trial_started = None
+
+class AdaptiveLimiter:
+    """In-flight request limit that follows the server's capacity (AIMD).
+
+    The limit grows by one request per window of `limit` completions while
+    per-token latency stays near the model's baseline. It halves when
+    latency inflates, when requests wait in the server's queue, or on a
+    timeout or transient failure, at most once per window. The baseline is
+    the best recent seconds per output token of each model, slowly
+    forgotten so it tracks changes of hardware or quantization.
+    """
+    
+    MAXIMUM = 8
+    INFLATION = 1.5  # Per-token latency over baseline that counts as overload
+    QUEUE_SECONDS = 1.0  # Server-side wait that counts as queueing
+    
+    def __init__(self, initial=1, maximum=MAXIMUM):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.baseline = {}  # model -> seconds per output token
+        self.last_decrease = 0.0
+        self.history = []  # (time, limit, reason) whenever the whole-number limit changes
+        self.record_change('start')
+    
+    def record_change(self, reason):
+        self.history.append((time.time(), int(self.limit), reason))
+        del self.history[:-200]
+    
+    @profiled('queued')
+    def acquire(self, token):
+        """Wait for a free slot; returns the time the request started"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                token.check()
+                self.condition.wait(0.25)
+            self.in_flight += 1
+        return time.monotonic()
+    
+    def release(self, started, model=None, stats=None, failure=None):
+        """Free the slot and adjust the limit from how the request went"""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+            reason = failure or self.overload(model, stats or {})
+            before = int(self.limit)
+            if reason:
+                # Requests started before the last decrease saw the old limit
+                if started >= self.last_decrease:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = time.monotonic()
+            elif stats:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            if int(self.limit) != before:
+                self.record_change(reason or 'latency flat')
+    
+    def overload(self, model, stats):
+        if not stats.get('eval_count') or not stats.get('eval_duration') or stats.get('load_duration', 0) > 1e9:
+            return None  # Early stops and model loads say nothing about contention
+        if stats.get('total_duration') and stats['elapsed'] - stats['total_duration'] / 1e9 > self.QUEUE_SECONDS:
+            return 'queueing'
+        per_token = stats['eval_duration'] / 1e9 / stats['eval_count']
+        baseline = self.baseline.get(model)
+        self.baseline[model] = per_token if baseline is None else min(per_token, baseline * 1.02)
+        if baseline is not None and per_token > baseline * self.INFLATION:
+            return 'latency'
+        return None
+    
+    def summary(self, since=0.0):
+        """Limit at the start, peak, now and backoffs since a point in time,
+        with the most recent changes"""
+        before = [entry for entry in self.history if entry[0] < since]
+        changes = before[-1:] + [entry for entry in self.history if entry[0] >= since]
+        backoffs = {}
+        for (_, previous, _), (_, limit, reason) in zip(changes, changes[1:]):
+            if limit < previous:
+                backoffs[reason] = backoffs.get(reason, 0) + 1
+        text = (f"started at {changes[0][1]}, peak {max(limit for _, limit, _ in changes)}, "
+                f"now {int(self.limit)}")
+        if backoffs:
+            text += f"; {sum(backoffs.values())} backoffs (" + ', '.join(
+                f"{reason} {count}" for reason, count in sorted(backoffs.items())) + ")"
+        recent = [str(limit) + (f" ({reason})" if reason in backoffs else '') for _, limit, reason in changes[-8:]]
+        return text + f"; recent: {'→'.join(recent)}"
+
+class OllamaClient:
+    """Streaming client for the Ollama HTTP API with adaptive deadlines.
+
+    Each request's deadline comes from the prompt size and the model's learned
+    throughput. Transient failures are retried with full-jitter exponential
+    backoff, and a per-model circuit breaker stops hammering a failing model.
+    A cancel token aborts the open connection, which makes the server stop
+    generating for it.
+    """
+    
+    MAX_ATTEMPTS = 4
+    BACKOFF_BASE = 1.0
+    BACKOFF_CAP = 30.0
+    KEEP_ALIVE = 300  # Ollama unloads idle models after 5 minutes by default
+    
+    def __init__(self, host=OLLAMA_HOST, throughput=None, profiles=None):
+        if not host.startswith(('http://', 'https://')):
+            host = 'http://' + host
+        self.base_url = host.rstrip('/')
+        self.throughput = throughput or ThroughputModel()
+        self.profiles = profiles or OptionProfiles(host=host)
+        self.breakers = {}
+        self.last_used = {}
+        self.load_totals = {}  # model -> [loads, seconds] observed by this client
+        self.limiter = AdaptiveLimiter()  # Shared by every thread using this client
+        self.lock = threading.Lock()
+    
+    def is_warm(self, model):
+        last = self.last_used.get(model)
+        return last is not None and time.monotonic() - last < self.KEEP_ALIVE
+    
+    def deadline_for(self, model, prompt, output_tokens):
+        return self.throughput.deadline(model, estimate_tokens(prompt), output_tokens,
+                                        include_load=not self.is_warm(model))
+    
+    def generate(self, model, prompt, output_tokens=ANALYSIS_OUTPUT_TOKENS, options=None, token=None,
+                 stream=None, analysis_type=None, limiter=None):
+        """Run one generation and return (text, stats)
+
+        stream (e.g. a CodeBlockStream) is fed every chunk; the generation is
+        stopped as soon as its feed() returns True. Without explicit options
+        the host/model profile sizes them for this prompt and analysis_type.
+        limiter replaces the client's shared AdaptiveLimiter for this request.
+        """
+        token = token or CancelToken()
+        limiter = limiter or self.limiter
+        with self.lock:
+            breaker = self.breakers.setdefault(model, CircuitBreaker())
+        breaker.check(model)
+        
+        if options is None:
+            options = self.profiles.options(model, estimate_tokens(prompt), output_tokens, analysis_type)
+        if options.get('num_predict'):
+            output_tokens = min(output_tokens, options['num_predict'])
+        deadline = self.deadline_for(model, prompt, output_tokens)
+        for attempt in range(self.MAX_ATTEMPTS):
+            token.check()
+            if stream is not None:
+                stream.reset()
+            started = limiter.acquire(token)
+            try:
+                text, stats = self.stream_generate(model, prompt, deadline, options, token, stream)
+            except OllamaTransientError:
+                limiter.release(started, failure='server error')
+                if attempt + 1 >= self.MAX_ATTEMPTS:
+                    breaker.failure()
+                    raise
+                token.sleep(random.uniform(0, min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt)))
+                continue
+            except OllamaError as e:
+                limiter.release(started, failure='timeout' if isinstance(e, OllamaTimeout) else None)
+                breaker.failure()
+                raise
+            except BaseException:
+                limiter.release(started)
+                raise
+            limiter.release(started, model, stats)
+            
+            breaker.success()
+            self.last_used[model] = time.monotonic()
+            self.throughput.update(model, stats)
+            load_seconds = stats.get('load_duration', 0) / 1e9
+            if load_seconds > 1:  # Warm requests report a few milliseconds
+                with self.lock:
+                    totals = self.load_totals.setdefault(model, [0, 0.0])
+                    totals[0] += 1
+                    totals[1] += load_seconds
+            return text, stats
+    
+    def get_json(self, path, timeout=10):
+        connection = self.open_connection(timeout)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise OllamaTransientError(str(e))
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise OllamaError(f"HTTP {response.status}: {body.decode('utf-8', errors='ignore').strip()}")
+        return json.loads(body)
+    
+    def installed_models(self):
+        return [m['name'] for m in self.get_json('/api/tags').get('models', [])]
+    
+    def loaded_models(self):
+        """Models currently resident in the server's memory"""
+        return [m['name'] for m in self.get_json('/api/ps').get('models', [])]
+    
+    def unload(self, model):
+        """Free a model's memory now instead of after the keep-alive period"""
+        self.post_json('/api/generate', {'model': model, 'keep_alive': 0}, 60, CancelToken())
+        self.last_used.pop(model, None)
+    
+    @profiled('embedding')
+    def embed(self, model, texts, token=None, timeout=300):
+        """Embedding vectors for a batch of texts"""
+        token = token or CancelToken()
+        try:
+            return self.post_json('/api/embed', {'model': model, 'input': texts}, timeout, token)['embeddings']
+        except OllamaError as e:
+            if 'HTTP 404' not in str(e):
+                raise
+        # Servers before /api/embed only take one prompt per request
+        return [self.post_json('/api/embeddings', {'model': model, 'prompt': text}, timeout, token)['embedding']
+                for text in texts]
+    
+    def post_json(self, path, payload, timeout, token):
+        """Non-streaming POST that the cancel token can abort"""
+        connection = self.open_connection(timeout)
+        handle = None
+        try:
+            try:
+                connection.connect()
+                sock = connection.sock
+                handle = token.on_cancel(lambda: self.abort_socket(sock))
+                connection.request('POST', path, body=json.dumps(payload).encode('utf-8'),
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                body = response.read()
+            except TimeoutError:
+                token.check()
+                raise OllamaTimeout(f"no response within {timeout:.0f}s")
+            except (OSError, http.client.HTTPException) as e:
+                token.check()
+                raise OllamaTransientError(str(e))
+            token.check()
+            if response.status != 200:
+                raise OllamaError(f"HTTP {response.status}: {body.decode('utf-8', errors='ignore').strip()}")
+            return json.loads(body)
+        finally:
+            if handle is not None:
+                token.remove(handle)
+            connection.close()
+    
+    def open_connection(self, timeout):
+        parts = urllib.parse.urlsplit(self.base_url)
+        if parts.scheme == 'https':
+            return http.client.HTTPSConnection(parts.hostname, parts.port or 443, timeout=timeout)
+        return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    
+    @staticmethod
+    def abort_socket(sock):
+        """Shut the socket down; this wakes a blocked read in the worker thread"""
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    @profiled('inference')
+    def stream_generate(self, model, prompt, deadline, options=None, token=None, stream=None):
+        """Single streaming /api/generate request bounded by a deadline"""
+        token = token or CancelToken()
+        payload = {'model': model, 'prompt': prompt, 'stream': True}
+        if options:
+            payload['options'] = options
+        body = json.dumps(payload).encode('utf-8')
+        
+        started = time.monotonic()
+        connection = self.open_connection(deadline)
+        handle = None
+        try:
+            try:
+                connection.connect()
+                # Registered before the request: headers only arrive once the
+                # model has loaded and evaluated the prompt, which can take a while.
+                # Keep our own reference; http.client drops connection.sock early.
+                sock = connection.sock
+                handle = token.on_cancel(lambda: self.abort_socket(sock))
+                connection.request('POST', '/api/generate', body=body,
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+            except TimeoutError:
+                token.check()
+                raise OllamaTimeout(f"no response within {deadline:.0f}s")
+            except (OSError, http.client.HTTPException) as e:
+                token.check()
+                raise OllamaTransientError(str(e))
+            
+            if response.status != 200:
+                detail = response.read().decode('utf-8', errors='ignore').strip()
+                if response.status >= 500 or response.status == 429:
+                    raise OllamaTransientError(f"HTTP {response.status}: {detail}")
+                raise OllamaError(f"HTTP {response.status}: {detail}")
+            
+            parts = []
+            stats = {}
+            try:
+                for line in response:
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if 'error' in chunk:
+                        raise OllamaError(chunk['error'])
+                    parts.append(chunk.get('response', ''))
+                    if chunk.get('done'):
+                        stats = chunk
+                        break
+                    if stream is not None and stream.feed(parts[-1]):
+                        # Closing the connection makes the server stop generating
+                        stats = {'stopped_early': True, 'chunks': len(parts)}
+                        break
+                    if time.monotonic() - started > deadline:
+                        raise OllamaTimeout(f"generation exceeded {deadline:.0f}s deadline")
+            except TimeoutError:
+                token.check()
+                raise OllamaTimeout(f"generation stalled past {deadline:.0f}s deadline")
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                token.check()
+                raise OllamaTransientError(f"stream interrupted: {e}")
+            
+            token.check()
+            if not stats:
+                raise OllamaTransientError("stream ended before the model finished")
+            stats['elapsed'] = time.monotonic() - started
+            return ''.join(parts), stats
+        finally:
+            if handle is not None:
+                token.remove(handle)
+            connection.close()
+
+def calibrate(client, model, token=None, report=print):
+    """Measure generation and prompt-eval speed for num_thread and num_batch
+    candidates on this machine and save the fastest into the model's profile"""
+    token = token or CancelToken()
+    # ~1500 tokens of code-like text, so prompt evaluation is measurable
+    prompt = "Summarize what this code does in one sentence.\n\n" + "\n".join(
+        f"def step_{i}(values):\n    return [v * {i} + {i % 7} for v in values if v > {i}]" for i in range(120))
+    
+    def measure(options):
+        options = dict(options, num_ctx=4096, num_predict=64, seed=1, temperature=0)
+        _, stats = client.generate(model, prompt, output_tokens=64, options=options, token=token)
+        prompt_rate = stats.get('prompt_eval_count', 0) / max(stats.get('prompt_eval_duration', 0) / 1e9, 1e-9)
+        gen_rate = stats.get('eval_count', 0) / max(stats.get('eval_duration', 0) / 1e9, 1e-9)
+        return prompt_rate, gen_rate
+    
+    report(f"Loading {model}...")
+    measure({})
+    
+    cpus = os.cpu_count() or 4
+    threads = sorted({max(1, cpus * n // 4) for n in (1, 2, 3, 4)})
+    best_threads, best_gen = None, 0.0
+    for num_thread in threads:
+        token.check()
+        prompt_rate, gen_rate = measure({'num_thread': num_thread})
+        report(f"  num_thread={num_thread:<3} prompt {prompt_rate:7.1f} tok/s  output {gen_rate:6.1f} tok/s")
+        if gen_rate > best_gen:
+            best_threads, best_gen = num_thread, gen_rate
+    
+    best_batch, best_prompt = None, 0.0
+    for num_batch in (128, 256, 512, 1024):
+        token.check()
+        prompt_rate, gen_rate = measure({'num_thread': best_threads, 'num_batch': num_batch})
+        report(f"  num_batch={num_batch:<5} prompt {prompt_rate:7.1f} tok/s  output {gen_rate:6.1f} tok/s")
+        if prompt_rate > best_prompt:
+            best_batch, best_prompt = num_batch, prompt_rate
+    
+    values = {'num_thread': best_threads, 'num_batch': best_batch,
+              'calibrated': datetime.datetime.now().isoformat(timespec='seconds')}
+    client.profiles.save_model(model, values)
+    report(f"Saved for {model} on {client.profiles.host}: num_thread={best_threads}, num_batch={best_batch}")
+    return values
+
+def format_request_stats(stats):
+    """One-line timing summary of a finished generation"""
+    parts = [f"{stats.get('elapsed', 0):.1f}s"]
+    if stats.get('stopped_early'):
+        parts.append(f"stopped after {stats['chunks']} chunks at the closing fence")
+    if stats.get('prompt_eval_count') and stats.get('prompt_eval_duration'):
+        rate = stats['prompt_eval_count'] / (stats['prompt_eval_duration'] / 1e9)
+        parts.append(f"prompt {stats['prompt_eval_count']} tok @ {rate:.0f}/s")
+    if stats.get('eval_count') and stats.get('eval_duration'):
+        rate = stats['eval_count'] / (stats['eval_duration'] / 1e9)
+        parts.append(f"output {stats['eval_count']} tok @ {rate:.1f}/s")
+    return ', '.join(parts)
+
+class OllamaTape:
+    """Recorded exchanges with an Ollama server, for deterministic replay.
+
+    The file is gzip-compressed JSON lines, one exchange per line: request
+    key, model, options, status and the response as (seconds since the
+    request arrived, chunk) pairs. Prompts are stored only as part of the key
+    hash. Exchanges are appended as they finish, so an interrupted recording
+    is still usable.
+    """
+    
+    # Sampling options change with the learned profiles; they're recorded
+    # but don't take part in matching
+    UNKEYED_FIELDS = ('options',)
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.exchanges = {}  # key -> recorded exchanges, in recording order
+        self.served = {}  # key -> how many of them were replayed
+        self.hits = 0
+        self.misses = 0
+    
+    @classmethod
+    def request_key(cls, method, path, body):
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = body.decode('utf-8', errors='replace')
+        if isinstance(payload, dict):
+            payload = {k: v for k, v in payload.items() if k not in cls.UNKEYED_FIELDS}
+        canonical = json.dumps([method, path, payload], sort_keys=True)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self.exchanges.setdefault(exchange['key'], []).append(exchange)
+        return self
+    
+    def append(self, exchange):
+        with self.lock:
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(json.dumps(exchange, separators=(',', ':')) + '\n')
+    
+    def lookup(self, key):
+        """Next recorded exchange for a request; repeats the last one when exhausted"""
+        with self.lock:
+            recorded = self.exchanges.get(key)
+            if not recorded:
+                self.misses += 1
+                return None
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+            self.hits += 1
+            return recorded[min(index, len(recorded) - 1)]
+
+class TapeServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for the Ollama server that records or replays a tape.
+
+    Recording forwards every request to the real server and saves the
+    streamed response with its timing. Replaying serves the recorded
+    responses with the original timing divided by speed (0 = no delays);
+    requests that aren't on the tape get HTTP 404. Point the GUI, the
+    command-line modes or the shell scripts (through OLLAMA_HOST) at
+    `address`.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, tape, replay, listen='127.0.0.1:0', upstream=OLLAMA_HOST, speed=1.0):
+        host, _, port = listen.rpartition(':')
+        super().__init__((host or '127.0.0.1', int(port or 0)), TapeHandler)
+        self.tape = tape
+        self.replay = replay
+        self.upstream = OllamaClient(upstream)
+        self.speed = speed
+    
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+    
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+    
+    def summary(self):
+        if self.replay:
+            return f"Replayed {self.tape.hits} requests from {self.tape.path}, {self.tape.misses} not on the tape"
+        return f"Recorded to {self.tape.path}"
+
+class TapeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        self.exchange()
+    
+    def do_POST(self):
+        self.exchange()
+    
+    def do_DELETE(self):
+        self.exchange()
+    
+    def do_HEAD(self):
+        # The ollama CLI checks that the server is up with HEAD /
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def exchange(self):
+        started = time.monotonic()
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        key = OllamaTape.request_key(self.command, self.path, body)
+        try:
+            if self.server.replay:
+                self.replay(key, started)
+            else:
+                self.record(key, body, started)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading (e.g. at a closing code fence)
+    
+    def replay(self, key, started):
+        exchange = self.server.tape.lookup(key)
+        if exchange is None:
+            if self.path == '/' and self.command == 'GET':
+                exchange = {'status': 200, 'chunks': [[0, 'Ollama is running']]}
+            else:
+                exchange = {'status': 404, 'chunks': [[0, json.dumps({'error': 'request is not on the tape'})]]}
+        self.start_response(exchange['status'], exchange.get('content_type'))
+        for offset, chunk in exchange['chunks']:
+            if self.server.speed > 0:
+                delay = started + offset / self.server.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self.write_chunk(chunk.encode('utf-8'))
+        self.end_response()
+    
+    def record(self, key, body, started):
+        connection = self.server.upstream.open_connection(3600)
+        try:
+            connection.request(self.command, self.path, body=body or None,
+                               headers={'Content-Type': self.headers.get('Content-Type', 'application/json')})
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            self.start_response(502)
+            self.write_chunk(json.dumps({'error': f"upstream: {e}"}).encode('utf-8'))
+            self.end_response()
+            return
+        
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        exchange = {'key': key, 'method': self.command, 'path': self.path,
+                    'model': payload.get('model'), 'options': payload.get('options'),
+                    'status': response.status, 'content_type': response.getheader('Content-Type'), 'chunks': []}
+        try:
+            self.start_response(response.status, exchange['content_type'])
+            for line in response:
+                exchange['chunks'].append([round(time.monotonic() - started, 4), line.decode('utf-8', errors='replace')])
+                self.write_chunk(line)
+            self.end_response()
+        finally:
+            connection.close()
+            # Saved even when the client hung up early; replay then ends at the same point
+            self.server.tape.append(exchange)
+    
+    def start_response(self, status, content_type=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'application/json; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+    
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+    
+    def end_response(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+class FileWatcher:
+    """Reports saved code files under a directory, debounced and coalesced.
+
+    Uses inotify (through ctypes) on Linux and falls back to polling
+    modification times elsewhere, or when the inotify watch limit is reached.
+    callback gets the list of changed paths once none of them has seen a new
+    event for `debounce` seconds; repeated writes to a file count once.
+    """
+    
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    
+    def __init__(self, target, callback, debounce=0.5, poll_interval=2.0):
+        self.target = os.path.abspath(target)
+        self.root = self.target if os.path.isdir(self.target) else os.path.dirname(self.target)
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.pending = {}  # path -> time of its last event
+        self.stopped = threading.Event()
+        self.mode = None
+    
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+    
+    def stop(self):
+        self.stopped.set()
+    
+    def wanted(self, path):
+        if self.target != self.root:
+            return path == self.target
+        return path.endswith(CODE_EXTENSIONS)
+    
+    def note(self, path):
+        if self.wanted(path):
+            self.pending[path] = time.monotonic()
+    
+    def flush(self):
+        """Hand over the paths that have been quiet for the debounce period"""
+        now = time.monotonic()
+        ready = [path for path, last in self.pending.items() if now - last >= self.debounce]
+        for path in ready:
+            del self.pending[path]
+        if ready:
+            try:
+                self.callback(ready)
+            except Exception:
+                pass  # A failing consumer mustn't stop the watch
+    
+    def wait_time(self, idle):
+        if not self.pending:
+            return idle
+        return max(0.05, self.debounce - (time.monotonic() - max(self.pending.values())))
+    
+    def walk(self, top):
+        for root, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            yield root, files
+    
+    def run(self):
+        try:
+            self.mode = 'inotify'
+            self.run_inotify()
+        except (OSError, AttributeError):
+            # No inotify (not Linux) or out of watches
+            self.mode = 'polling'
+            self.run_polling()
+    
+    def run_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directories = {}  # watch descriptor -> directory
+        
+        def add_tree(top, report_files=False):
+            for root, files in self.walk(top):
+                wd = libc.inotify_add_watch(fd, os.fsencode(root), self.WATCH_MASK)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {root}")
+                directories[wd] = root
+                if report_files:
+                    # Files written before the new directory's watch was in place
+                    for name in files:
+                        self.note(os.path.join(root, name))
+        
+        try:
+            add_tree(self.root)
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([fd], [], [], self.wait_time(0.5))
+                if ready:
+                    try:
+                        data = os.read(fd, 65536)
+                    except BlockingIOError:
+                        data = b''
+                    offset = 0
+                    while offset < len(data):
+                        wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                        name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                        offset += 16 + length
+                        directory = directories.get(wd)
+                        if mask & self.IN_IGNORED:
+                            directories.pop(wd, None)
+                        if directory is None or not name:
+                            continue
+                        path = os.path.join(directory, os.fsdecode(name))
+                        if mask & self.IN_ISDIR:
+                            if mask & (self.IN_CREATE | self.IN_MOVED_TO) and os.path.basename(path) not in SKIP_DIRS:
+                                add_tree(path, report_files=True)
+                        elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                            # IN_CREATE alone is followed by IN_CLOSE_WRITE once written
+                            self.note(path)
+                self.flush()
+        finally:
+            os.close(fd)
+    
+    def snapshot(self):
+        state = {}
+        for root, files in self.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                if self.wanted(path):
+                    try:
+                        info = os.stat(path)
+                    except OSError:
+                        continue
+                    state[path] = (info.st_mtime_ns, info.st_size)
+        return state
+    
+    def run_polling(self):
+        previous = self.snapshot()
+        next_poll = time.monotonic() + self.poll_interval
+        while not self.stopped.wait(min(self.wait_time(self.poll_interval), max(0.05, next_poll - time.monotonic()))):
+            if time.monotonic() >= next_poll:
+                current = self.snapshot()
+                for path, state in current.items():
+                    if previous.get(path) != state:
+                        self.note(path)
+                previous = current
+                next_poll = time.monotonic() + self.poll_interval
+            self.flush()
+
+class FileScheduler:
+    """Orders a work list so the most useful results arrive first.
+
+    Scorers are callables mapping a file path to a value in [0, 1]; they are
+    combined as a weighted sum and files are processed highest score first.
+    Pinned paths (files or directories) always go to the front, in the order
+    they were pinned. Ties keep discovery order so runs stay reproducible.
+    """
+    
+    def __init__(self, pinned=None):
+        self.scorers = []
+        self.pinned = [os.path.realpath(p) for p in (pinned or [])]
+    
+    def add_scorer(self, name, func, weight=1.0):
+        """Register a scoring function; higher weight means more influence"""
+        self.scorers.append((name, func, weight))
+    
+    def score(self, file_path):
+        total = 0.0
+        for _, func, weight in self.scorers:
+            try:
+                total += weight * func(file_path)
+            except Exception:
+                pass  # A broken scorer shouldn't stop the run
+        return total
+    
+    def pin_rank(self, file_path):
+        """Index of the first pin covering this path, or None"""
+        real = os.path.realpath(file_path)
+        for rank, pin in enumerate(self.pinned):
+            if real == pin or real.startswith(pin + os.sep):
+                return rank
+        return None
+    
+    def order(self, files, token=None):
+        pinned, rest = [], []
+        for index, file_path in enumerate(files):
+            if token and index % 256 == 0:
+                token.check()
+            rank = self.pin_rank(file_path)
+            item = (-self.score(file_path), index, file_path)
+            if rank is None:
+                rest.append(item)
+            else:
+                pinned.append((rank,) + item)
+        pinned.sort()
+        rest.sort()
+        return [item[-1] for item in pinned] + [item[-1] for item in rest]
+    
+    def describe(self):
+        names = ', '.join(f"{name}×{weight:g}" for name, _, weight in self.scorers)
+        return names or 'discovery order'
+
+class RunLog:
+    """Append-only on-disk log of the output pane.
+
+    Only every CHECKPOINT-th line offset is held in memory, plus one marker
+    per analyzed file, so memory stays flat however long a run gets. Reading
+    a window seeks to the nearest checkpoint and skips forward.
+    """
+    
+    CHECKPOINT = 256
+    KEEP = 20  # Older logs are deleted when a new one starts
+    
+    def __init__(self, directory=LOG_DIR):
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self.path = os.path.join(directory, f"{stamp}.log")
+        self.lock = threading.RLock()  # LogView holds it across a render
+        self.writer = open(self.path, 'ab')
+        self.reader = open(self.path, 'rb')
+        self.size = 0
+        self.line_count = 1
+        self.checkpoints = array('Q', [0])
+        self.markers = []  # (line, label) for jump-to-file
+        
+        for old in sorted(Path(directory).glob('*.log'))[:-self.KEEP]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+    
+    def append(self, text, marker=None):
+        """Write text; returns the log size after it"""
+        data = text.encode('utf-8')
+        with self.lock:
+            if marker:
+                self.markers.append((self.line_count - 1, marker))
+            self.writer.write(data)
+            self.writer.flush()
+            start = 0
+            while True:
+                newline = data.find(b'\n', start)
+                if newline < 0:
+                    break
+                # line_count is the index of the line this newline starts
+                if self.line_count % self.CHECKPOINT == 0:
+                    self.checkpoints.append(self.size + newline + 1)
+                self.line_count += 1
+                start = newline + 1
+            self.size += len(data)
+            return self.size
+    
+    def lines(self, first, count):
+        """Return (first, lines) for up to count lines starting at first"""
+        with self.lock:
+            first = max(0, min(first, self.line_count - 1))
+            block = first // self.CHECKPOINT
+            self.reader.seek(self.checkpoints[block])
+            for _ in range(first - block * self.CHECKPOINT):
+                self.reader.readline()
+            lines = []
+            for _ in range(count):
+                line = self.reader.readline()
+                if not line:
+                    break
+                lines.append(line.decode('utf-8', errors='replace'))
+            return first, lines
+    
+    def copy_to(self, file_path):
+        with self.lock:
+            self.writer.flush()
+            shutil.copyfile(self.path, file_path)
+    
+    def close(self):
+        with self.lock:
+            self.writer.close()
+            self.reader.close()
+
+class LogView:
+    """Virtualized, read-only view of a RunLog.
+
+    The Text widget only holds the visible lines plus MARGIN on either side;
+    the scrollbar is driven by the log's line count. While the view follows
+    the end of the log, new output is inserted directly and lines scrolled
+    off the top are dropped. Worker threads post() output; it reaches the
+    widget from drain(), which runs on the Tk thread.
+    """
+    
+    MARGIN = 200
+    DRAIN_MS = 50
+    
+    def __init__(self, parent, **text_options):
+        self.text = tk.Text(parent, **text_options)
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.linespace = tkfont.Font(font=self.text.cget('font')).metrics('linespace')
+        
+        self.log = None
+        self.start = 0   # Log line shown on the first widget line
+        self.loaded = 0  # Number of log lines in the widget
+        self.top = 0     # First visible log line
+        self.follow = True
+        self.shown = 0   # Log size covered by the widget (rendered or appended)
+        self.pending = queue.Queue()  # (log, size after, text) from post()
+        
+        self.text.bind('<MouseWheel>', lambda e: self.scroll_by(-3 if e.delta > 0 else 3))
+        self.text.bind('<Button-4>', lambda e: self.scroll_by(-3))
+        self.text.bind('<Button-5>', lambda e: self.scroll_by(3))
+        self.text.bind('<Up>', lambda e: self.scroll_by(-1))
+        self.text.bind('<Down>', lambda e: self.scroll_by(1))
+        self.text.bind('<Prior>', lambda e: self.scroll_by(-self.visible_lines()))
+        self.text.bind('<Next>', lambda e: self.scroll_by(self.visible_lines()))
+        self.text.bind('<Control-Home>', lambda e: self.scroll_to(0) or 'break')
+        self.text.bind('<Control-End>', lambda e: self.scroll_to(self.log.line_count) or 'break')
+        self.text.after(self.DRAIN_MS, self.drain)
+    
+    def set_log(self, log):
+        self.log = log
+        self.text.delete(1.0, tk.END)
+        self.start = self.loaded = self.top = self.shown = 0
+        self.follow = True
+        self.update_scrollbar()
+    
+    def visible_lines(self):
+        height = self.text.winfo_height()
+        if height <= 1:
+            return int(self.text.cget('height'))
+        return max(1, height // self.linespace)
+    
+    def widget_lines(self):
+        return int(self.text.index('end-1c').split('.')[0])
+    
+    def post(self, log, size, text):
+        """Queue text just written to log (which reached size); any thread"""
+        self.pending.put((log, size, text))
+    
+    def drain(self):
+        """Show posted text; reschedules itself on the Tk thread"""
+        parts = []
+        while True:
+            try:
+                log, size, text = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            # Skip output of a replaced log or already covered by a render
+            if log is self.log and size > self.shown:
+                parts.append(text)
+                self.shown = size
+        if parts:
+            self.append(''.join(parts))
+        self.text.after(self.DRAIN_MS, self.drain)
+    
+    def append(self, text):
+        """Show newly logged text (the log itself was already written)"""
+        if self.follow:
+            self.text.insert(tk.END, text)
+            self.loaded = self.widget_lines()
+            excess = self.loaded - (self.visible_lines() + 2 * self.MARGIN)
+            if excess > 0:
+                self.text.delete(1.0, f"{excess + 1}.0")
+                self.start += excess
+                self.loaded -= excess
+            self.text.see(tk.END)
+            self.top = max(0, self.log.line_count - self.visible_lines())
+        self.update_scrollbar()
+    
+    def render(self, first, count):
+        with self.log.lock:
+            self.shown = self.log.size
+            self.start, lines = self.log.lines(first, count)
+        self.text.delete(1.0, tk.END)
+        text = ''.join(lines)
+        if self.start + len(lines) < self.log.line_count - 1:
+            # Not the tail: keep the widget from growing a blank last line
+            text = text[:-1]
+        self.text.insert(tk.END, text)
+        self.loaded = self.widget_lines()
+    
+    def scroll_by(self, lines):
+        self.scroll_to(self.top + lines)
+        return 'break'
+    
+    def scroll_to(self, line):
+        total = self.log.line_count
+        visible = self.visible_lines()
+        self.top = max(0, min(line, total - visible))
+        
+        if self.top >= total - visible:
+            # Back at the end: resume following new output
+            if not self.follow or self.start + self.loaded < total:
+                self.follow = True
+                first = max(0, total - visible - self.MARGIN)
+                self.render(first, total - first)
+            self.text.see(tk.END)
+        else:
+            self.follow = False
+            if self.top < self.start or self.top + visible > self.start + self.loaded:
+                self.render(max(0, self.top - self.MARGIN), visible + 2 * self.MARGIN)
+            self.text.yview(f"{self.top - self.start + 1}.0")
+        self.update_scrollbar()
+    
+    def on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.log.line_count))
+        elif args[0] == 'scroll':
+            step = self.visible_lines() if args[2] == 'pages' else 1
+            self.scroll_by(int(args[1]) * step)
+    
+    def update_scrollbar(self):
+        total = max(1, self.log.line_count if self.log else 1)
+        visible = self.visible_lines()
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + visible) / total))
+
+ANALYSIS_TYPES = ('errors', 'style', 'security', 'performance', 'cleanup', 'all')
+
+def stratified_mean(strata, confidence=0.95):
+    """Stratified estimate of a per-file mean: (mean, CI half-width, share of
+    files in sampled strata). strata is a list of (files in stratum,
+    sampled values); unsampled strata are left out of the estimate."""
+    covered = [(size, values) for size, values in strata if values]
+    total = sum(size for size, _ in covered)
+    if not total:
+        return 0.0, 0.0, 0.0
+    # Strata with one sample borrow the pooled variance
+    pooled = [v for _, values in covered for v in values]
+    pooled_var = statistics.variance(pooled) if len(pooled) > 1 else 0.0
+    mean = variance = 0.0
+    for size, values in covered:
+        weight = size / total
+        mean += weight * statistics.fmean(values)
+        s2 = statistics.variance(values) if len(values) > 1 else pooled_var
+        variance += weight ** 2 * (1 - len(values) / size) * s2 / len(values)
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    return mean, z * variance ** 0.5, total / sum(size for size, _ in strata)
+
+def wilson_interval(hits, n, confidence=0.95):
+    """Confidence interval of a proportion that behaves with small samples"""
+    if not n:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = hits / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * ((p * (1 - p) + z * z / (4 * n)) / n) ** 0.5 / (1 + z * z / n)
+    return max(0.0, center - half), min(1.0, center + half)
+
+def parse_shard(text):
+    """'i/N' -> (i, N) with 1 <= i <= N"""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text or '')
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"shard must look like i/N with 1 <= i <= N: {text!r}")
+    return int(match.group(1)), int(match.group(2))
+
+def assign_shards(costs, count):
+    """Split {key: cost} into count shards of similar total cost.
+
+    Greedy largest-first onto the lightest shard, with ties broken by key
+    and shard number, so every machine computes the same split from the
+    same file list. Returns {key: shard number (1-based)}.
+    """
+    totals = [0] * count
+    assignment = {}
+    for key, cost in sorted(costs.items(), key=lambda item: (-item[1], item[0])):
+        shard = min(range(count), key=lambda n: (totals[n], n))
+        totals[shard] += cost
+        assignment[key] = shard + 1
+    return assignment
+
+HUNK_HEADER = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+def parse_staged_hunks(diff_text, merge_gap=5):
+    """(path, first line, last line) of added/changed line ranges in a
+    zero-context diff; hunks closer than merge_gap lines are merged"""
+    hunks = []
+    path = None
+    for line in diff_text.split('\n'):
+        if line.startswith('+++ '):
+            name = line[4:]
+            path = name[2:] if name.startswith('b/') else None
+        elif path and line.startswith('@@'):
+            match = HUNK_HEADER.match(line)
+            if not match:
+                continue
+            start, count = int(match.group(1)), int(match.group(2) or 1)
+            if count == 0:
+                continue  # Only deletions
+            end = start + count - 1
+            if hunks and hunks[-1][0] == path and start - hunks[-1][2] <= merge_gap:
+                hunks[-1] = (path, hunks[-1][1], end)
+            else:
+                hunks.append((path, start, end))
+    return hunks
+
+def hunk_excerpt(path, lines, start, end, before=40, after=3):
+    """Changed lines with their enclosing definition (when it is close) as
+    numbered source; changed lines are marked with '+'"""
+    patterns = [pattern for pattern, kind in DEFINITION_PATTERNS.get(os.path.splitext(path)[1], [])]
+    first = max(1, start - 3)
+    for line_no in range(start, max(0, start - before), -1):
+        if line_no <= len(lines) and any(p.match(lines[line_no - 1]) for p in patterns):
+            first = line_no
+            break
+    last = min(len(lines), end + after)
+    return '\n'.join(f"{'+' if start <= n <= end else ' '}{n:5d}| {lines[n - 1]}" for n in range(first, last + 1))
+
+def parse_batch_spec(text):
+    """Batch jobs from lines of "target | analysis type | model".
+
+    The analysis type defaults to cleanup and the model to auto (the best
+    installed model for each file's language). Lines starting with # are
+    comments.
+    """
+    jobs = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = [field.strip() for field in line.split('|')]
+        target = os.path.abspath(os.path.expanduser(fields[0]))
+        analysis_type = fields[1] if len(fields) > 1 and fields[1] else 'cleanup'
+        model = fields[2] if len(fields) > 2 and fields[2] else 'auto'
+        if analysis_type not in ANALYSIS_TYPES:
+            raise ValueError(f"line {line_no}: unknown analysis type '{analysis_type}'")
+        if not os.path.exists(target):
+            raise ValueError(f"line {line_no}: {target} does not exist")
+        jobs.append({'target': target, 'analysis_type': analysis_type, 'model': model})
+    return jobs
+
+class AnalysisEngine:
+    """Everything a run needs except the window: discovery, scheduling,
+    prompts, the model call for one file, fixes and the local indexes.
+
+    The GUI subclasses it and sends output to its log view; command-line
+    modes use it directly and print to stdout.
+    """
+    
+    def __init__(self, host=OLLAMA_HOST):
+        # Profiles stay keyed by the real server when host is a record/replay stand-in
+        self.client = OllamaClient(host, profiles=OptionProfiles())
+        self.findings_db = FindingsDB()
+        self.symbol_index = SymbolIndex()
+        self.symbol_roots = set()  # Roots the symbol index was refreshed for
+        self.clone_index = CloneIndex()
+        self.clone_roots = set()  # Roots whose clone pairs are loaded for prompts
+        self.embedding_index = None  # Set while a run uses related-code retrieval
+        self.pinned_paths = []  # Files/directories to analyze before everything else
+        self.minify_rules = load_minify_rules()
+        self.prompt_tokens = [0, 0]  # Source tokens before and after minifying, this run
+        self.unit_cache = True  # Send only the definitions that changed since their last analysis
+        self.preprocessor = None  # Set while a run prepares its files on a process pool
+        self.output_local = threading.local()  # Per-file output buffer of pool workers
+        self.output_lock = threading.Lock()
+    
+    def append_output(self, text, marker=None):
+        buffer = getattr(self.output_local, 'buffer', None)
+        if buffer is not None:
+            buffer.append((text, marker))
+            return
+        with self.output_lock:
+            self.write_output(text, marker)
+    
+    @profiled('output')
+    def write_output(self, text, marker=None):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    
+    def run_pool(self, items, work, token):
+        """Call work(*item) for each item on worker threads; the client's
+        adaptive limiter decides how many requests are in flight. Items start
+        in order, and each item's output is written as one block when it
+        finishes."""
+        items = list(items)
+        lock = threading.Lock()
+        failures = []
+        
+        def worker():
+            while not token.cancelled and not failures:
+                with lock:
+                    if not items:
+                        return
+                    item = items.pop(0)
+                self.output_local.buffer = []
+                try:
+                    work(*item)
+                except BaseException as e:
+                    failures.append(e)
+                    token.cancel()  # Stop the other workers' requests too
+                finally:
+                    buffer, self.output_local.buffer = self.output_local.buffer, None
+                    with self.output_lock:
+                        for text, marker in buffer:
+                            self.write_output(text, marker)
+        
+        threads = [threading.Thread(target=worker, daemon=True)
+                   for _ in range(min(self.client.limiter.maximum, len(items)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0]
+        token.check()
+    
+    @contextlib.contextmanager
+    def preprocessing(self, jobs):
+        """Prepare the (path, analysis_type, model) jobs of a run on all cores
+        while the model works; analyze_file picks the records up"""
+        preprocessor = Preprocessor.start(jobs, self.minify_rules, self.unit_cache)
+        self.preprocessor = preprocessor
+        try:
+            yield
+        finally:
+            self.preprocessor = None
+            if preprocessor:
+                preprocessor.close()
+                self.append_output(f"⚙️ {preprocessor.describe()}\n")
+    
+    def report_concurrency(self, since):
+        self.append_output(f"🎛️ In-flight request limit: {self.client.limiter.summary(since)}\n")
+    
+    def set_status(self, text):
+        pass
+    
+    def start_progress(self, items):
+        """RunProgress for (path, model) items, knowing which models are loaded"""
+        try:
+            warm = self.client.loaded_models()
+        except OllamaError:
+            warm = [model for _, model in items if self.client.is_warm(model)]
+        return RunProgress(self.client.throughput, items, warm)
+    
+    def report_progress(self, progress):
+        if progress.done_files:
+            self.append_output(f"   ⏳ {progress.describe()}\n")
+    
+    def available_models(self):
+        """Names of the models installed on the server"""
+        try:
+            return self.client.installed_models()
+        except OllamaError:
+            return []
+    
+    def find_git_root(self, path):
+        """Find the root of a git repository"""
+        current_path = Path(path).resolve()
+        
+        while current_path != current_path.parent:
+            if (current_path / '.git').exists():
+                return str(current_path)
+            current_path = current_path.parent
+        
+        return None
+    
+    def run_git_command(self, cwd, args, token=None):
+        """Run a git command in the specified directory"""
+        if token is None:
+            result = subprocess.run(
+                ['git'] + args,
+                cwd=cwd,
+                capture_output=True,
+                text=True
+            )
+            returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
+        else:
+            # Cancellable variant for git calls made during a run
+            process = subprocess.Popen(['git'] + args, cwd=cwd, text=True,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            handle = token.on_cancel(process.kill)
+            try:
+                stdout, stderr = process.communicate()
+            finally:
+                token.remove(handle)
+            token.check()
+            returncode = process.returncode
+        if returncode != 0:
+            raise Exception(f"Git command failed: {stderr}")
+        return stdout
+    
+    @profiled('discover')
+    def discover_files(self, target, max_size, token):
+        """Find code files under target, skipping build/dependency directories"""
+        if os.path.isfile(target):
+            return [target]
+        
+        files_to_analyze = []
+        for root, dirs, files in os.walk(target):
+            token.check()
+            # Skip common build/dependency directories
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            for file in files:
+                if file.endswith(CODE_EXTENSIONS):
+                    file_path = os.path.join(root, file)
+                    try:
+                        if os.path.getsize(file_path) < max_size:
+                            files_to_analyze.append(file_path)
+                    except OSError:
+                        pass  # Skip if can't get file size
+        return files_to_analyze
+    
+    def repository_root(self, target):
+        root = self.find_git_root(target) or (target if os.path.isdir(target) else os.path.dirname(target))
+        return os.path.abspath(root)
+    
+    @profiled('index')
+    def refresh_symbol_index(self, target, token):
+        """Update the cross-file symbol index for the repository containing target"""
+        root = self.repository_root(target)
+        files = self.discover_files(root, 1000000, token)
+        parsed = self.symbol_index.refresh(root, files, token)
+        self.symbol_roots.add(root)
+        self.append_output(f"🧭 Symbol index: {len(files)} files, {parsed} re-parsed\n\n")
+    
+    def symbol_context(self, file_path):
+        path = os.path.abspath(file_path)
+        for root in self.symbol_roots:
+            if path.startswith(root + os.sep):
+                return self.symbol_index.prompt_context(file_path, root)
+        return ''
+    
+    @profiled('index')
+    def refresh_clone_index(self, target, token):
+        """Update the clone index for the repository containing target and
+        return its clone groups"""
+        root = self.repository_root(target)
+        files = self.discover_files(root, 1000000, token)
+        hashed = self.clone_index.refresh(root, files, token)
+        groups = self.clone_index.find(root, token)
+        self.clone_roots.add(root)
+        duplicated = sum(f[3] - f[2] + 1 for g in groups for f in g['fragments'][1:])
+        self.append_output(f"🧬 Clone index: {len(files)} files, {hashed} re-hashed; {len(groups)} clone groups, "
+                           f"~{duplicated} duplicated lines\n\n")
+        return groups
+    
+    def clone_context(self, file_path):
+        path = os.path.abspath(file_path)
+        for root in self.clone_roots:
+            if path.startswith(root + os.sep):
+                return self.clone_index.prompt_context(file_path, root)
+        return ''
+    
+    def run_clone_report(self, target, token, limit=30):
+        """Report the near-duplicate functions and blocks of a repository"""
+        root = self.repository_root(target)
+        self.append_output(f"🧬 Searching {root} for near-duplicate code\n")
+        self.append_output("=" * 50 + "\n")
+        groups = self.refresh_clone_index(root, token)
+        if not groups:
+            self.append_output("✅ No near-duplicate functions or blocks found\n")
+            return groups
+        for number, group in enumerate(groups[:limit], 1):
+            fragments = group['fragments']
+            lines = [f[3] - f[2] + 1 for f in fragments]
+            size = f"{min(lines)}" if min(lines) == max(lines) else f"{min(lines)}-{max(lines)}"
+            self.append_output(f"[{number}] {len(fragments)} copies, ~{group['similarity']:.0%} similar, "
+                               f"{size} lines each\n")
+            for path, name, start, end, _ in fragments:
+                self.append_output(f"    {os.path.relpath(path, root)}:{start}-{end} {name or '(top-level code)'}\n",
+                                   path)
+            self.append_output("\n")
+        if len(groups) > limit:
+            self.append_output(f"… and {len(groups) - limit} smaller groups\n")
+        return groups
+    
+    @profiled('index')
+    def refresh_embedding_index(self, target, token):
+        """Load and update the embedding index for related-code retrieval"""
+        self.embedding_index = None
+        if np is None:
+            self.append_output("⚠️ Related-code retrieval needs numpy (pip install numpy); continuing without it\n\n")
+            return
+        
+        index = EmbeddingIndex(self.repository_root(target))
+        files = self.discover_files(index.root, 100000, token)
+        self.append_output(f"🧲 Updating embedding index for {len(files)} files...\n")
+        
+        def progress(done, total):
+            self.set_status(f"Embedding repository chunks: {done}/{total}")
+        
+        try:
+            embedded = index.refresh(self.client, files, token, progress)
+        except OllamaError as e:
+            self.append_output(f"⚠️ Embedding failed ({e}); continuing without related code\n\n")
+            return
+        self.embedding_index = index
+        self.append_output(f"🧲 Embedding index: {len(index.rows)} chunks, {embedded} newly embedded\n\n")
+    
+    def related_context(self, file_path, token_budget=1500):
+        """Most similar chunks of other files, as a prompt section"""
+        if not self.embedding_index:
+            return ''
+        related = self.embedding_index.related(file_path, token_budget)
+        if not related:
+            return ''
+        parts = ["", "", "RELATED CODE FROM OTHER FILES (retrieved by similarity; context only, do not analyze it):"]
+        for path, start, end, score, text in related:
+            parts.append(f"--- {os.path.relpath(path, self.embedding_index.root)} lines {start}-{end} ---")
+            parts.append(text.rstrip('\n'))
+        return '\n'.join(parts) + '\n\n'
+    
+    @profiled('schedule')
+    def schedule_files(self, target, files, token):
+        """Order discovered files by priority and report how they were ordered"""
+        scheduler = self.build_scheduler(target, token)
+        ordered = scheduler.order(files, token)
+        pinned = sum(1 for f in ordered if scheduler.pin_rank(f) is not None)
+        self.append_output(f"🗂️ Scheduling by: {scheduler.describe()}")
+        if pinned:
+            self.append_output(f" ({pinned} pinned files first)")
+        self.append_output("\n\n")
+        return ordered
+    
+    def build_scheduler(self, target, token):
+        """Create the file scheduler: git churn/recency, size and prior findings"""
+        scheduler = FileScheduler(pinned=self.pinned_paths)
+        
+        git_root = self.find_git_root(target if os.path.isdir(target) else os.path.dirname(target))
+        if git_root:
+            try:
+                churn, last_touched = self.collect_git_history(git_root, token)
+                if churn:
+                    max_churn = max(churn.values())
+                    scheduler.add_scorer(
+                        'churn', lambda p: churn.get(os.path.realpath(p), 0) / max_churn, 1.0)
+                if last_touched:
+                    now = datetime.datetime.now().timestamp()
+                    # Halve the recency value for every two weeks without a change
+                    scheduler.add_scorer(
+                        'recency',
+                        lambda p: 0.5 ** ((now - last_touched.get(os.path.realpath(p), 0)) / (14 * 86400)),
+                        1.0)
+            except Exception as e:
+                self.append_output(f"⚠️ Git history unavailable for scheduling: {e}\n")
+        
+        # Shortest job first: a file's size is the best cheap estimate of its cost
+        scheduler.add_scorer('size', lambda p: 1.0 / (1.0 + os.path.getsize(p) / 8000.0), 1.0)
+        
+        density = self.collect_finding_density(target, token)
+        if density:
+            max_density = max(density.values())
+            scheduler.add_scorer(
+                'findings', lambda p: density.get(os.path.realpath(p), 0) / max_density, 1.5)
+        
+        return scheduler
+    
+    def collect_git_history(self, git_root, token, max_commits=1000):
+        """Return per-file commit counts and last-change times from recent history"""
+        log = self.run_git_command(git_root, ['log', '-n', str(max_commits),
+                                              '--name-only', '--pretty=format:@%ct'], token)
+        churn, last_touched = {}, {}
+        commit_time = 0
+        for line in log.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('@'):
+                commit_time = int(line[1:])
+                continue
+            path = os.path.realpath(os.path.join(git_root, line))
+            churn[path] = churn.get(path, 0) + 1
+            # git log is newest first, so the first time we see a path wins
+            last_touched.setdefault(path, commit_time)
+        
+        # Uncommitted edits are the most recent changes of all
+        status = self.run_git_command(git_root, ['status', '--porcelain'], token)
+        now = int(datetime.datetime.now().timestamp())
+        for line in status.split('\n'):
+            if len(line) > 3:
+                path = os.path.realpath(os.path.join(git_root, line[3:].split(' -> ')[-1]))
+                last_touched[path] = now
+        return churn, last_touched
+    
+    def collect_finding_density(self, target, token):
+        """Open findings per KB for each file under target, from the findings database"""
+        density = {}
+        for path, findings in self.findings_db.open_finding_counts(self.repository_root(target)).items():
+            token.check()
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue  # Deleted since it was analyzed
+            density[os.path.realpath(path)] = findings / max(1.0, size / 1024.0)
+        return density
+    
+    def analyze_file(self, model, file_path, analysis_type, token, source=None, context=True, preprocessed=True):
+        """Analyze one file with the model; returns (status, result)
+
+        source is the file's text when it doesn't come from disk (git blobs).
+        context=False leaves out the cross-file context (symbol usage, clones,
+        related code), which describes the working tree. preprocessed=False
+        reads the file now even while a run's Preprocessor is active (watch
+        mode re-analyzes files because they were just saved).
+        """
+        # Read and minify: done ahead on the preprocessing pool when the run has one
+        record = None
+        if source is None and preprocessed and self.preprocessor:
+            with profile_stage('read'):
+                record = self.preprocessor.take(file_path, analysis_type, model)
+        if record is None:
+            record = prepare_source(file_path, analysis_type, model, self.minify_rules, self.unit_cache, source)
+        if record['error']:
+            self.append_output(f"❌ Error reading file: {record['error']}\n\n")
+            return 'error', record['error']
+        if record['empty']:
+            self.append_output(f"⚠️ Skipping empty file: {os.path.basename(file_path)}\n\n")
+            return 'empty', ''
+        
+        # Definitions unchanged since their last analysis keep their findings
+        units = self.unit_plan(record['units'])
+        changed = [unit for unit in units if unit['cached'] is None] if units else []
+        if units and not changed:
+            return 'analyzed', self.reuse_unit_findings(file_path, units, '', analysis_type)
+        content, line_map, cut = record['content'], record['line_map'], record['cut']
+        tokens = record['tokens']
+        excerpt_map = None
+        if len(changed) < len(units or []):
+            excerpt_map = sorted(line for unit in changed for line in unit['lines'])
+            lines = record['text'].split('\n')
+            excerpt = '\n'.join(lines[line - 1] for line in excerpt_map)
+            names = ', '.join(unit['name'] for unit in changed[:5]) + (', …' if len(changed) > 5 else '')
+            self.append_output(f"   🧩 {len(changed)} of {len(units)} definitions changed: {names}\n")
+            # Trim low-signal text first so more real code fits the limit
+            content, line_map = minify_source(excerpt, file_path, self.minify_rules.get(analysis_type, []))
+            line_map = [excerpt_map[line - 1] for line in line_map] if line_map else excerpt_map
+            tokens = (tokens[0], estimate_tokens(content))
+            content, line_map, cut = truncate_source(content, line_map)
+        self.prompt_tokens[0] += tokens[0]
+        self.prompt_tokens[1] += tokens[1]
+        
+        # Create analysis prompt
+        prompt = self.create_analysis_prompt(file_path, content, analysis_type, excerpt=bool(excerpt_map),
+                                             context=context)
+        
+        # Debug: Show content size
+        if len(content) < record['size']:
+            self.append_output(f"   Content size: {len(content)} chars (minified from {record['size']})\n")
+        else:
+            self.append_output(f"   Content size: {len(content)} chars\n")
+        
+        # Run Ollama analysis
+        status, result = 'no_output', ''
+        try:
+            response, stats = self.client.generate(model, prompt, token=token, analysis_type=analysis_type)
+            self.append_output(f"   ⏱️ {format_request_stats(stats)}\n")
+            
+            if response:
+                # Clean up terminal control sequences
+                with profile_stage('postprocess'):
+                    clean_output = remap_line_numbers(self.clean_terminal_output(response), line_map)
+                
+                # Check for common unhelpful responses
+                unhelpful_phrases = [
+                    "i don't have access",
+                    "i cannot access",
+                    "i'm unable to see",
+                    "i can't see the code",
+                    "no code provided",
+                    "code is not provided",
+                    "i need to see the code",
+                    "i need more information",
+                    "please provide",
+                    "provide me with",
+                    "i'd be happy to help",
+                    "sure, i can analyze",
+                    "please provide the file",
+                    "provide more context",
+                    "it appears to be incomplete",
+                    "cannot provide a detailed analysis",
+                    "// your comprehensive code analysis goes here"
+                ]
+                
+                is_unhelpful = any(phrase in clean_output.lower() for phrase in unhelpful_phrases)
+                
+                if clean_output.strip() and not is_unhelpful:
+                    status, result = 'analyzed', clean_output
+                    self.append_output(f"✅ Results for {os.path.basename(file_path)}:\n")
+                    self.append_output("-" * 40 + "\n")
+                    self.append_output(clean_output)
+                    self.append_output("\n" + "=" * 50 + "\n\n")
+                elif is_unhelpful:
+                    self.append_output(f"🔄 Retrying analysis for {os.path.basename(file_path)} with simplified prompt...\n")
+                    # Retry with a more direct prompt
+                    file_ext = os.path.splitext(file_path)[1]
+                    lang_name = {
+                        '.py': 'Python', '.cpp': 'C++', '.h': 'C++', '.c': 'C',
+                        '.js': 'JavaScript', '.ts': 'TypeScript', '.rs': 'Rust',
+                        '.go': 'Go', '.java': 'Java'
+                    }.get(file_ext, 'code')
+                    
+                    retry_prompt = f"""Here is {lang_name} code to analyze:
+
+{content}
+
+Analyze this code and identify any:
+- Errors or bugs
+- Style issues
+- Security problems
+- Performance issues
+- Code that needs cleanup
+
+Be specific about what you find."""
+                    try:
+                        retry_response, _ = self.client.generate(model, retry_prompt, token=token,
+                                                                 analysis_type=analysis_type)
+                        if retry_response:
+                            retry_output = remap_line_numbers(self.clean_terminal_output(retry_response), line_map)
+                            if retry_output.strip():
+                                status, result = 'analyzed', retry_output
+                                self.append_output(f"✅ Results for {os.path.basename(file_path)} (retry):\n")
+                                self.append_output("-" * 40 + "\n")
+                                self.append_output(retry_output)
+                                self.append_output("\n" + "=" * 50 + "\n\n")
+                            else:
+                                status = 'unhelpful'
+                                self.append_output(f"⚠️ No useful output after retry for {os.path.basename(file_path)}\n\n")
+                        else:
+                            self.append_output(f"⚠️ No output after retry for {os.path.basename(file_path)}\n\n")
+                    except OllamaTimeout:
+                        status = 'timeout'
+                        self.append_output(f"⏱️ Retry timed out for {os.path.basename(file_path)}\n\n")
+                    except Exception as retry_e:
+                        status = 'error'
+                        self.append_output(f"❌ Retry failed for {os.path.basename(file_path)}: {retry_e}\n\n")
+                else:
+                    self.append_output(f"⚠️ No readable output from analysis of {os.path.basename(file_path)}\n\n")
+        
+        except OllamaTimeout as e:
+            status = 'timeout'
+            self.append_output(f"⏱️ Analysis timed out for this file ({e})\n\n")
+        except CircuitOpenError as e:
+            status = 'error'
+            self.append_output(f"⛔ Skipped: {e}\n\n")
+        except Exception as e:
+            status = 'error'
+            self.append_output(f"❌ Error analyzing file: {e}\n\n")
+        
+        if units and status == 'analyzed':
+            result = self.reuse_unit_findings(file_path, units, result, analysis_type, cut)
+        return status, result
+    
+    def unit_plan(self, keyed):
+        """The code units of a file (unit_keys) with the stored findings of
+        unchanged ones.
+
+        Returns None when the cache is off or the file doesn't split, else a
+        list of {'name', 'lines', 'key', 'cached'} where cached is None for
+        definitions that changed (or were never analyzed) since.
+        """
+        if not self.unit_cache or not keyed:
+            return None
+        plan = [{'name': name, 'lines': numbers, 'key': key} for name, numbers, key in keyed]
+        cached = self.findings_db.unit_results([unit['key'] for unit in plan])
+        for unit in plan:
+            unit['cached'] = cached.get(unit['key'])
+        return plan
+    
+    def reuse_unit_findings(self, file_path, units, result, analysis_type, cut=None):
+        """Store the findings of the analyzed definitions and add the stored
+        ones of the unchanged definitions to result.
+
+        Findings are kept relative to their definition, so they follow it when
+        code above it grows or shrinks. Definitions reaching cut (the first
+        line the prompt limit left out) aren't stored, so the next run
+        analyzes them again.
+        """
+        owner = {line: unit for unit in units for line in unit['lines']}
+        fresh = {unit['key']: [] for unit in units if unit['cached'] is None}
+        if cut is not None:
+            for unit in units:
+                if unit['cached'] is None and unit['lines'] and max(unit['lines']) >= cut:
+                    fresh.pop(unit['key'], None)
+            left = sum(1 for unit in units if unit['cached'] is None) - len(fresh)
+            if left:
+                self.append_output(f"   ✂️ {left} definitions past the size limit stay uncached\n")
+        for finding in parse_findings(result, analysis_type):
+            unit = owner.get(finding['line_start'])
+            if unit is None or unit['cached'] is not None or unit['key'] not in fresh:
+                continue  # Not a line of the excerpt the model saw, or cut off
+            offsets = {line: offset for offset, line in enumerate(unit['lines'], 1)}
+            fresh[unit['key']].append({
+                'category': finding['category'],
+                'severity': finding['severity'],
+                'start': offsets[finding['line_start']],
+                'end': sum(1 for line in unit['lines'] if line <= finding['line_end']),
+                'message': rewrite_line_numbers(finding['message'], lambda line: offsets.get(line, line)),
+            })
+        self.findings_db.store_unit_results(fresh)
+        
+        unchanged = [unit for unit in units if unit['cached'] is not None]
+        if not unchanged:
+            return result
+        reused = []
+        for unit in unchanged:
+            numbers = unit['lines']
+            
+            def current(offset):
+                return numbers[min(max(offset, 1), len(numbers)) - 1]
+            
+            for finding in unit['cached']:
+                start, end = current(finding['start']), current(finding['end'])
+                message = rewrite_line_numbers(finding['message'], current)
+                if not LINE_REFERENCE.search(message):
+                    message = (f"line {start}: " if start == end else f"lines {start}-{end}: ") + message
+                # Category and severity first, where parse_findings looks for them
+                category = 'bug' if finding['category'] == 'errors' else finding['category']
+                reused.append(f"- [{category}, {finding['severity']}] {message}")
+        
+        self.append_output(f"♻️ {len(unchanged)} of {len(units)} definitions of {os.path.basename(file_path)} "
+                           f"unchanged, {len(reused)} earlier findings reused\n")
+        if not reused:
+            return result or "No findings: every definition is unchanged since an analysis that found none."
+        block = "Findings in unchanged definitions:\n" + '\n'.join(reused)
+        self.append_output(block + "\n\n")
+        return f"{result.rstrip()}\n\n{block}" if result.strip() else block
+    
+    @staticmethod
+    def stratum(target, file_path):
+        """Sampling stratum of a file: its top-level directory and language family"""
+        relative = os.path.relpath(file_path, target).replace(os.sep, '/')
+        top = relative.split('/')[0] + '/' if '/' in relative else './'
+        ext = os.path.splitext(file_path)[1]
+        family = next((f for f in LANGUAGE_FAMILIES if ext in f), (ext,))
+        return top, family[0]
+    
+    def sample_order(self, target, files):
+        """All files in a stratified random order: one file of every stratum
+        first, then the strata interleaved in proportion to their size, so any
+        prefix is a proportional sample. The order is the same for a target
+        every time."""
+        strata = {}
+        for file_path in sorted(files):
+            strata.setdefault(self.stratum(target, file_path), []).append(file_path)
+        rng = random.Random(os.path.abspath(target))
+        keyed = []
+        for key in sorted(strata):
+            members = strata[key]
+            rng.shuffle(members)
+            offset = rng.random()
+            for i, file_path in enumerate(members):
+                keyed.append((i > 0, (i + offset) / len(members), file_path))
+        keyed.sort()
+        return [file_path for _, _, file_path in keyed]
+    
+    def run_sample(self, target, analysis_type, model, token, seconds=None, max_tokens=None):
+        """Analyze a stratified sample of target within a time and/or token
+        budget and estimate issue rates for the whole tree.
+
+        The sample is the start of an ordinary analysis journal, so running
+        it again extends the sample and Start Analysis can finish it as a
+        full run without redoing any file.
+        """
+        started = time.monotonic()
+        self.prompt_tokens = [0, 0]
+        self.append_output(f"🎲 Sampling {target} ({analysis_type}, {model})\n")
+        self.append_output("=" * 50 + "\n")
+        
+        key = RunJournal.run_key('analysis', target, analysis_type, model)
+        journal = RunJournal.find_incomplete(key)
+        if journal and not journal.header.get('sampled'):
+            journal = None  # An interrupted regular run; its order isn't a sample
+        if journal:
+            files = journal.files
+            self.append_output(f"♻️ Extending the earlier sample ({len(journal.records)} files done)\n")
+        else:
+            files = self.sample_order(target, self.discover_files(target, 100000, token))
+            if not files:
+                self.append_output("⚠️ No code files found to analyze.\n")
+                return
+            journal = RunJournal.create(key, 'analysis', target, analysis_type, model, files,
+                                        db_run_id=self.findings_db.start_run('analysis', target, analysis_type, model),
+                                        duplicates={}, sampled=True)
+        run_id = journal.header['db_run_id']
+        results = {path: entry for path, entry in journal.records.items() if entry.get('status') == 'analyzed'}
+        
+        used_tokens = 0
+        stopped_by = None
+        with self.preprocessing([(f, analysis_type, model) for f in files if not journal.is_done(f)]):
+            for file_path in files:
+                token.check()
+                if journal.is_done(file_path):
+                    continue
+                if seconds is not None and time.monotonic() - started >= seconds:
+                    stopped_by = "time budget"
+                    break
+                if max_tokens is not None:
+                    # Stop before a file that would overshoot, not after it
+                    expected = (RunProgress.prompt_tokens(file_path)
+                                + int(self.client.throughput.rates(model)['output_tokens']))
+                    if used_tokens + expected > max_tokens:
+                        stopped_by = "token budget"
+                        break
+                self.set_status(f"Sampling: {len(results)}/{len(files)} files")
+                self.append_output(f"[sample {len(results) + 1}] 🔍 {os.path.relpath(file_path, target)}\n", file_path)
+                before = self.prompt_tokens[1]
+                status, result = self.analyze_file(model, file_path, analysis_type, token)
+                used_tokens += self.prompt_tokens[1] - before + estimate_tokens(result or '')
+                journal.record(file_path, status, result)
+                self.findings_db.record_analysis(run_id, file_path, status, result, analysis_type)
+                if status == 'analyzed':
+                    results[file_path] = {'result': result}
+        
+        if stopped_by is None:
+            journal.mark_complete()
+            self.findings_db.finish_run(run_id)
+            self.append_output("🎉 Every file is analyzed; the figures below are exact\n")
+        self.report_sample_estimates(target, files, results, analysis_type)
+        self.append_output(f"⏱️ {time.monotonic() - started:.0f}s, ~{used_tokens} tokens this session"
+                           + (f", stopped at the {stopped_by}" if stopped_by else "") + "\n")
+        if stopped_by:
+            self.append_output("▶️ Sample again to extend it, or Start Analysis to finish it as a full run\n")
+        self.report_prompt_savings()
+    
+    def report_sample_estimates(self, target, files, results, analysis_type):
+        """Per-category findings per file and per-directory rates of files with
+        findings, with 95% confidence intervals"""
+        strata = {}
+        for file_path in files:
+            strata.setdefault(self.stratum(target, file_path), []).append(file_path)
+        counts = {path: {} for path in results}
+        for path, entry in results.items():
+            for finding in parse_findings(entry.get('result') or '', analysis_type):
+                counts[path][finding['category']] = counts[path].get(finding['category'], 0) + 1
+        categories = sorted({category for per_file in counts.values() for category in per_file}) or [analysis_type]
+        
+        self.append_output("\n" + "=" * 50 + "\n")
+        self.append_output(f"📈 Estimate from {len(results)}/{len(files)} files "
+                           f"({100 * len(results) / len(files):.1f}%), {len(strata)} strata\n\n")
+        self.append_output("Findings per file (95% CI) and projected total:\n")
+        for category in categories:
+            mean, half, coverage = stratified_mean([
+                (len(members), [counts[p].get(category, 0) for p in members if p in counts])
+                for members in strata.values()])
+            low, high = max(0.0, mean - half), mean + half
+            self.append_output(f"  {category:<12} {mean:6.2f} ({low:.2f}-{high:.2f})   "
+                               f"≈ {mean * len(files):.0f} ({low * len(files):.0f}-{high * len(files):.0f})\n")
+        if coverage < 1:
+            self.append_output(f"  ({100 * (1 - coverage):.0f}% of files are in strata without a sample yet)\n")
+        
+        self.append_output("\nFiles with findings, by directory (95% CI):\n")
+        directories = {}
+        for (top, _), members in strata.items():
+            entry = directories.setdefault(top, [0, 0, 0])
+            entry[0] += len(members)
+            for path in members:
+                if path in counts:
+                    entry[1] += 1
+                    entry[2] += bool(counts[path])
+        for top, (size, sampled, with_findings) in sorted(directories.items(), key=lambda item: -item[1][0]):
+            if not sampled:
+                self.append_output(f"  {top:<30} not sampled yet ({size} files)\n")
+                continue
+            low, high = wilson_interval(with_findings, sampled) if sampled < size else (with_findings / size,) * 2
+            self.append_output(f"  {top:<30} {100 * with_findings / sampled:5.1f}% ({100 * low:.0f}-{100 * high:.0f}%)"
+                               f"  n={sampled}/{size}\n")
+    
+    def create_hunk_prompt(self, path, excerpt):
+        """Short review prompt for one staged change"""
+        return f"""REVIEW THIS CHANGE TO {path}:
+
+{excerpt}
+
+Lines starting with '+' were just changed; the others are context. Report only real problems in the changed lines: bugs, crashes, security holes, broken logic.
+Write one line per problem as:
+- [high|medium|low] line N: description
+Use high only for problems that would break the program or open a vulnerability. If there are no problems, answer "No issues"."""
+    
+    def run_pre_commit(self, repo, model, budget=10.0, workers=4):
+        """Review the staged hunks of repo within a wall-clock budget.
+
+        Returns 1 when a finished hunk has a high-severity finding, else 0.
+        Hunks that didn't finish in time (or failed) are listed but never
+        block the commit.
+        """
+        started = time.monotonic()
+        token = CancelToken()
+        diff = self.run_git_command(repo, ['-c', 'core.quotepath=off', 'diff', '--cached', '-U0', '--no-color',
+                                           '--no-ext-diff', '--diff-filter=AM', '--no-renames'])
+        hunks = [hunk for hunk in parse_staged_hunks(diff) if hunk[0].endswith(CODE_EXTENSIONS)]
+        if not hunks:
+            return 0
+        
+        staged = {}
+        jobs = []
+        for path, start, end in hunks:
+            if path not in staged:
+                # The index version: what is about to be committed
+                staged[path] = self.run_git_command(repo, ['show', f":{path}"]).split('\n')
+            prompt = self.create_hunk_prompt(path, hunk_excerpt(path, staged[path], start, end))
+            jobs.append((path, f"{path}:{start}-{end}" if end > start else f"{path}:{start}", prompt))
+        
+        results = {}
+        queue = list(range(len(jobs)))
+        lock = threading.Lock()
+        # No time to ramp up from one request; this limiter still backs off if the server queues
+        limiter = AdaptiveLimiter(initial=min(workers, len(jobs)), maximum=workers)
+        
+        def work():
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    index = queue.pop(0)
+                try:
+                    text, _ = self.client.generate(model, jobs[index][2], output_tokens=300, token=token,
+                                                   analysis_type='hunk', limiter=limiter)
+                    results[index] = ('done', text)
+                except Cancelled:
+                    return
+                except OllamaError as e:
+                    results[index] = ('error', str(e))
+        
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(min(workers, len(jobs)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(0.0, started + budget - time.monotonic()))
+        token.cancel()  # Aborts the requests still streaming
+        for thread in threads:
+            thread.join(1.0)
+        
+        blocking, unfinished = [], []
+        for index, (path, label, _) in enumerate(jobs):
+            state, text = results.get(index, ('unfinished', ''))
+            if state != 'done':
+                unfinished.append(f"{label} ({text})" if text else label)
+                continue
+            for finding in parse_findings(text, 'errors'):
+                # Excerpt line numbers are the file's own, so messages cite them directly
+                marker = '❌' if finding['severity'] == 'high' else '⚠️'
+                self.append_output(f"{marker} {path}: {finding['message']}\n")
+                if finding['severity'] == 'high':
+                    blocking.append(finding)
+        
+        elapsed = time.monotonic() - started
+        self.append_output(f"🔍 Reviewed {len(jobs) - len(unfinished)}/{len(jobs)} staged hunks in {elapsed:.1f}s "
+                           f"(budget {budget:.0f}s)\n")
+        if unfinished:
+            self.append_output(f"⏳ Not reviewed: {', '.join(unfinished)}\n")
+        if blocking:
+            self.append_output(f"❌ Commit blocked by {len(blocking)} high-severity findings "
+                               "(git commit --no-verify skips this check)\n")
+            return 1
+        return 0
+    
+    def install_pre_commit_hook(self, repo, model, budget):
+        """Install a pre-commit hook that runs run_pre_commit; returns its path"""
+        hook = os.path.join(repo, self.run_git_command(repo, ['rev-parse', '--git-path', 'hooks/pre-commit']).strip())
+        marker = "# ollama-code-checker pre-commit hook"
+        if os.path.exists(hook):
+            with open(hook, 'r', encoding='utf-8', errors='ignore') as f:
+                if marker not in f.read():
+                    raise OSError(f"{hook} already exists and was not installed by this tool")
+        os.makedirs(os.path.dirname(hook), exist_ok=True)
+        with open(hook, 'w', encoding='utf-8') as f:
+            f.write(f"#!/bin/sh\n{marker}\n"
+                    f"exec {sys.executable} '{os.path.abspath(__file__)}' --pre-commit --budget {budget:g} "
+                    f"--model '{model}'\n")
+        os.chmod(hook, 0o755)
+        return hook
+    
+    def report_prompt_savings(self):
+        before, after = self.prompt_tokens
+        if before > after:
+            self.append_output(f"✂️ Input minifier saved ~{before - after} of {before} source tokens "
+                               f"({(before - after) * 100 // before}%)\n")
+        self.prompt_tokens = [0, 0]
+    
+    def run_batch(self, jobs, token, shard=None):
+        """Analyze several targets with all work grouped by model.
+
+        Each model's files run back to back while it is resident, models that
+        are already loaded go first, and a finished model is unloaded so the
+        next one has the memory. Load time is measured and compared with the
+        loads a job-by-job run would have caused.
+
+        shard (i, N) analyzes only this machine's cost-balanced share of the
+        files. Returns the manifest of all files per job (paths relative to
+        the job target) and this run's results, as a partial result.
+        """
+        self.prompt_tokens = [0, 0]
+        self.append_output("📦 Starting batch analysis\n")
+        self.append_output("=" * 50 + "\n")
+        work = {}           # model -> [(job number, file)]
+        job_order = []      # Model of every file in plain job-by-job order
+        manifest = {}       # job number -> every file of the job, relative to its target
+        discovered = []
+        for job_no, job in enumerate(jobs):
+            token.check()
+            files = self.discover_files(job['target'], 100000, token)
+            manifest[job_no] = sorted(self.relative_path(job['target'], f) for f in files)
+            discovered.append(files)
+        
+        if shard:
+            costs = {(job_no, self.relative_path(jobs[job_no]['target'], f)): RunProgress.prompt_tokens(f)
+                     for job_no, files in enumerate(discovered) for f in files}
+            assignment = assign_shards(costs, shard[1])
+            mine = sum(cost for key, cost in costs.items() if assignment[key] == shard[0])
+            discovered = [[f for f in files if assignment[(job_no, self.relative_path(jobs[job_no]['target'], f))] == shard[0]]
+                          for job_no, files in enumerate(discovered)]
+            self.append_output(f"🧩 Shard {shard[0]}/{shard[1]}: {sum(map(len, discovered))} of {len(costs)} files, "
+                               f"~{mine} of {sum(costs.values())} prompt tokens\n")
+        
+        results = []
+        for job_no, job in enumerate(jobs):
+            files = discovered[job_no]
+            self.append_output(f"📁 {job['target']}: {len(files)} files, {job['analysis_type']}, model {job['model']}\n")
+            if not files:
+                continue
+            files = self.schedule_files(job['target'], files, token)
+            if job['analysis_type'] in ('cleanup', 'all'):
+                self.refresh_symbol_index(job['target'], token)
+                self.refresh_clone_index(job['target'], token)
+            for file_path in files:
+                model = job['model']
+                if model == 'auto':
+                    language = self.get_language_from_extension(os.path.splitext(file_path)[1])
+                    model = self.get_best_model_for_language(language).replace('🚀 ', '').strip()
+                work.setdefault(model, []).append((job_no, file_path))
+                job_order.append(model)
+        
+        partial = {'jobs': jobs, 'shard': list(shard) if shard else None, 'manifest': manifest, 'results': results}
+        if not work:
+            self.append_output("⚠️ No code files found in any batch target.\n")
+            return partial
+        
+        try:
+            resident = set(self.client.loaded_models())
+        except OllamaError:
+            resident = set()
+        models = sorted(work, key=lambda m: (m not in resident, -len(work[m])))
+        needed = sum(1 for m in models if m not in resident)
+        naive = sum(1 for i, m in enumerate(job_order)
+                    if (m != job_order[i - 1] if i else m not in resident))
+        self.append_output(f"🧮 {len(job_order)} files across {len(models)} models: {needed} model loads "
+                           f"(job-by-job order would need {naive})\n\n")
+        
+        run_ids = {}
+        loads_before = {m: list(v) for m, v in self.client.load_totals.items()}
+        progress = self.start_progress([(file_path, m) for m in models for _, file_path in work[m]])
+        self.report_progress(progress)
+        run_started = time.time()
+        for job_no in sorted({job_no for items in work.values() for job_no, _ in items}):
+            job = jobs[job_no]
+            run_ids[job_no] = self.findings_db.start_run('analysis', job['target'], job['analysis_type'], job['model'])
+        
+        def analyze(number, model, job_no, file_path):
+            token.check()
+            job = jobs[job_no]
+            self.append_output(f"[{number}/{len(job_order)}] 🔍 Analyzing: {os.path.basename(file_path)}\n", file_path)
+            # Hashed before the request, so an edit made while the model works doesn't relabel the result
+            content_hash = file_content_hash(file_path)
+            status, result = self.analyze_file(model, file_path, job['analysis_type'], token)
+            progress.finish(file_path)
+            self.report_progress(progress)
+            self.findings_db.record_analysis(run_ids[job_no], file_path, status, result, job['analysis_type'],
+                                             content_hash=content_hash)
+            results.append({'job': job_no, 'path': self.relative_path(job['target'], file_path), 'model': model,
+                            'status': status, 'result': result, 'content_hash': content_hash})
+        
+        done = 0
+        for group_no, model in enumerate(models, 1):
+            self.append_output(f"🤖 [{group_no}/{len(models)}] {model}: {len(work[model])} files\n\n")
+            with self.preprocessing([(file_path, jobs[job_no]['analysis_type'], model)
+                                     for job_no, file_path in work[model]]):
+                self.run_pool([(done + n, model, job_no, file_path)
+                               for n, (job_no, file_path) in enumerate(work[model], 1)], analyze, token)
+            done += len(work[model])
+            if group_no < len(models):
+                try:
+                    self.client.unload(model)
+                except OllamaError:
+                    pass  # It will be evicted by the keep-alive timer instead
+        
+        for run_id in run_ids.values():
+            self.findings_db.finish_run(run_id)
+        
+        self.append_output("=" * 50 + "\n")
+        self.append_output(f"🎉 Batch complete: {len(job_order)} files, {len(models)} models\n")
+        total_loads, total_seconds = 0, 0.0
+        for model in models:
+            loads, seconds = self.client.load_totals.get(model, [0, 0.0])
+            before = loads_before.get(model, [0, 0.0])
+            loads, seconds = loads - before[0], seconds - before[1]
+            total_loads += loads
+            total_seconds += seconds
+            self.append_output(f"   ⏳ {model}: {loads} loads, {seconds:.1f}s\n")
+        average = total_seconds / total_loads if total_loads else 0
+        self.append_output(f"⏳ Model load time: {total_seconds:.1f}s over {total_loads} loads")
+        if naive > total_loads and average:
+            self.append_output(f" (job-by-job order: ~{naive * average:.0f}s over {naive} loads)")
+        self.append_output("\n")
+        self.report_prompt_savings()
+        self.report_concurrency(run_started)
+        return partial
+    
+    @staticmethod
+    def target_base(target):
+        """Directory the files of a target are named relative to: the target
+        itself, or the directory of a single-file target. A target missing
+        here (merging elsewhere) is taken for a directory."""
+        return os.path.dirname(target) if os.path.isfile(target) else target
+    
+    @classmethod
+    def relative_path(cls, target, file_path):
+        """Path of a file within a target, the same on every machine"""
+        return os.path.relpath(file_path, cls.target_base(target)).replace(os.sep, '/')
+    
+    @classmethod
+    def resolve_relative(cls, target, path):
+        """The file a relative_path() names"""
+        return os.path.join(cls.target_base(target), *path.split('/'))
+    
+    def merge_partials(self, partials, report_path=None):
+        """Combine shard results into the findings database and one report.
+
+        Every shard must come from the same jobs and file list; files missing
+        from all shards or present in several are reported. Returns True
+        when the merged result is complete.
+        """
+        first = partials[0]
+        problems = []
+        count = (first.get('shard') or [1, 1])[1]
+        seen_shards = sorted(p['shard'][0] for p in partials if p.get('shard'))
+        if any(p['jobs'] != first['jobs'] or p['manifest'] != first['manifest'] for p in partials):
+            problems.append("partial results come from different jobs or file lists")
+        if seen_shards != list(range(1, count + 1)):
+            problems.append(f"shards present: {seen_shards or 'none'}, expected 1..{count}")
+        
+        merged = {}  # (job, path) -> result record
+        duplicates = []
+        for partial in partials:
+            for record in partial['results']:
+                key = (str(record['job']), record['path'])
+                if key in merged:
+                    duplicates.append(key)
+                merged[key] = record
+        manifest = {(str(job_no), path) for job_no, paths in first['manifest'].items() for path in paths}
+        missing = sorted(manifest - set(merged))
+        if duplicates:
+            problems.append(f"{len(duplicates)} files analyzed by more than one shard: "
+                            + ', '.join(path for _, path in duplicates[:10]))
+        if missing:
+            problems.append(f"{len(missing)} files missing from every shard: "
+                            + ', '.join(path for _, path in missing[:10]))
+        unhashed = sorted(key for key, record in merged.items() if not record.get('content_hash'))
+        if unhashed:
+            problems.append(f"{len(unhashed)} files have no content hash (unreadable when analyzed), not indexed: "
+                            + ', '.join(path for _, path in unhashed[:10]))
+        
+        lines = []
+        for job_no, job in enumerate(first['jobs']):
+            records = sorted((r for key, r in merged.items() if key[0] == str(job_no)), key=lambda r: r['path'])
+            if not records:
+                continue
+            run_id = self.findings_db.start_run('merge', job['target'], job['analysis_type'], job['model'])
+            findings = 0
+            lines.append(f"# {job['target']} ({job['analysis_type']}, {job['model']})\n")
+            for record in records:
+                if record.get('content_hash'):
+                    file_path = self.resolve_relative(job['target'], record['path'])
+                    findings += self.findings_db.record_analysis(run_id, file_path, record['status'],
+                                                                 record['result'], job['analysis_type'],
+                                                                 content_hash=record['content_hash'])
+                lines.append(f"## {record['path']} ({record['status']}, {record['model']})\n\n{record['result']}\n")
+            self.findings_db.finish_run(run_id)
+            self.append_output(f"🗃️ {job['target']}: {len(records)} files, {findings} findings indexed\n")
+        
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines))
+            self.append_output(f"📝 Report written to {report_path}\n")
+        for problem in problems:
+            self.append_output(f"❌ {problem}\n")
+        if not problems:
+            self.append_output(f"✅ Merged {len(partials)} shards: {len(merged)} files, none missing or duplicated\n")
+        return not problems
+    
+    def tree_entries(self, repo, spec, token):
+        """(path, blob id, size or None) of code files in a tree-ish or a range.
+
+        "main..feature" (or "main...feature") means the files added or modified
+        on feature since it branched from main, at their feature version.
+        """
+        if '..' in spec:
+            base, _, head = spec.replace('...', '..').partition('..')
+            raw = self.run_git_command(repo, ['diff', '--raw', '-z', '--no-abbrev', '--no-renames',
+                                              '--diff-filter=AM', f"{base}...{head or 'HEAD'}"], token)
+            fields = raw.split('\0')
+            entries = [(path, meta.split()[3], None) for meta, path in zip(fields[0::2], fields[1::2]) if meta]
+        else:
+            listing = self.run_git_command(repo, ['ls-tree', '-r', '-z', '-l', '--full-tree', spec], token)
+            entries = []
+            for record in listing.split('\0'):
+                if not record:
+                    continue
+                meta, path = record.split('\t', 1)
+                mode, kind, object_id, size = meta.split()
+                if kind == 'blob' and not mode.startswith('12'):  # Not a symlink
+                    entries.append((path, object_id, int(size)))
+        return [(path, object_id, size) for path, object_id, size in entries
+                if path.endswith(CODE_EXTENSIONS) and not set(path.split('/')[:-1]) & set(SKIP_DIRS)]
+    
+    def run_tree_analysis(self, repo, spec, analysis_type, model, token, max_size=100000):
+        """Analyze files straight from git objects, reusing results by blob id.
+
+        Nothing is read from a working tree: prompts get no cross-file context,
+        since the indexes behind it describe the checkout rather than the ref.
+        Results are recorded under <repo>@<spec>/<path>, apart from the
+        checkout's own findings that fix mode and scheduling work from.
+        """
+        self.prompt_tokens = [0, 0]
+        self.append_output(f"🌿 Analyzing {spec} in {repo} (no checkout)\n")
+        self.append_output("=" * 50 + "\n")
+        entries = sorted(self.tree_entries(repo, spec, token))
+        if not entries:
+            self.append_output("⚠️ No code files in that tree or range.\n")
+            return
+        self.append_output(f"📊 {len(entries)} files\n\n")
+        
+        # The ref's own namespace, queryable by prefix like a directory
+        root = f"{os.path.abspath(repo)}@{spec}"
+        run_id = self.findings_db.start_run('analysis', root, analysis_type, model)
+        counts = {'cached': 0, 'analyzed': 0}
+        counts_lock = threading.Lock()
+        
+        with GitObjectReader(repo) as reader:
+            handle = token.on_cancel(reader.close)
+            
+            def analyze(i, path, object_id, size):
+                token.check()
+                file_path = os.path.join(root, path)
+                self.set_status(f"{spec}: {i}/{len(entries)} files")
+                self.append_output(f"[{i}/{len(entries)}] 🔍 {path} ({object_id[:10]})\n", file_path)
+                
+                cached = self.findings_db.cached_result(object_id, analysis_type, model)
+                if cached is not None:
+                    outcome = 'cached'
+                    status, result = 'analyzed', cached
+                    self.append_output(f"♻️ Results for {path} (cached by blob id):\n")
+                    self.append_output("-" * 40 + "\n")
+                    self.append_output(cached)
+                    self.append_output("\n" + "=" * 50 + "\n\n")
+                elif size is not None and size >= max_size:
+                    self.append_output(f"⚠️ Skipping large file ({size} bytes)\n\n")
+                    return
+                else:
+                    try:
+                        _, data = reader.read(object_id)  # The reader serializes its callers
+                    except (OSError, KeyError) as e:
+                        token.check()
+                        self.append_output(f"❌ Could not read blob: {e}\n\n")
+                        return
+                    if len(data) >= max_size:
+                        self.append_output(f"⚠️ Skipping large file ({len(data)} bytes)\n\n")
+                        return
+                    outcome = 'analyzed'
+                    status, result = self.analyze_file(model, file_path, analysis_type, token,
+                                                       source=data.decode('utf-8', errors='ignore'), context=False)
+                self.findings_db.record_analysis(run_id, file_path, status, result, analysis_type,
+                                                 content_hash=object_id)
+                with counts_lock:
+                    counts[outcome] += 1
+            
+            run_started = time.time()
+            try:
+                self.run_pool([(i, *entry) for i, entry in enumerate(entries, 1)], analyze, token)
+            finally:
+                token.remove(handle)
+        
+        self.findings_db.finish_run(run_id)
+        self.append_output("=" * 50 + "\n")
+        self.append_output(f"🎉 {spec}: {counts['analyzed']} files analyzed, {counts['cached']} reused by blob id\n")
+        self.report_prompt_savings()
+        self.report_concurrency(run_started)
+    
+    @profiled('prompt')
+    def create_analysis_prompt(self, file_path, content, analysis_type, excerpt=False, context=True):
+        """Create analysis prompt based on type
+
+        excerpt: content holds only the definitions that changed since the
+        file was last analyzed.
+        context: add what the local indexes know about other files.
+        """
+        file_ext = os.path.splitext(file_path)[1]
+        language_map = {
+            '.rs': 'Rust', '.ts': 'TypeScript', '.tsx': 'TypeScript', '.js': 'JavaScript', 
+            '.jsx': 'JavaScript', '.py': 'Python', '.go': 'Go', '.java': 'Java',
+            '.cpp': 'C++', '.c': 'C', '.h': 'C/C++'
+        }
+        language = language_map.get(file_ext, 'Unknown')
+        
+        # Create a much more direct and commanding prompt
+        base_prompt = f"""ANALYZE THIS {language.upper()} CODE:
+
+{content}
+
+You must analyze the code above. Do not ask for more information - the code is right there. Analyze it now."""
+        if excerpt:
+            base_prompt += ("\n\nThe code above is an excerpt: only the definitions that changed since the last "
+                            "review. The rest of the file is unchanged, so don't report code outside it as missing.")
+        
+        if context and analysis_type in ('cleanup', 'all'):
+            base_prompt += self.symbol_context(file_path)
+            base_prompt += self.clone_context(file_path)
+        if context:
+            base_prompt += self.related_context(file_path)
+        
+        if analysis_type == "cleanup":
+            return base_prompt + """TASK: Code Cleanup Analysis
+
+Please analyze the code above and identify:
+1. Stub functions (empty or placeholder implementations)
+2. Unused functions, variables, and imports
+3. Dead code that's never called
+4. Commented-out code that should be removed
+5. Redundant or duplicate code
+6. Empty catch blocks or TODO comments
+
+For each finding, specify:
+- Line numbers where the issue occurs
+- Description of the problem
+- Whether it's safe to remove
+
+Provide your analysis in a clear, structured format."""
+        
+        elif analysis_type == "errors":
+            return base_prompt + """TASK: Error and Bug Detection
+
+Please analyze the code above and identify:
+1. Syntax errors
+2. Type errors
+3. Logic issues
+4. Potential runtime errors
+5. Missing imports or dependencies
+
+For each issue found, provide:
+- Line numbers where the error occurs
+- Description of the problem
+- Suggested fix
+
+Provide your analysis in a clear, structured format."""
+        
+        elif analysis_type == "security":
+            return base_prompt + """TASK: Security Analysis
+
+Please analyze the code above and identify:
+1. Security vulnerabilities
+2. Unsafe operations
+3. Input validation issues
+4. Authentication problems
+5. Data exposure risks
+
+For each security issue found, provide:
+- Line numbers where the vulnerability occurs
+- Description of the security risk
+- Severity level (High/Medium/Low)
+- Recommended fix
+
+Provide your analysis in a clear, structured format."""
+        
+        elif analysis_type == "performance":
+            return base_prompt + """TASK: Performance Analysis
+
+Please analyze the code above and identify:
+1. Performance bottlenecks
+2. Inefficient algorithms
+3. Memory usage issues
+4. I/O optimization opportunities
+
+For each performance issue found, provide:
+- Line numbers where the issue occurs
+- Description of the performance problem
+- Impact level (High/Medium/Low)
+- Suggested optimization
+
+Provide your analysis in a clear, structured format."""
+        
+        elif analysis_type == "style":
+            return base_prompt + """TASK: Code Style Review
+
+Please review the code above for:
+1. Code formatting and indentation
+2. Naming conventions
+3. Code organization
+4. Documentation quality
+5. Best practice compliance
+
+For each style issue found, provide:
+- Line numbers where the issue occurs
+- Description of the style problem
+- Recommended improvement
+
+Provide your analysis in a clear, structured format."""
+        
+        else:  # all
+            return base_prompt + """TASK: Comprehensive Code Analysis
+
+Please provide a thorough analysis of the code above covering:
+1. Errors and bugs
+2. Code style and best practices
+3. Security considerations
+4. Performance opportunities
+5. Code cleanup (stub/unused code)
+
+For each issue found, provide:
+- Category (Error/Style/Security/Performance/Cleanup)
+- Line numbers where the issue occurs
+- Description of the problem
+- Recommended fix or improvement
+- Priority level (High/Medium/Low)
+
+Provide your analysis in a clear, structured format with specific, actionable feedback."""
+    
+    def create_fix_prompt(self, file_path, content, analysis_type):
+        """Create prompt for fixing code"""
+        file_ext = os.path.splitext(file_path)[1]
+        language_map = {
+            '.rs': 'Rust', '.ts': 'TypeScript', '.tsx': 'TypeScript', '.js': 'JavaScript', 
+            '.jsx': 'JavaScript', '.py': 'Python', '.go': 'Go', '.java': 'Java',
+            '.cpp': 'C++', '.c': 'C', '.h': 'C/C++'
+        }
+        language = language_map.get(file_ext, 'Unknown')
+        
+        base_prompt = f"""You are an expert {language} programmer. Fix the issues in this code file.
+
+File: {os.path.basename(file_path)}
+Language: {language}
+
+ORIGINAL CODE TO FIX:
+```{language.lower()}
+{content}
+```
+
+Task: Analyze the code above and fix any issues you find:
+1. Fix errors, bugs, or issues
+2. Remove unused imports, variables, and functions
+3. Remove commented-out code
+4. Fix code style issues
+5. Improve performance where possible
+{self.symbol_context(file_path)}
+IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code blocks. Do not include explanations or other text. The code is provided above - analyze it directly."""
+        
+        return base_prompt
+    
+    @profiled('postprocess')
+    def clean_terminal_output(self, text):
+        """Remove terminal control sequences and formatting codes from text"""
+        text = StreamSanitizer().feed(text)
+        
+        # Collapse runs of blank lines, and of spaces outside ``` code blocks
+        text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
+        parts = re.split(r'(```.*?```)', text, flags=re.DOTALL)
+        text = ''.join(part if i % 2 else re.sub(r'[ \t]+', ' ', part) for i, part in enumerate(parts))
+        return text.strip()
+    
+    @profiled('postprocess')
+    def extract_code_from_response(self, code_stream, original_content):
+        """Extract code from the AI response fed through a CodeBlockStream"""
+        fixed_code = code_stream.finish()
+        
+        if fixed_code:
+            fixed_code = fixed_code.strip()
+            
+            # Basic validation - should be similar length and have some common elements
+            if len(fixed_code) > len(original_content) * 0.5 and len(fixed_code) < len(original_content) * 2:
+                return fixed_code
+        
+        return None
+    
+    def apply_fix(self, file_path, original_content, fixed_code, token):
+        """Back up the original and atomically replace the file with the fix"""
+        token.check()  # Last point where Stop prevents the write
+        
+        # Create backup
+        backup_path = file_path + '.backup'
+        with open(backup_path, 'w', encoding='utf-8') as f:
+            f.write(original_content)
+        
+        # Write fixed code to a temp file first so a file is never half-written
+        tmp_path = file_path + '.ollama-tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(fixed_code)
+        os.replace(tmp_path, file_path)
+    
+    def detect_dominant_language(self, target_path):
+        """Detect the dominant programming language in target"""
+        if not os.path.exists(target_path):
+            return None
+        
+        language_counts = {}
+        extensions = ['.rs', '.ts', '.tsx', '.js', '.jsx', '.py', '.go', '.java', '.cpp', '.c', '.h']
+        
+        if os.path.isfile(target_path):
+            ext = os.path.splitext(target_path)[1]
+            if ext in extensions:
+                return self.get_language_from_extension(ext)
+            return None
+        
+        # Count files by language
+        for root, dirs, files in os.walk(target_path):
+            dirs[:] = [d for d in dirs if d not in ['node_modules', 'target', 'build', 'dist', '.git']]
+            for file in files:
+                ext = os.path.splitext(file)[1]
+                if ext in extensions:
+                    lang = self.get_language_from_extension(ext)
+                    language_counts[lang] = language_counts.get(lang, 0) + 1
+        
+        if not language_counts:
+            return None
+        
+        # Return most common language
+        return max(language_counts, key=language_counts.get)
+    
+    def get_language_from_extension(self, ext):
+        """Map file extension to language name"""
+        ext_map = {
+            '.rs': 'rust',
+            '.ts': 'typescript', '.tsx': 'typescript',
+            '.js': 'javascript', '.jsx': 'javascript',
+            '.py': 'python',
+            '.go': 'go',
+            '.java': 'java',
+            '.cpp': 'cpp', '.c': 'c', '.h': 'c'
+        }
+        return ext_map.get(ext, 'general')
+    
+    def get_best_model_for_language(self, language):
+        """Get the best available model for a specific language"""
+        available_models = self.available_models()
+        
+        # Model preferences by language
+        language_models = {
+            'rust': ['granite-code', 'deepseek-coder', 'codellama'],
+            'typescript': ['granite-code', 'deepseek-coder', 'codegemma'],
+            'javascript': ['granite-code', 'deepseek-coder', 'codegemma'],
+            'python': ['deepseek-coder', 'granite-code', 'codellama'],
+            'go': ['granite-code', 'deepseek-coder', 'codellama'],
+            'java': ['granite-code', 'deepseek-coder', 'codellama'],
+            'cpp': ['granite-code', 'deepseek-coder', 'codellama'],
+            'c': ['granite-code', 'deepseek-coder', 'codellama']
+        }
+        
+        preferred_models = language_models.get(language, ['granite-code', 'deepseek-coder'])
+        
+        # Find best available model
+        for preferred in preferred_models:
+            for model in available_models:
+                if preferred in model.lower():
+                    return model
+        
+        # Fallback to first code model
+        for model in available_models:
+            if '🚀' in model:
+                return model
+        
+        return available_models[0] if available_models else 'granite-code:latest'
+
+class OllamaCodeCheckerGUI(AnalysisEngine):
+    def __init__(self, root, host=OLLAMA_HOST, start_server=True):
         self.root = root
         self.root.title("Ollama Code Checker")
         self.root.geometry("900x700")
@@ -19,16 +4870,27 @@ class OllamaCodeCheckerGUI:
         self.models_path = "/run/media/garuda/73cf9511-0af0-4ac4-9d83-ee21eb17ff5d/models"
         
         # Variables
+        super().__init__(host)  # Client (for the server started below), indexes
         self.analysis_running = False
-        self.current_process = None
+        self.cancel_token = CancelToken()  # Replaced for every run; Stop cancels it
+        self.run_log = RunLog()  # Output pane contents, on disk
         self.analyzed_files = []  # Store files from last analysis
         self.last_analysis_target = None
         self.last_analysis_type = None
         self.git_info = {}  # Store git repository information
+        self.resume_journal = None  # Unfinished run journal the user chose to resume
+        self.watcher = None  # FileWatcher while watch mode is on
+        self.watch_pending = {}  # Saved files waiting for re-analysis, oldest first
+        self.watch_condition = threading.Condition()
+        self.watch_idle = threading.Event()  # Clear while watch mode has work; full runs yield to it
+        self.watch_idle.set()
+        self.run_progress = None  # RunProgress of the running analysis, drives the bar
+        self.profiler = None  # PipelineProfiler of the running analysis, when profiling
         
         self.setup_ui()
         self.load_available_models()
-        self.start_ollama_service()
+        if start_server:
+            self.start_ollama_service()
     
     def setup_ui(self):
         # Main frame
@@ -71,6 +4933,25 @@ class OllamaCodeCheckerGUI:
             ttk.Radiobutton(analysis_frame, text=text, variable=self.analysis_var, 
                            value=value).grid(row=i//3, column=i%3, padx=(0, 15), pady=2, sticky=tk.W)
         
+        # Identical files are always analyzed once; this widens "identical"
+        self.dedup_whitespace_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(analysis_frame, text="🧬 Treat files differing only in whitespace as duplicates",
+                        variable=self.dedup_whitespace_var).grid(row=2, column=0, columnspan=3, pady=2, sticky=tk.W)
+        
+        self.retrieval_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(analysis_frame, text=f"🧲 Add related code from the repository ({EMBED_MODEL} embeddings)",
+                        variable=self.retrieval_var).grid(row=3, column=0, columnspan=3, pady=2, sticky=tk.W)
+        
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(analysis_frame, text="📈 Profile runs (stage times, CPU samples, allocations)",
+                        variable=self.profile_var).grid(row=4, column=0, columnspan=3, pady=2, sticky=tk.W)
+        
+        self.unit_cache_var = tk.BooleanVar(value=self.unit_cache)
+        ttk.Checkbutton(analysis_frame, text="🧩 Re-analyze only changed functions (reuse findings of the rest)",
+                        variable=self.unit_cache_var,
+                        command=lambda: setattr(self, 'unit_cache', self.unit_cache_var.get())
+                        ).grid(row=5, column=0, columnspan=3, pady=2, sticky=tk.W)
+        
         # Target selection
         ttk.Label(main_frame, text="Target:", font=('Arial', 10, 'bold')).grid(row=3, column=0, sticky=tk.W, pady=5)
         target_frame = ttk.Frame(main_frame)
@@ -90,6 +4971,8 @@ class OllamaCodeCheckerGUI:
                   command=self.browse_file).grid(row=0, column=2, padx=(5, 0))
         ttk.Button(target_frame, text="🤖 Auto-Select Model", 
                   command=self.auto_select_model).grid(row=0, column=3, padx=(5, 0))
+        ttk.Button(target_frame, text="📌 Pin Files", 
+                  command=self.pin_files).grid(row=0, column=4, padx=(5, 0))
         
         # Git info section
         git_frame = ttk.LabelFrame(main_frame, text="📋 Repository Info", padding="5")
@@ -146,16 +5029,40 @@ class OllamaCodeCheckerGUI:
         ttk.Button(button_frame, text="💾 Save Report", 
                   command=self.save_report).grid(row=0, column=6)
         
+        ttk.Button(button_frame, text="🔎 Query Findings", 
+                  command=self.show_findings_query).grid(row=1, column=0, padx=(0, 10), pady=(5, 0))
+        
+        ttk.Button(button_frame, text="📍 Jump to File", 
+                  command=self.jump_to_file).grid(row=1, column=1, padx=(0, 10), pady=(5, 0))
+        
+        ttk.Button(button_frame, text="📦 Batch Analysis", 
+                  command=self.show_batch_dialog).grid(row=1, column=2, padx=(0, 10), pady=(5, 0))
+        
+        ttk.Button(button_frame, text="🌿 Analyze Ref", 
+                  command=self.start_ref_analysis).grid(row=1, column=3, padx=(0, 10), pady=(5, 0))
+        
+        self.watch_button = ttk.Button(button_frame, text="👁️ Watch Target", 
+                                      command=self.toggle_watch)
+        self.watch_button.grid(row=1, column=4, padx=(0, 10), pady=(5, 0))
+        
+        ttk.Button(button_frame, text="🎲 Sample Estimate", 
+                  command=self.start_sample).grid(row=1, column=5, padx=(0, 10), pady=(5, 0))
+        
+        ttk.Button(button_frame, text="🧬 Find Duplicates", 
+                  command=self.start_clone_report).grid(row=1, column=6, pady=(5, 0))
+        
         # Output area
         output_frame = ttk.LabelFrame(main_frame, text="📊 Analysis Output", padding="5")
         output_frame.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(10, 0))
         output_frame.columnconfigure(0, weight=1)
         output_frame.rowconfigure(0, weight=1)
         
-        self.output_text = scrolledtext.ScrolledText(output_frame, wrap=tk.WORD, 
-                                                    height=25, state=tk.NORMAL,
-                                                    font=('Consolas', 9))
-        self.output_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        # Virtualized: only the visible part of the on-disk run log is loaded
+        self.output_view = LogView(output_frame, wrap=tk.WORD, 
+                                   height=25, state=tk.NORMAL,
+                                   font=('Consolas', 9))
+        self.output_view.set_log(self.run_log)
+        self.output_text = self.output_view.text
         
         # Make text selectable but prevent editing except for copy operations
         self.output_text.bind('<Key>', self.on_key_press)
@@ -367,34 +5274,11 @@ class OllamaCodeCheckerGUI:
                 status_text += f" | ✅ Clean"
             
             self.git_status_var.set(status_text)
-            
+        
         except Exception as e:
             self.git_status_var.set(f"❌ Git error: {str(e)}")
             self.git_info = {}
     
-    def find_git_root(self, path):
-        """Find the root of a git repository"""
-        current_path = Path(path).resolve()
-        
-        while current_path != current_path.parent:
-            if (current_path / '.git').exists():
-                return str(current_path)
-            current_path = current_path.parent
-        
-        return None
-    
-    def run_git_command(self, cwd, args):
-        """Run a git command in the specified directory"""
-        result = subprocess.run(
-            ['git'] + args,
-            cwd=cwd,
-            capture_output=True,
-            text=True
-        )
-        if result.returncode != 0:
-            raise Exception(f"Git command failed: {result.stderr}")
-        return result.stdout
-    
     def show_git_status(self):
         """Show detailed git status"""
         if not self.git_info:
@@ -538,74 +5422,584 @@ class OllamaCodeCheckerGUI:
         }
         return status_map.get(status_code.strip(), '📄')
     
-    def append_output(self, text):
-        """Append text to output area"""
-        # Text is always in NORMAL state for selection, just insert and scroll
-        self.output_text.insert(tk.END, text)
-        self.output_text.see(tk.END)
-        self.root.update_idletasks()
+    def set_status(self, text):
+        self.root.after(0, self.status_var.set, text)
+    
+    def available_models(self):
+        return self.model_combo['values']
+    
+    def report_progress(self, progress):
+        """Drive the progress bar and status line from the run's estimator"""
+        if self.run_progress is None:
+            self.run_progress = progress
+            self.root.after(0, self.tick_progress)
+        self.run_progress = progress
+    
+    def tick_progress(self):
+        """Refresh bar and ETA every second while a run has an estimator"""
+        progress = self.run_progress
+        if progress is None:
+            return
+        if str(self.progress['mode']) != 'determinate':
+            self.progress.stop()
+            self.progress.config(mode='determinate', maximum=1000)
+        self.progress['value'] = 1000 * progress.fraction()
+        self.status_var.set(progress.describe())
+        self.root.after(1000, self.tick_progress)
+    
+    @profiled('output')
+    def write_output(self, text, marker=None):
+        """Append text to the run log and the output area
+
+        marker labels the line for Jump to File (usually a file path).
+        Called from worker threads: the view shows it from the Tk thread.
+        """
+        log = self.run_log
+        self.output_view.post(log, log.append(text, marker), text)
+    
+    def clear_output(self):
+        """Clear output area by starting a new run log"""
+        self.run_log.close()
+        self.run_log = RunLog()
+        self.output_view.set_log(self.run_log)
+    
+    def jump_to_file(self):
+        """Scroll the output to a file's section via the log's marker index"""
+        markers = list(self.run_log.markers)
+        if not markers:
+            messagebox.showinfo("Jump to File", "No files in the current output yet.")
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Jump to File")
+        dialog.geometry("600x400")
+        dialog.columnconfigure(0, weight=1)
+        dialog.rowconfigure(1, weight=1)
+        
+        filter_var = tk.StringVar()
+        filter_entry = ttk.Entry(dialog, textvariable=filter_var)
+        filter_entry.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=10, pady=(10, 5))
+        file_list = tk.Listbox(dialog, font=('Consolas', 9))
+        file_list.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=(0, 10))
+        shown = []
+        
+        def refresh(*args):
+            needle = filter_var.get().lower()
+            shown[:] = [(line, label) for line, label in markers if needle in label.lower()]
+            file_list.delete(0, tk.END)
+            for line, label in shown:
+                file_list.insert(tk.END, f"{line + 1:>8}  {label}")
+        
+        def jump(event=None):
+            selection = file_list.curselection()
+            if selection:
+                self.output_view.scroll_to(shown[selection[0]][0])
+                dialog.destroy()
+        
+        filter_var.trace_add('write', refresh)
+        file_list.bind('<Double-Button-1>', jump)
+        file_list.bind('<Return>', jump)
+        refresh()
+        filter_entry.focus_set()
+    
+    def save_report(self):
+        """Save analysis report to file"""
+        if not self.run_log.size:
+            messagebox.showwarning("No Content", "No analysis output to save.")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".md",
+            filetypes=[("Markdown files", "*.md"), ("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if file_path:
+            try:
+                self.run_log.copy_to(file_path)
+                messagebox.showinfo("Saved", f"Report saved to {file_path}")
+                self.status_var.set(f"Report saved: {file_path}")
+            except Exception as e:
+                messagebox.showerror("Error", f"Could not save file: {e}")
+    
+    def start_analysis(self):
+        """Start code analysis"""
+        if self.analysis_running:
+            return
+        
+        target = self.target_var.get().strip()
+        if not target:
+            messagebox.showerror("Error", "Please select a target file or directory.")
+            return
+        
+        if not os.path.exists(target):
+            messagebox.showerror("Error", f"Target path does not exist: {target}")
+            return
+        
+        # Clean model name (remove emoji prefix)
+        model = self.model_var.get().replace('🚀 ', '').strip()
+        
+        self.check_resume('analysis', target, self.analysis_var.get(), model)
+        
+        self.analysis_running = True
+        self.analyze_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.progress.start()
+        self.status_var.set("Running analysis...")
+        
+        # Clear previous output
+        self.clear_output()
+        
+        # Run analysis in separate thread
+        self.cancel_token = CancelToken()
+        thread = threading.Thread(target=self.run_analysis)
+        thread.daemon = True
+        thread.start()
+    
+    def show_batch_dialog(self):
+        """Edit a list of targets (each with its own type and model) and run them as one batch"""
+        if self.analysis_running:
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Batch Analysis")
+        dialog.geometry("700x350")
+        dialog.columnconfigure(0, weight=1)
+        dialog.rowconfigure(1, weight=1)
+        
+        ttk.Label(dialog, text="One target per line:  path | analysis type | model   "
+                               "(type defaults to cleanup, model to auto)").grid(
+            row=0, column=0, columnspan=2, sticky=tk.W, padx=10, pady=(10, 5))
+        spec_text = tk.Text(dialog, font=('Consolas', 9), height=12)
+        spec_text.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10)
+        target = self.target_var.get().strip()
+        if target:
+            model = self.model_var.get().replace('🚀 ', '').strip()
+            spec_text.insert(tk.END, f"{target} | {self.analysis_var.get()} | {model}\n")
+        
+        def run():
+            try:
+                jobs = parse_batch_spec(spec_text.get(1.0, tk.END))
+            except ValueError as e:
+                messagebox.showerror("Batch Analysis", str(e), parent=dialog)
+                return
+            if not jobs:
+                return
+            dialog.destroy()
+            self.start_batch(jobs)
+        
+        ttk.Button(dialog, text="🚀 Run Batch", command=run).grid(row=2, column=0, pady=10)
+        ttk.Button(dialog, text="Cancel", command=dialog.destroy).grid(row=2, column=1, pady=10)
+    
+    def start_batch(self, jobs):
+        self.analysis_running = True
+        self.analyze_button.config(state=tk.DISABLED)
+        self.autofix_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.progress.start()
+        self.status_var.set("Running batch analysis...")
+        self.clear_output()
+        
+        self.cancel_token = CancelToken()
+        thread = threading.Thread(target=self.run_batch_worker, args=(jobs,))
+        thread.daemon = True
+        thread.start()
     
-    def clear_output(self):
-        """Clear output area"""
-        # Text is always in NORMAL state, just delete content
-        self.output_text.delete(1.0, tk.END)
+    def run_batch_worker(self, jobs):
+        token = self.cancel_token
+        self.begin_profile()
+        try:
+            self.run_batch(jobs, token)
+        except Cancelled:
+            self.report_stopped(None, "Results of finished files are in the findings database.\n")
+        except Exception as e:
+            self.append_output(f"\n❌ Batch error: {e}\n")
+        finally:
+            self.root.after(0, self.analysis_finished)
     
-    def save_report(self):
-        """Save analysis report to file"""
-        if not self.output_text.get(1.0, tk.END).strip():
-            messagebox.showwarning("No Content", "No analysis output to save.")
+    def start_ref_analysis(self):
+        """Analyze a branch, tag, commit or range of the target's repository without checking it out"""
+        if self.analysis_running:
             return
         
-        file_path = filedialog.asksaveasfilename(
-            defaultextension=".md",
-            filetypes=[("Markdown files", "*.md"), ("Text files", "*.txt"), ("All files", "*.*")]
-        )
-        if file_path:
-            try:
-                with open(file_path, 'w') as f:
-                    f.write(self.output_text.get(1.0, tk.END))
-                messagebox.showinfo("Saved", f"Report saved to {file_path}")
-                self.status_var.set(f"Report saved: {file_path}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Could not save file: {e}")
+        target = self.target_var.get().strip()
+        repo = self.find_git_root(target) if target and os.path.exists(target) else None
+        if not repo:
+            messagebox.showerror("Error", "The target is not inside a git repository.")
+            return
+        
+        spec = simpledialog.askstring(
+            "Analyze Ref",
+            f"Ref or range to analyze in {os.path.basename(repo)}\n(e.g. feature, v1.2, main..feature):",
+            parent=self.root)
+        if not spec or not spec.strip():
+            return
+        
+        model = self.model_var.get().replace('🚀 ', '').strip()
+        analysis_type = self.analysis_var.get()
+        
+        self.analysis_running = True
+        self.analyze_button.config(state=tk.DISABLED)
+        self.autofix_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.progress.start()
+        self.status_var.set(f"Analyzing {spec.strip()}...")
+        self.clear_output()
+        
+        self.cancel_token = CancelToken()
+        thread = threading.Thread(target=self.run_ref_worker, args=(repo, spec.strip(), analysis_type, model))
+        thread.daemon = True
+        thread.start()
     
-    def start_analysis(self):
-        """Start code analysis"""
+    def run_ref_worker(self, repo, spec, analysis_type, model):
+        token = self.cancel_token
+        self.begin_profile()
+        try:
+            self.run_tree_analysis(repo, spec, analysis_type, model, token)
+        except Cancelled:
+            self.report_stopped(None, "Results of finished files are in the findings database.\n")
+        except Exception as e:
+            self.append_output(f"\n❌ Ref analysis error: {e}\n")
+        finally:
+            self.root.after(0, self.analysis_finished)
+    
+    def start_sample(self):
+        """Estimate issue rates of a large target from a time-budgeted sample"""
         if self.analysis_running:
             return
         
         target = self.target_var.get().strip()
-        if not target:
-            messagebox.showerror("Error", "Please select a target file or directory.")
+        if not target or not os.path.isdir(target):
+            messagebox.showerror("Error", "Please select a target directory to sample.")
             return
         
-        if not os.path.exists(target):
-            messagebox.showerror("Error", f"Target path does not exist: {target}")
+        minutes = simpledialog.askfloat("Sample Estimate", "Time budget in minutes:",
+                                        initialvalue=10, minvalue=0.1, parent=self.root)
+        if not minutes:
             return
         
-        # Clean model name (remove emoji prefix)
         model = self.model_var.get().replace('🚀 ', '').strip()
+        analysis_type = self.analysis_var.get()
         
         self.analysis_running = True
         self.analyze_button.config(state=tk.DISABLED)
+        self.autofix_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
         self.progress.start()
-        self.status_var.set("Running analysis...")
+        self.status_var.set(f"Sampling for {minutes:g} minutes...")
+        self.clear_output()
         
-        # Clear previous output
+        self.cancel_token = CancelToken()
+        thread = threading.Thread(target=self.run_sample_worker, args=(target, analysis_type, model, minutes * 60))
+        thread.daemon = True
+        thread.start()
+    
+    def run_sample_worker(self, target, analysis_type, model, seconds):
+        token = self.cancel_token
+        self.begin_profile()
+        try:
+            self.run_sample(target, analysis_type, model, token, seconds=seconds)
+        except Cancelled:
+            self.report_stopped(None, "Sampled files are kept; sample again to extend the estimate.\n")
+        except Exception as e:
+            self.append_output(f"\n❌ Sampling error: {e}\n")
+        finally:
+            self.root.after(0, self.analysis_finished)
+    
+    def start_clone_report(self):
+        """List near-duplicate code across the repository of the target"""
+        if self.analysis_running:
+            return
+        
+        target = self.target_var.get().strip()
+        if not target or not os.path.exists(target):
+            messagebox.showerror("Error", "Please select a valid target directory or file.")
+            return
+        
+        self.analysis_running = True
+        self.analyze_button.config(state=tk.DISABLED)
+        self.autofix_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.progress.start()
+        self.status_var.set("Searching for near-duplicate code...")
         self.clear_output()
         
-        # Run analysis in separate thread
-        thread = threading.Thread(target=self.run_analysis)
+        self.cancel_token = CancelToken()
+        thread = threading.Thread(target=self.run_clone_worker, args=(target,))
+        thread.daemon = True
+        thread.start()
+    
+    def run_clone_worker(self, target):
+        token = self.cancel_token
+        self.begin_profile()
+        try:
+            self.run_clone_report(target, token)
+        except Cancelled:
+            self.report_stopped(None, "The clone index keeps the files hashed so far.\n")
+        except Exception as e:
+            self.append_output(f"\n❌ Duplicate search error: {e}\n")
+        finally:
+            self.root.after(0, self.analysis_finished)
+    
+    def toggle_watch(self):
+        """Re-analyze files of the target as they are saved"""
+        if self.watcher:
+            self.stop_watch()
+            return
+        
+        target = self.target_var.get().strip()
+        if not target or not os.path.exists(target):
+            messagebox.showerror("Error", "Please select a valid target directory or file to watch.")
+            return
+        model = self.model_var.get().replace('🚀 ', '').strip()
+        if not model:
+            messagebox.showerror("Error", "Please select a model.")
+            return
+        analysis_type = self.analysis_var.get()
+        
+        self.show_watch_window(target)
+        self.watch_token = CancelToken()
+        run_id = self.findings_db.start_run('watch', target, analysis_type, model)
+        self.watch_hashes = {}  # Content last analyzed per file; saves without changes are skipped
+        thread = threading.Thread(target=self.watch_worker,
+                                  args=(target, model, analysis_type, run_id, self.watch_token))
         thread.daemon = True
         thread.start()
+        self.watcher = FileWatcher(target, self.queue_watched_files).start()
+        self.watch_button.config(text="⏹️ Stop Watching")
+        self.append_output(f"👁️ Watching {target} ({analysis_type}, {model}); saved files are re-analyzed\n\n")
+    
+    def stop_watch(self):
+        self.watcher.stop()
+        self.watcher = None
+        self.watch_token.cancel()
+        with self.watch_condition:
+            self.watch_pending.clear()
+            self.watch_condition.notify_all()
+        self.watch_idle.set()
+        self.watch_button.config(text="👁️ Watch Target")
+        if self.watch_window.winfo_exists():
+            self.watch_window.destroy()
+        self.append_output("👁️ Stopped watching\n")
+    
+    def queue_watched_files(self, paths):
+        """FileWatcher callback: queue saved files, once each"""
+        with self.watch_condition:
+            for path in paths:
+                self.watch_pending.pop(path, None)
+                self.watch_pending[path] = True
+            self.watch_idle.clear()
+            self.watch_condition.notify_all()
+    
+    def watch_worker(self, target, model, analysis_type, run_id, token):
+        base = target if os.path.isdir(target) else os.path.dirname(target)
+        try:
+            while True:
+                with self.watch_condition:
+                    while not self.watch_pending:
+                        self.watch_idle.set()
+                        token.check()
+                        self.watch_condition.wait(1.0)
+                    file_path = next(iter(self.watch_pending))
+                    del self.watch_pending[file_path]
+                
+                content_hash = file_content_hash(file_path)
+                if content_hash is None:
+                    continue  # Deleted or renamed away since it was saved
+                if self.watch_hashes.get(file_path) == content_hash:
+                    continue
+                
+                self.root.after(0, self.update_watch_row, file_path, base, "analyzing", "")
+                saved = time.strftime('%H:%M:%S')
+                self.append_output(f"👁️ {saved} {os.path.relpath(file_path, base)} saved, re-analyzing\n", file_path)
+                try:
+                    status, result = self.analyze_file(model, file_path, analysis_type, token,
+                                                       preprocessed=False)
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    status, result = 'error', str(e)
+                    self.append_output(f"❌ {e}\n\n")
+                self.watch_hashes[file_path] = content_hash
+                count = self.findings_db.record_analysis(run_id, file_path, status, result, analysis_type,
+                                                         content_hash=content_hash)
+                self.root.after(0, self.update_watch_row, file_path, base, status, count)
+        except Cancelled:
+            pass
+        finally:
+            self.findings_db.finish_run(run_id)
+    
+    def wait_for_watch(self, token):
+        """Let files saved during a full run go first"""
+        while not self.watch_idle.wait(0.25):
+            token.check()
+    
+    def show_watch_window(self, target):
+        """One row per watched file, updated in place as it is re-analyzed"""
+        self.watch_window = tk.Toplevel(self.root)
+        self.watch_window.title(f"Watching {os.path.basename(os.path.abspath(target))}")
+        self.watch_window.geometry("650x300")
+        self.watch_window.columnconfigure(0, weight=1)
+        self.watch_window.rowconfigure(0, weight=1)
+        self.watch_window.protocol("WM_DELETE_WINDOW", self.stop_watch)
+        
+        self.watch_tree = ttk.Treeview(self.watch_window, columns=('status', 'findings', 'time'))
+        self.watch_tree.heading('#0', text="File")
+        self.watch_tree.heading('status', text="Status")
+        self.watch_tree.heading('findings', text="Findings")
+        self.watch_tree.heading('time', text="Analyzed")
+        self.watch_tree.column('#0', width=360)
+        for column in ('status', 'findings', 'time'):
+            self.watch_tree.column(column, width=90, anchor=tk.CENTER)
+        self.watch_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=10)
+        
+        def jump(event=None):
+            # Latest result of the file in the output
+            for file_path in self.watch_tree.selection():
+                lines = [line for line, label in self.run_log.markers if label == file_path]
+                if lines:
+                    self.output_view.scroll_to(lines[-1])
+        
+        self.watch_tree.bind('<Double-Button-1>', jump)
+        ttk.Label(self.watch_window, text="Double-click a file to show its latest result").grid(
+            row=1, column=0, sticky=tk.W, padx=10, pady=(0, 10))
+    
+    def update_watch_row(self, file_path, base, status, findings):
+        if not self.watch_window.winfo_exists():
+            return
+        values = (status, findings, time.strftime('%H:%M:%S') if status != 'analyzing' else '')
+        if self.watch_tree.exists(file_path):
+            self.watch_tree.item(file_path, values=values)
+            self.watch_tree.move(file_path, '', 0)
+        else:
+            self.watch_tree.insert('', 0, iid=file_path, text=os.path.relpath(file_path, base), values=values)
     
     def stop_analysis(self):
         """Stop running analysis"""
-        if self.current_process:
-            self.current_process.terminate()
-        self.analysis_finished()
-        self.append_output("\n🛑 Analysis stopped by user\n")
+        # Aborts in-flight requests and git calls; the worker prints a partial
+        # summary and calls analysis_finished once it has unwound
+        self.cancel_token.cancel()
+        self.stop_button.config(state=tk.DISABLED)
+        self.status_var.set("Stopping...")
+    
+    def report_stopped(self, journal, summary=''):
+        """Partial summary for a run the user stopped"""
+        self.append_output("\n🛑 Stopped by user")
+        if journal:
+            self.append_output(f" - {len(journal.records)}/{len(journal.files)} files done. "
+                               "Progress is saved; start the same run again to resume.")
+        self.append_output("\n")
+        if summary:
+            self.append_output(summary)
+    
+    def pin_files(self):
+        """Choose files that should be analyzed before everything else"""
+        target = self.target_var.get().strip()
+        initial_dir = target if os.path.isdir(target) else os.path.dirname(target)
+        files = filedialog.askopenfilenames(
+            title="Pin Files (analyzed first)",
+            initialdir=initial_dir or os.path.expanduser("~"),
+            filetypes=[
+                ("Code files", "*.py *.rs *.ts *.tsx *.js *.jsx *.go *.java *.cpp *.c *.h"),
+                ("All files", "*.*")
+            ]
+        )
+        if files:
+            self.pinned_paths = list(files)
+            self.status_var.set(f"📌 {len(self.pinned_paths)} pinned files will be analyzed first")
+        elif self.pinned_paths and messagebox.askyesno(
+                "Clear Pinned Files", f"Clear the {len(self.pinned_paths)} pinned files?"):
+            self.pinned_paths = []
+            self.status_var.set("Pinned files cleared")
+    
+    def show_findings_query(self):
+        """Query indexed findings across all stored runs"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Query Findings")
+        dialog.resizable(False, False)
+        
+        severity_var = tk.StringVar(value="any")
+        category_var = tk.StringVar(value="any")
+        days_var = tk.StringVar(value="")
+        changed_var = tk.BooleanVar(value=False)
+        path_var = tk.StringVar(value=self.target_var.get().strip())
+        
+        ttk.Label(dialog, text="Severity:").grid(row=0, column=0, sticky=tk.W, padx=10, pady=5)
+        ttk.Combobox(dialog, textvariable=severity_var, state='readonly', width=12,
+                     values=['any', 'high', 'medium', 'low', 'unrated']).grid(row=0, column=1, sticky=tk.W, padx=10)
+        ttk.Label(dialog, text="Category:").grid(row=1, column=0, sticky=tk.W, padx=10, pady=5)
+        ttk.Combobox(dialog, textvariable=category_var, state='readonly', width=12,
+                     values=['any', 'errors', 'style', 'security', 'performance', 'cleanup', 'general']
+                     ).grid(row=1, column=1, sticky=tk.W, padx=10)
+        ttk.Label(dialog, text="Within last N days:").grid(row=2, column=0, sticky=tk.W, padx=10, pady=5)
+        ttk.Entry(dialog, textvariable=days_var, width=8).grid(row=2, column=1, sticky=tk.W, padx=10)
+        ttk.Checkbutton(dialog, text="Only files changed in that period",
+                        variable=changed_var).grid(row=3, column=0, columnspan=2, sticky=tk.W, padx=10, pady=5)
+        ttk.Label(dialog, text="Path prefix:").grid(row=4, column=0, sticky=tk.W, padx=10, pady=5)
+        ttk.Entry(dialog, textvariable=path_var, width=50).grid(row=4, column=1, sticky=tk.W, padx=10)
+        
+        def run_query():
+            cutoff = None
+            if days_var.get().strip():
+                try:
+                    days = float(days_var.get())
+                except ValueError:
+                    messagebox.showerror("Error", "Days must be a number.", parent=dialog)
+                    return
+                cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec='seconds')
+            findings = self.findings_db.query(
+                severity=None if severity_var.get() == 'any' else severity_var.get(),
+                category=None if category_var.get() == 'any' else category_var.get(),
+                since=None if changed_var.get() else cutoff,
+                changed_since=cutoff if changed_var.get() else None,
+                path_prefix=path_var.get().strip() or None)
+            dialog.destroy()
+            self.show_findings(findings)
+        
+        ttk.Button(dialog, text="🔎 Search", command=run_query).grid(row=5, column=0, columnspan=2, pady=10)
+    
+    def show_findings(self, findings):
+        """Print query results grouped by file"""
+        self.clear_output()
+        self.append_output(f"🔎 {len(findings)} findings\n")
+        self.append_output("=" * 50 + "\n")
+        current_path = None
+        for finding in findings:
+            if finding['path'] != current_path:
+                current_path = finding['path']
+                self.append_output("\n")
+                self.append_output(f"📄 {current_path}\n", current_path)
+            lines = str(finding['line_start'])
+            if finding['line_end'] != finding['line_start']:
+                lines += f"-{finding['line_end']}"
+            self.append_output(f"  [{finding['severity']}/{finding['category']}] line {lines}: {finding['message']}\n")
+        
+        paths = []
+        for finding in findings:
+            if finding['path'] not in paths and os.path.exists(finding['path']):
+                paths.append(finding['path'])
+        if paths and not self.analysis_running:
+            self.analyzed_files = paths
+            self.fix_button.config(state=tk.NORMAL)
+            self.status_var.set(f"{len(findings)} findings in {len(paths)} files - 'Fix Issues' will fix these files")
+    
+    def check_resume(self, mode, target, analysis_type, model):
+        """Offer to resume an interrupted run of the same kind"""
+        self.resume_journal = None
+        key = RunJournal.run_key(mode, target, analysis_type, model)
+        journal = RunJournal.find_incomplete(key)
+        if not journal:
+            return
+        
+        result = messagebox.askyesno(
+            "Resume Interrupted Run",
+            f"An unfinished {mode} run for this target was found "
+            f"({len(journal.records)}/{len(journal.files)} files done, "
+            f"started {journal.header.get('started', 'unknown')}).\n\n"
+            "Resume where it stopped? Choose No to start over."
+        )
+        if result:
+            self.resume_journal = journal
+        else:
+            journal.discard()
     
     def start_autofix_analysis(self):
         """Start analysis with auto-fix capability"""
@@ -636,6 +6030,8 @@ class OllamaCodeCheckerGUI:
         # Clean model name (remove emoji prefix)
         model = self.model_var.get().replace('🚀 ', '').strip()
         
+        self.check_resume('autofix', target, self.analysis_var.get(), model)
+        
         self.analysis_running = True
         self.analyze_button.config(state=tk.DISABLED)
         self.autofix_button.config(state=tk.DISABLED)
@@ -647,12 +6043,16 @@ class OllamaCodeCheckerGUI:
         self.clear_output()
         
         # Run analysis in separate thread
+        self.cancel_token = CancelToken()
         thread = threading.Thread(target=self.run_autofix_analysis)
         thread.daemon = True
         thread.start()
     
     def run_analysis(self):
         """Run the actual analysis using direct ollama commands"""
+        token = self.cancel_token
+        self.begin_profile()
+        journal = None
         try:
             target = self.target_var.get().strip()
             model = self.model_var.get().replace('🚀 ', '').strip()
@@ -665,29 +6065,22 @@ class OllamaCodeCheckerGUI:
             self.append_output(f"🔍 Analysis: {analysis_type}\n")
             self.append_output("=" * 50 + "\n\n")
             
-            # Set environment
-            env = os.environ.copy()
-            env['OLLAMA_MODELS'] = self.models_path
-            env['CUDA_VISIBLE_DEVICES'] = '0'  # Use GPU
+            journal = self.resume_journal
+            self.resume_journal = None
+            self.prompt_tokens = [0, 0]
             
-            if os.path.isfile(target):
-                files_to_analyze = [target]
+            if journal:
+                files_to_analyze = journal.files
+                duplicates = journal.header.get('duplicates', {})
+                self.append_output(f"♻️ Resuming interrupted run: {len(journal.records)}/{len(files_to_analyze)} files already done\n\n")
             else:
-                # Find code files in directory
-                extensions = ['.rs', '.ts', '.tsx', '.js', '.jsx', '.py', '.go', '.java', '.cpp', '.c', '.h']
-                files_to_analyze = []
-                for root, dirs, files in os.walk(target):
-                    # Skip common build/dependency directories
-                    dirs[:] = [d for d in dirs if d not in ['node_modules', 'target', 'build', 'dist', '.git', '__pycache__']]
-                    for file in files:
-                        if any(file.endswith(ext) for ext in extensions):
-                            file_path = os.path.join(root, file)
-                            # Skip very large files (>100KB for better analysis)
-                            try:
-                                if os.path.getsize(file_path) < 100000:  # 100KB limit
-                                    files_to_analyze.append(file_path)
-                            except OSError:
-                                pass  # Skip if can't get file size
+                # Skip very large files (>100KB for better analysis)
+                files_to_analyze = self.discover_files(target, 100000, token)
+                # Analyze one copy of each group of identical files
+                duplicates = group_duplicates(files_to_analyze, self.dedup_whitespace_var.get(), token)
+                files_to_analyze = list(duplicates)
+                duplicates = {path: copies for path, copies in duplicates.items() if copies}
+            saved_requests = sum(len(copies) for copies in duplicates.values())
             
             if not files_to_analyze:
                 self.append_output("⚠️ No code files found to analyze.\n")
@@ -696,273 +6089,101 @@ class OllamaCodeCheckerGUI:
             # Show warning for large codebases
             if len(files_to_analyze) > 100:
                 self.append_output(f"⚠️  Large codebase detected: {len(files_to_analyze)} files\n")
-                self.append_output("This may take a while. Consider analyzing smaller directories first.\n\n")
-            else:
-                self.append_output(f"📊 Found {len(files_to_analyze)} files to analyze\n\n")
-            
-            for i, file_path in enumerate(files_to_analyze, 1):
-                if not self.analysis_running:
-                    break
-                    
-                self.append_output(f"[{i}/{len(files_to_analyze)}] 🔍 Analyzing: {os.path.basename(file_path)}\n")
-                
-                # Read file content
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()[:15000]  # Increase limit for better analysis
-                    
-                    if not content.strip():
-                        self.append_output(f"⚠️ Skipping empty file: {os.path.basename(file_path)}\n\n")
-                        continue
-                        
-                except Exception as e:
-                    self.append_output(f"❌ Error reading file: {e}\n\n")
-                    continue
-                
-                # Create analysis prompt
-                prompt = self.create_analysis_prompt(file_path, content, analysis_type)
-                
-                # Debug: Show content size
-                self.append_output(f"   Content size: {len(content)} chars\n")
-                
-                # Run Ollama analysis
-                try:
-                    self.current_process = subprocess.Popen(
-                        ['ollama', 'run', model],
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        env=env
-                    )
-                    
-                    stdout, _ = self.current_process.communicate(input=prompt, timeout=300)
-                    
-                    if stdout:
-                        # Clean up terminal control sequences
-                        clean_output = self.clean_terminal_output(stdout)
-                        
-                        # Check for common unhelpful responses
-                        unhelpful_phrases = [
-                            "i don't have access",
-                            "i cannot access",
-                            "i'm unable to see",
-                            "i can't see the code",
-                            "no code provided",
-                            "code is not provided",
-                            "i need to see the code",
-                            "i need more information",
-                            "please provide",
-                            "provide me with",
-                            "i'd be happy to help",
-                            "sure, i can analyze",
-                            "please provide the file",
-                            "provide more context",
-                            "it appears to be incomplete",
-                            "cannot provide a detailed analysis",
-                            "// your comprehensive code analysis goes here"
-                        ]
-                        
-                        is_unhelpful = any(phrase in clean_output.lower() for phrase in unhelpful_phrases)
-                        
-                        if clean_output.strip() and not is_unhelpful:
-                            self.append_output(f"✅ Results for {os.path.basename(file_path)}:\n")
-                            self.append_output("-" * 40 + "\n")
-                            self.append_output(clean_output)
-                            self.append_output("\n" + "=" * 50 + "\n\n")
-                        elif is_unhelpful:
-                            self.append_output(f"🔄 Retrying analysis for {os.path.basename(file_path)} with simplified prompt...\n")
-                            # Retry with a more direct prompt
-                            file_ext = os.path.splitext(file_path)[1]
-                            lang_name = {
-                                '.py': 'Python', '.cpp': 'C++', '.h': 'C++', '.c': 'C',
-                                '.js': 'JavaScript', '.ts': 'TypeScript', '.rs': 'Rust',
-                                '.go': 'Go', '.java': 'Java'
-                            }.get(file_ext, 'code')
-                            
-                            retry_prompt = f"""Here is {lang_name} code to analyze:
-
-{content}
-
-Analyze this code and identify any:
-- Errors or bugs
-- Style issues
-- Security problems
-- Performance issues
-- Code that needs cleanup
-
-Be specific about what you find."""
-                            try:
-                                retry_process = subprocess.Popen(
-                                    ['ollama', 'run', model],
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
-                                    text=True,
-                                    env=env
-                                )
-                                retry_stdout, _ = retry_process.communicate(input=retry_prompt, timeout=300)
-                                if retry_stdout:
-                                    retry_output = self.clean_terminal_output(retry_stdout)
-                                    if retry_output.strip():
-                                        self.append_output(f"✅ Results for {os.path.basename(file_path)} (retry):\n")
-                                        self.append_output("-" * 40 + "\n")
-                                        self.append_output(retry_output)
-                                        self.append_output("\n" + "=" * 50 + "\n\n")
-                                    else:
-                                        self.append_output(f"⚠️ No useful output after retry for {os.path.basename(file_path)}\n\n")
-                                else:
-                                    self.append_output(f"⚠️ No output after retry for {os.path.basename(file_path)}\n\n")
-                            except Exception as retry_e:
-                                self.append_output(f"❌ Retry failed for {os.path.basename(file_path)}: {retry_e}\n\n")
-                        else:
-                            self.append_output(f"⚠️ No readable output from analysis of {os.path.basename(file_path)}\n\n")
-                    
-                except subprocess.TimeoutExpired:
-                    self.append_output("⏱️ Analysis timed out for this file\n\n")
-                    if self.current_process:
-                        self.current_process.kill()
-                except Exception as e:
-                    self.append_output(f"❌ Error analyzing file: {e}\n\n")
-            
-            # Store analyzed files for potential fixing
-            self.analyzed_files = files_to_analyze
-            self.last_analysis_target = target
-            self.last_analysis_type = analysis_type
-            
-            self.append_output("🎉 Analysis completed successfully!\n")
-            self.append_output(f"📋 {len(files_to_analyze)} files analyzed and ready for fixing.\n")
-            
-        except Exception as e:
-            self.append_output(f"\n❌ Analysis error: {e}\n")
-        finally:
-            self.root.after(0, self.analysis_finished)
-    
-    def create_analysis_prompt(self, file_path, content, analysis_type):
-        """Create analysis prompt based on type"""
-        file_ext = os.path.splitext(file_path)[1]
-        language_map = {
-            '.rs': 'Rust', '.ts': 'TypeScript', '.tsx': 'TypeScript', '.js': 'JavaScript', 
-            '.jsx': 'JavaScript', '.py': 'Python', '.go': 'Go', '.java': 'Java',
-            '.cpp': 'C++', '.c': 'C', '.h': 'C/C++'
-        }
-        language = language_map.get(file_ext, 'Unknown')
-        
-        # Create a much more direct and commanding prompt
-        base_prompt = f"""ANALYZE THIS {language.upper()} CODE:
-
-{content}
-
-You must analyze the code above. Do not ask for more information - the code is right there. Analyze it now."""
-        
-        if analysis_type == "cleanup":
-            return base_prompt + """TASK: Code Cleanup Analysis
-
-Please analyze the code above and identify:
-1. Stub functions (empty or placeholder implementations)
-2. Unused functions, variables, and imports
-3. Dead code that's never called
-4. Commented-out code that should be removed
-5. Redundant or duplicate code
-6. Empty catch blocks or TODO comments
-
-For each finding, specify:
-- Line numbers where the issue occurs
-- Description of the problem
-- Whether it's safe to remove
-
-Provide your analysis in a clear, structured format."""
-            
-        elif analysis_type == "errors":
-            return base_prompt + """TASK: Error and Bug Detection
-
-Please analyze the code above and identify:
-1. Syntax errors
-2. Type errors
-3. Logic issues
-4. Potential runtime errors
-5. Missing imports or dependencies
-
-For each issue found, provide:
-- Line numbers where the error occurs
-- Description of the problem
-- Suggested fix
-
-Provide your analysis in a clear, structured format."""
-            
-        elif analysis_type == "security":
-            return base_prompt + """TASK: Security Analysis
-
-Please analyze the code above and identify:
-1. Security vulnerabilities
-2. Unsafe operations
-3. Input validation issues
-4. Authentication problems
-5. Data exposure risks
-
-For each security issue found, provide:
-- Line numbers where the vulnerability occurs
-- Description of the security risk
-- Severity level (High/Medium/Low)
-- Recommended fix
-
-Provide your analysis in a clear, structured format."""
+                self.append_output("This may take a while. Consider analyzing smaller directories first, "
+                                   "or 🎲 Sample Estimate for a quick health estimate.\n\n")
+            else:
+                self.append_output(f"📊 Found {len(files_to_analyze)} files to analyze\n\n")
+            if saved_requests:
+                self.append_output(f"🧬 {saved_requests} duplicate files share a result with one of "
+                                   f"{len(duplicates)} analyzed copies\n\n")
             
-        elif analysis_type == "performance":
-            return base_prompt + """TASK: Performance Analysis
-
-Please analyze the code above and identify:
-1. Performance bottlenecks
-2. Inefficient algorithms
-3. Memory usage issues
-4. I/O optimization opportunities
-
-For each performance issue found, provide:
-- Line numbers where the issue occurs
-- Description of the performance problem
-- Impact level (High/Medium/Low)
-- Suggested optimization
-
-Provide your analysis in a clear, structured format."""
+            if not journal:
+                files_to_analyze = self.schedule_files(target, files_to_analyze, token)
+                journal = RunJournal.create(
+                    RunJournal.run_key('analysis', target, analysis_type, model),
+                    'analysis', target, analysis_type, model, files_to_analyze,
+                    db_run_id=self.findings_db.start_run('analysis', target, analysis_type, model),
+                    duplicates=duplicates)
+            run_id = journal.header.get('db_run_id')
+            if run_id is None:
+                run_id = self.findings_db.start_run('analysis', target, analysis_type, model)
             
-        elif analysis_type == "style":
-            return base_prompt + """TASK: Code Style Review
-
-Please review the code above for:
-1. Code formatting and indentation
-2. Naming conventions
-3. Code organization
-4. Documentation quality
-5. Best practice compliance
-
-For each style issue found, provide:
-- Line numbers where the issue occurs
-- Description of the style problem
-- Recommended improvement
-
-Provide your analysis in a clear, structured format."""
+            if analysis_type in ('cleanup', 'all'):
+                self.refresh_symbol_index(target, token)
+                self.refresh_clone_index(target, token)
+            if self.retrieval_var.get():
+                self.refresh_embedding_index(target, token)
+            else:
+                self.embedding_index = None
             
-        else:  # all
-            return base_prompt + """TASK: Comprehensive Code Analysis
-
-Please provide a thorough analysis of the code above covering:
-1. Errors and bugs
-2. Code style and best practices
-3. Security considerations
-4. Performance opportunities
-5. Code cleanup (stub/unused code)
-
-For each issue found, provide:
-- Category (Error/Style/Security/Performance/Cleanup)
-- Line numbers where the issue occurs
-- Description of the problem
-- Recommended fix or improvement
-- Priority level (High/Medium/Low)
-
-Provide your analysis in a clear, structured format with specific, actionable feedback."""
+            progress = self.start_progress([(f, model) for f in files_to_analyze if not journal.is_done(f)])
+            self.report_progress(progress)
+            def analyze(i, file_path):
+                token.check()
+                self.wait_for_watch(token)
+                
+                if journal.is_done(file_path):
+                    entry = journal.records[file_path]
+                    if entry.get('result'):
+                        self.append_output(f"♻️ Results for {os.path.basename(file_path)} (from journal):\n", file_path)
+                        self.append_output("-" * 40 + "\n")
+                        self.append_output(entry['result'])
+                        self.append_output("\n" + "=" * 50 + "\n\n")
+                    return
+                
+                self.append_output(f"[{i}/{len(files_to_analyze)}] 🔍 Analyzing: {os.path.basename(file_path)}\n", file_path)
+                
+                status, result = self.analyze_file(model, file_path, analysis_type, token)
+                progress.finish(file_path)
+                self.report_progress(progress)
+                
+                journal.record(file_path, status, result)
+                finding_count = self.findings_db.record_analysis(run_id, file_path, status, result, analysis_type)
+                if finding_count:
+                    self.append_output(f"   🗃️ {finding_count} findings indexed\n\n")
+                
+                # Same content (and line structure) means the same findings
+                copies = duplicates.get(file_path, [])
+                if copies:
+                    self.append_output(f"🧬 Result also applies to {len(copies)} identical copies:\n")
+                    for copy_path in copies:
+                        self.findings_db.record_analysis(run_id, copy_path, status, result, analysis_type)
+                        self.append_output(f"   ↳ {os.path.relpath(copy_path, target)}\n", copy_path)
+                    self.append_output("\n")
+            
+            run_started = time.time()
+            with self.preprocessing([(f, analysis_type, model) for f in files_to_analyze if not journal.is_done(f)]):
+                self.run_pool(enumerate(files_to_analyze, 1), analyze, token)
+            
+            journal.mark_complete()
+            self.findings_db.finish_run(run_id)
+            
+            # Files with open findings become the work list for fixing
+            self.analyzed_files = self.findings_db.work_list(run_id=run_id)
+            self.last_analysis_target = target
+            self.last_analysis_type = analysis_type
+            
+            self.append_output("🎉 Analysis completed successfully!\n")
+            self.append_output(f"📋 {len(files_to_analyze) + saved_requests} files analyzed, "
+                               f"{len(self.analyzed_files)} with findings ready for fixing.\n")
+            if saved_requests:
+                self.append_output(f"🧬 Deduplication saved {saved_requests} model requests\n")
+            self.report_prompt_savings()
+            self.report_concurrency(run_started)
+            
+        except Cancelled:
+            self.report_stopped(journal)
+        except Exception as e:
+            self.append_output(f"\n❌ Analysis error: {e}\n")
+        finally:
+            self.root.after(0, self.analysis_finished)
     
     def run_autofix_analysis(self):
         """Run analysis with auto-fix capability"""
+        token = self.cancel_token
+        self.begin_profile()
+        journal = None
+        fixed_files = 0
         try:
             target = self.target_var.get().strip()
             model = self.model_var.get().replace('🚀 ', '').strip()
@@ -976,36 +6197,23 @@ Provide your analysis in a clear, structured format with specific, actionable fe
             self.append_output("⚠️  Auto-fix mode: Files will be modified!\n")
             self.append_output("=" * 50 + "\n\n")
             
-            # Set environment
-            env = os.environ.copy()
-            env['OLLAMA_MODELS'] = self.models_path
-            env['CUDA_VISIBLE_DEVICES'] = '0'  # Use GPU
+            journal = self.resume_journal
+            self.resume_journal = None
             
-            if os.path.isfile(target):
-                files_to_analyze = [target]
+            if journal:
+                files_to_analyze = journal.files
+                self.append_output(f"♻️ Resuming interrupted auto-fix: {len(journal.records)}/{len(files_to_analyze)} files already done\n\n")
             else:
-                # Find code files in directory
-                extensions = ['.rs', '.ts', '.tsx', '.js', '.jsx', '.py', '.go', '.java', '.cpp', '.c', '.h']
-                files_to_analyze = []
-                for root, dirs, files in os.walk(target):
-                    # Skip common build/dependency directories
-                    dirs[:] = [d for d in dirs if d not in ['node_modules', 'target', 'build', 'dist', '.git', '__pycache__']]
-                    for file in files:
-                        if any(file.endswith(ext) for ext in extensions):
-                            file_path = os.path.join(root, file)
-                            # Skip very large files (>50KB) for safety in auto-fix
-                            try:
-                                if os.path.getsize(file_path) < 50000:  # 50KB limit
-                                    files_to_analyze.append(file_path)
-                            except OSError:
-                                pass  # Skip if can't get file size
+                # Skip very large files (>50KB) for safety in auto-fix
+                files_to_analyze = self.discover_files(target, 50000, token)
             
             if not files_to_analyze:
                 self.append_output("⚠️ No code files found to analyze.\n")
                 return
             
             # Additional confirmation for large codebases in auto-fix mode
-            if len(files_to_analyze) > 50:
+            # (already given when the interrupted run was started)
+            if len(files_to_analyze) > 50 and not journal:
                 large_result = messagebox.askyesno(
                     "Large Codebase Warning", 
                     f"Found {len(files_to_analyze)} files to analyze and fix.\n\n"
@@ -1019,14 +6227,26 @@ Provide your analysis in a clear, structured format with specific, actionable fe
             
             self.append_output(f"📈 Found {len(files_to_analyze)} files to analyze and fix\n\n")
             
-            fixed_files = 0
+            if not journal:
+                files_to_analyze = self.schedule_files(target, files_to_analyze, token)
+                journal = RunJournal.create(
+                    RunJournal.run_key('autofix', target, analysis_type, model),
+                    'autofix', target, analysis_type, model, files_to_analyze)
+            
+            # Fixes remove "unused" code, so tell the model what other files use
+            self.refresh_symbol_index(target, token)
             
             for i, file_path in enumerate(files_to_analyze, 1):
-                if not self.analysis_running:
-                    break
+                token.check()
+                
+                if journal.is_done(file_path):
+                    if journal.records[file_path].get('status') == 'fixed':
+                        fixed_files += 1
+                    continue
                     
-                self.append_output(f"[{i}/{len(files_to_analyze)}] 🔍 Analyzing: {os.path.basename(file_path)}\n")
+                self.append_output(f"[{i}/{len(files_to_analyze)}] 🔍 Analyzing: {os.path.basename(file_path)}\n", file_path)
                 
+                status = 'error'
                 try:
                     # Read original file content
                     with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
@@ -1034,202 +6254,61 @@ Provide your analysis in a clear, structured format with specific, actionable fe
                     
                     if len(original_content) > 10000:  # Skip very large files
                         self.append_output(f"⚠️ Skipping large file (>10k chars): {os.path.basename(file_path)}\n\n")
+                        journal.record(file_path, 'skipped')
                         continue
                     
                     # Create fix prompt
                     prompt = self.create_fix_prompt(file_path, original_content, analysis_type)
                     
-                    # Get fixed code from Ollama
-                    self.current_process = subprocess.Popen(
-                        ['ollama', 'run', model],
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        env=env
-                    )
-                    
-                    stdout, _ = self.current_process.communicate(input=prompt, timeout=300)
+                    # Get fixed code from Ollama; the answer is about as long as the file
+                    code_stream = CodeBlockStream()
+                    response, stats = self.client.generate(
+                        model, prompt, output_tokens=estimate_tokens(original_content) + 256, token=token,
+                        stream=code_stream, analysis_type='fix')
+                    self.append_output(f"   ⏱️ {format_request_stats(stats)}\n")
                     
-                    if stdout:
-                        # Clean up terminal control sequences first
-                        clean_stdout = self.clean_terminal_output(stdout)
-                        # Extract fixed code from AI response
-                        fixed_code = self.extract_code_from_response(clean_stdout, original_content)
+                    if response:
+                        # The stream already sanitized the answer and cut out the code block
+                        fixed_code = self.extract_code_from_response(code_stream, original_content)
                         
                         if fixed_code and fixed_code != original_content:
-                            # Create backup
-                            backup_path = file_path + '.backup'
-                            with open(backup_path, 'w', encoding='utf-8') as f:
-                                f.write(original_content)
-                            
-                            # Write fixed code
-                            with open(file_path, 'w', encoding='utf-8') as f:
-                                f.write(fixed_code)
+                            self.apply_fix(file_path, original_content, fixed_code, token)
+                            self.findings_db.mark_fixed(file_path)
                             
                             self.append_output(f"✅ Fixed: {os.path.basename(file_path)} (backup created)\n")
                             fixed_files += 1
+                            status = 'fixed'
                         else:
                             self.append_output(f"ℹ️ No fixes needed: {os.path.basename(file_path)}\n")
+                            status = 'unchanged'
+                    else:
+                        status = 'no_output'
                     
-                except subprocess.TimeoutExpired:
-                    self.append_output(f"⏱️ Timeout analyzing: {os.path.basename(file_path)}\n")
-                    if self.current_process:
-                        self.current_process.kill()
+                except OllamaTimeout as e:
+                    status = 'timeout'
+                    self.append_output(f"⏱️ Timeout analyzing: {os.path.basename(file_path)} ({e})\n")
+                except CircuitOpenError as e:
+                    self.append_output(f"⛔ Skipped {os.path.basename(file_path)}: {e}\n")
                 except Exception as e:
                     self.append_output(f"❌ Error processing {os.path.basename(file_path)}: {str(e)}\n")
                 
+                journal.record(file_path, status)
+                
                 self.append_output("\n")
             
+            journal.mark_complete()
+            
             self.append_output("=" * 50 + "\n")
             self.append_output(f"🎉 Auto-fix complete! Fixed {fixed_files}/{len(files_to_analyze)} files\n")
             self.append_output("💾 Backup files created with .backup extension\n")
             
+        except Cancelled:
+            self.report_stopped(journal, f"🔧 Fixed {fixed_files} files before stopping (backups use the .backup extension)\n")
         except Exception as e:
             self.append_output(f"\n❌ Auto-fix error: {e}\n")
         finally:
             self.root.after(0, self.analysis_finished)
     
-    def create_fix_prompt(self, file_path, content, analysis_type):
-        """Create prompt for fixing code"""
-        file_ext = os.path.splitext(file_path)[1]
-        language_map = {
-            '.rs': 'Rust', '.ts': 'TypeScript', '.tsx': 'TypeScript', '.js': 'JavaScript', 
-            '.jsx': 'JavaScript', '.py': 'Python', '.go': 'Go', '.java': 'Java',
-            '.cpp': 'C++', '.c': 'C', '.h': 'C/C++'
-        }
-        language = language_map.get(file_ext, 'Unknown')
-        
-        base_prompt = f"""You are an expert {language} programmer. Fix the issues in this code file.
-
-File: {os.path.basename(file_path)}
-Language: {language}
-
-ORIGINAL CODE TO FIX:
-```{language.lower()}
-{content}
-```
-
-Task: Analyze the code above and fix any issues you find:
-1. Fix errors, bugs, or issues
-2. Remove unused imports, variables, and functions
-3. Remove commented-out code
-4. Fix code style issues
-5. Improve performance where possible
-
-IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code blocks. Do not include explanations or other text. The code is provided above - analyze it directly."""
-        
-        return base_prompt
-    
-    def clean_terminal_output(self, text):
-        """Remove terminal control sequences and formatting codes from text"""
-        import re
-        
-        # Remove ANSI escape sequences (colors, cursor movement, etc.)
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        text = ansi_escape.sub('', text)
-        
-        # Remove specific terminal control sequences
-        control_sequences = [
-            r'\[\?\d+[hl]',  # Private mode sequences
-            r'\[\d*[ABCD]',  # Cursor movement
-            r'\[\d*[GKJ]',   # Erase sequences
-            r'\[\d+;\d+[Hf]', # Cursor position
-            r'\[\?25[lh]',   # Cursor visibility
-            r'\[\?2026[hl]', # Bracketed paste mode
-            r'\[2K',         # Clear line
-            r'\[1G',         # Move to column 1
-            r'\[K',          # Clear to end of line
-        ]
-        
-        for pattern in control_sequences:
-            text = re.sub(pattern, '', text)
-        
-        # Remove spinner characters and extra whitespace
-        spinner_chars = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
-        for char in spinner_chars:
-            text = text.replace(char, '')
-        
-        # Clean up excessive whitespace and newlines
-        text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)  # Multiple newlines to double
-        text = re.sub(r'[ \t]+', ' ', text)  # Multiple spaces to single
-        text = text.strip()
-        
-        return text
-    
-    def detect_dominant_language(self, target_path):
-        """Detect the dominant programming language in target"""
-        if not os.path.exists(target_path):
-            return None
-        
-        language_counts = {}
-        extensions = ['.rs', '.ts', '.tsx', '.js', '.jsx', '.py', '.go', '.java', '.cpp', '.c', '.h']
-        
-        if os.path.isfile(target_path):
-            ext = os.path.splitext(target_path)[1]
-            if ext in extensions:
-                return self.get_language_from_extension(ext)
-            return None
-        
-        # Count files by language
-        for root, dirs, files in os.walk(target_path):
-            dirs[:] = [d for d in dirs if d not in ['node_modules', 'target', 'build', 'dist', '.git']]
-            for file in files:
-                ext = os.path.splitext(file)[1]
-                if ext in extensions:
-                    lang = self.get_language_from_extension(ext)
-                    language_counts[lang] = language_counts.get(lang, 0) + 1
-        
-        if not language_counts:
-            return None
-        
-        # Return most common language
-        return max(language_counts, key=language_counts.get)
-    
-    def get_language_from_extension(self, ext):
-        """Map file extension to language name"""
-        ext_map = {
-            '.rs': 'rust',
-            '.ts': 'typescript', '.tsx': 'typescript',
-            '.js': 'javascript', '.jsx': 'javascript',
-            '.py': 'python',
-            '.go': 'go',
-            '.java': 'java',
-            '.cpp': 'cpp', '.c': 'c', '.h': 'c'
-        }
-        return ext_map.get(ext, 'general')
-    
-    def get_best_model_for_language(self, language):
-        """Get the best available model for a specific language"""
-        available_models = self.model_combo['values']
-        
-        # Model preferences by language
-        language_models = {
-            'rust': ['granite-code', 'deepseek-coder', 'codellama'],
-            'typescript': ['granite-code', 'deepseek-coder', 'codegemma'],
-            'javascript': ['granite-code', 'deepseek-coder', 'codegemma'],
-            'python': ['deepseek-coder', 'granite-code', 'codellama'],
-            'go': ['granite-code', 'deepseek-coder', 'codellama'],
-            'java': ['granite-code', 'deepseek-coder', 'codellama'],
-            'cpp': ['granite-code', 'deepseek-coder', 'codellama'],
-            'c': ['granite-code', 'deepseek-coder', 'codellama']
-        }
-        
-        preferred_models = language_models.get(language, ['granite-code', 'deepseek-coder'])
-        
-        # Find best available model
-        for preferred in preferred_models:
-            for model in available_models:
-                if preferred in model.lower():
-                    return model
-        
-        # Fallback to first code model
-        for model in available_models:
-            if '🚀' in model:
-                return model
-        
-        return available_models[0] if available_models else 'granite-code:latest'
-    
     def auto_select_model(self):
         """Automatically select best model for the target code"""
         target = self.target_var.get().strip()
@@ -1252,7 +6331,64 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
         self._target_timer = self.root.after(1000, self.auto_select_model)
     
     def load_previous_results(self):
-        """Load previous analysis results from file"""
+        """Pick a previous analysis run from the findings database"""
+        runs = self.findings_db.recent_runs()
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Load Previous Analysis Results")
+        dialog.geometry("700x350")
+        dialog.columnconfigure(0, weight=1)
+        dialog.rowconfigure(0, weight=1)
+        
+        run_list = tk.Listbox(dialog, font=('Consolas', 9))
+        run_list.grid(row=0, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=10)
+        for run in runs:
+            run_list.insert(tk.END, f"#{run['id']}  {run['started']}  {run['analysis_type']:<11} "
+                                    f"{run['file_count']:>4} files {run['finding_count']:>5} findings  "
+                                    f"{os.path.basename(run['target'])}  ({run['model']})")
+        
+        def load_selected():
+            selection = run_list.curselection()
+            if not selection:
+                return
+            dialog.destroy()
+            self.load_run_results(runs[selection[0]])
+        
+        def load_file():
+            dialog.destroy()
+            self.load_report_file()
+        
+        run_list.bind('<Double-Button-1>', lambda e: load_selected())
+        ttk.Button(dialog, text="📂 Load Run", command=load_selected).grid(row=1, column=0, pady=(0, 10))
+        ttk.Button(dialog, text="📄 Open Report File...", command=load_file).grid(row=1, column=1, pady=(0, 10))
+        ttk.Button(dialog, text="Cancel", command=dialog.destroy).grid(row=1, column=2, pady=(0, 10))
+    
+    def load_run_results(self, run):
+        """Show a stored run and take its open findings as the fix work list"""
+        self.clear_output()
+        self.append_output(f"📂 Loaded run #{run['id']} from {run['started']}\n")
+        self.append_output(f"📁 Target: {run['target']}\n")
+        self.append_output(f"🤖 Model: {run['model']}\n")
+        self.append_output(f"🔍 Analysis: {run['analysis_type']}\n")
+        self.append_output("=" * 50 + "\n\n")
+        for path, status, result in self.findings_db.run_results(run['id']):
+            if result:
+                self.append_output(f"✅ Results for {os.path.basename(path)}:\n", path)
+                self.append_output("-" * 40 + "\n")
+                self.append_output(result)
+                self.append_output("\n" + "=" * 50 + "\n\n")
+        
+        self.analyzed_files = [f for f in self.findings_db.work_list(run_id=run['id']) if os.path.exists(f)]
+        self.last_analysis_target = run['target']
+        self.last_analysis_type = run['analysis_type']
+        if self.analyzed_files:
+            self.fix_button.config(state=tk.NORMAL)
+            self.status_var.set(f"Loaded run #{run['id']} - {len(self.analyzed_files)} files with open findings ready for fixing")
+        else:
+            self.status_var.set(f"Loaded run #{run['id']} - No open findings to fix")
+    
+    def load_report_file(self):
+        """Load a saved report file (reports from before the findings database)"""
         file_path = filedialog.askopenfilename(
             title="Load Previous Analysis Results",
             filetypes=[("Markdown files", "*.md"), ("Text files", "*.txt"), ("All files", "*.*")]
@@ -1304,6 +6440,25 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
     
     def start_fix_only(self):
         """Start fix-only mode for previously analyzed files"""
+        if not self.analyzed_files and not self.analysis_running:
+            # The GUI may have been closed mid-run; pick the work list back up
+            journal = RunJournal.latest_incomplete('fix')
+            if journal and messagebox.askyesno(
+                "Resume Interrupted Fix Run",
+                f"An unfinished fix run was found ({len(journal.records)}/{len(journal.files)} files done, "
+                f"started {journal.header.get('started', 'unknown')}).\n\nResume it?"
+            ):
+                self.analyzed_files = journal.files
+                self.last_analysis_target = journal.header.get('target')
+                self.resume_journal = journal
+        
+        if not self.analyzed_files and not self.analysis_running:
+            # Fall back to the stored open findings under the current target
+            target = self.target_var.get().strip()
+            if target:
+                self.analyzed_files = [f for f in self.findings_db.work_list(target=target) if os.path.exists(f)]
+                self.last_analysis_target = target
+        
         if not self.analyzed_files:
             messagebox.showwarning("No Files", "No analyzed files available for fixing.\nRun analysis first or load previous results.")
             return
@@ -1326,6 +6481,9 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
         # Clean model name
         model = self.model_var.get().replace('🚀 ', '').strip()
         
+        if not self.resume_journal:
+            self.check_resume('fix', self.last_analysis_target, 'cleanup', model)
+        
         self.analysis_running = True
         self.analyze_button.config(state=tk.DISABLED)
         self.fix_button.config(state=tk.DISABLED)
@@ -1338,12 +6496,17 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
         self.clear_output()
         
         # Run fix in separate thread
+        self.cancel_token = CancelToken()
         thread = threading.Thread(target=self.run_fix_only)
         thread.daemon = True
         thread.start()
     
     def run_fix_only(self):
         """Run fixes on previously analyzed files"""
+        token = self.cancel_token
+        self.begin_profile()
+        journal = None
+        fixed_files = 0
         try:
             model = self.model_var.get().replace('🚀 ', '').strip()
             
@@ -1354,23 +6517,33 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
             self.append_output("⚠️  Fix mode: Files will be modified!\n")
             self.append_output("=" * 50 + "\n\n")
             
-            # Set environment
-            env = os.environ.copy()
-            env['OLLAMA_MODELS'] = self.models_path
-            env['CUDA_VISIBLE_DEVICES'] = '0'
+            journal = self.resume_journal
+            self.resume_journal = None
+            if journal:
+                self.append_output(f"♻️ Resuming interrupted fix run: {len(journal.records)}/{len(journal.files)} files already done\n\n")
+            else:
+                journal = RunJournal.create(
+                    RunJournal.run_key('fix', self.last_analysis_target, 'cleanup', model),
+                    'fix', self.last_analysis_target, 'cleanup', model, self.analyzed_files)
             
-            fixed_files = 0
+            if self.last_analysis_target and os.path.exists(self.last_analysis_target):
+                self.refresh_symbol_index(self.last_analysis_target, token)
             
             for i, file_path in enumerate(self.analyzed_files, 1):
-                if not self.analysis_running:
-                    break
+                token.check()
                 
                 if not os.path.exists(file_path):
                     self.append_output(f"⚠️ Skipping missing file: {os.path.basename(file_path)}\n")
                     continue
+                
+                if journal.is_done(file_path):
+                    if journal.records[file_path].get('status') == 'fixed':
+                        fixed_files += 1
+                    continue
                     
-                self.append_output(f"[{i}/{len(self.analyzed_files)}] 🔍 Fixing: {os.path.basename(file_path)}\n")
+                self.append_output(f"[{i}/{len(self.analyzed_files)}] 🔍 Fixing: {os.path.basename(file_path)}\n", file_path)
                 
+                status = 'error'
                 try:
                     # Read original file content
                     with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
@@ -1378,82 +6551,74 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
                     
                     if len(original_content) > 10000:  # Skip very large files
                         self.append_output(f"⚠️ Skipping large file: {os.path.basename(file_path)}\n\n")
+                        journal.record(file_path, 'skipped')
                         continue
                     
                     # Create fix prompt
                     prompt = self.create_fix_prompt(file_path, original_content, 'cleanup')
                     
-                    # Get fixed code from Ollama
-                    self.current_process = subprocess.Popen(
-                        ['ollama', 'run', model],
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        env=env
-                    )
+                    # Get fixed code from Ollama; the answer is about as long as the file
+                    code_stream = CodeBlockStream()
+                    response, stats = self.client.generate(
+                        model, prompt, output_tokens=estimate_tokens(original_content) + 256, token=token,
+                        stream=code_stream, analysis_type='fix')
+                    self.append_output(f"   ⏱️ {format_request_stats(stats)}\n")
                     
-                    stdout, _ = self.current_process.communicate(input=prompt, timeout=300)
-                    
-                    if stdout:
-                        # Clean up terminal control sequences first
-                        clean_stdout = self.clean_terminal_output(stdout)
-                        # Extract fixed code from AI response
-                        fixed_code = self.extract_code_from_response(clean_stdout, original_content)
+                    if response:
+                        # The stream already sanitized the answer and cut out the code block
+                        fixed_code = self.extract_code_from_response(code_stream, original_content)
                         
                         if fixed_code and fixed_code != original_content:
-                            # Create backup
-                            backup_path = file_path + '.backup'
-                            with open(backup_path, 'w', encoding='utf-8') as f:
-                                f.write(original_content)
-                            
-                            # Write fixed code
-                            with open(file_path, 'w', encoding='utf-8') as f:
-                                f.write(fixed_code)
+                            self.apply_fix(file_path, original_content, fixed_code, token)
+                            self.findings_db.mark_fixed(file_path)
                             
                             self.append_output(f"✅ Fixed: {os.path.basename(file_path)} (backup created)\n")
                             fixed_files += 1
+                            status = 'fixed'
                         else:
                             self.append_output(f"ℹ️ No fixes needed: {os.path.basename(file_path)}\n")
+                            status = 'unchanged'
+                    else:
+                        status = 'no_output'
                     
-                except subprocess.TimeoutExpired:
-                    self.append_output(f"⏱️ Timeout fixing: {os.path.basename(file_path)}\n")
-                    if self.current_process:
-                        self.current_process.kill()
+                except OllamaTimeout as e:
+                    status = 'timeout'
+                    self.append_output(f"⏱️ Timeout fixing: {os.path.basename(file_path)} ({e})\n")
+                except CircuitOpenError as e:
+                    self.append_output(f"⛔ Skipped {os.path.basename(file_path)}: {e}\n")
                 except Exception as e:
                     self.append_output(f"❌ Error fixing {os.path.basename(file_path)}: {str(e)}\n")
                 
+                journal.record(file_path, status)
+                
                 self.append_output("\n")
             
+            journal.mark_complete()
+            
             self.append_output("=" * 50 + "\n")
             self.append_output(f"🎉 Fix-only complete! Fixed {fixed_files}/{len(self.analyzed_files)} files\n")
             self.append_output("💾 Backup files created with .backup extension\n")
             
+        except Cancelled:
+            self.report_stopped(journal, f"🔧 Fixed {fixed_files} files before stopping (backups use the .backup extension)\n")
         except Exception as e:
             self.append_output(f"\n❌ Fix-only error: {e}\n")
         finally:
             self.root.after(0, self.analysis_finished)
     
-    def extract_code_from_response(self, response, original_content):
-        """Extract code from AI response"""
-        import re
-        
-        # Look for code blocks
-        code_blocks = re.findall(r'```(?:\w+)?\n(.*?)```', response, re.DOTALL)
-        
-        if code_blocks:
-            # Use the largest code block
-            fixed_code = max(code_blocks, key=len).strip()
-            
-            # Basic validation - should be similar length and have some common elements
-            if len(fixed_code) > len(original_content) * 0.5 and len(fixed_code) < len(original_content) * 2:
-                return fixed_code
-        
-        return None
+    def begin_profile(self):
+        """Profile the run that is starting, if the user asked for it"""
+        if self.profile_var.get() and PipelineProfiler.active is None:
+            self.profiler = PipelineProfiler().start()
     
     def analysis_finished(self):
         """Called when analysis is complete"""
         self.analysis_running = False
+        if self.profiler:
+            self.append_output("\n" + self.profiler.finish())
+            self.profiler = None
+        self.run_progress = None
+        self.progress.config(mode='indeterminate', value=0)
         self.analyze_button.config(state=tk.NORMAL)
         self.autofix_button.config(state=tk.NORMAL)
         
@@ -1467,12 +6632,198 @@ IMPORTANT: Return ONLY the corrected code wrapped in ```{language.lower()} code
         
         self.stop_button.config(state=tk.DISABLED)
         self.progress.stop()
-        self.current_process = None
 
 def main():
+    parser = argparse.ArgumentParser(description="Ollama code checker. Starts the GUI unless a command is given.")
+    parser.add_argument('--calibrate', metavar='MODEL',
+                        help="measure the best num_thread/num_batch for MODEL on this machine and save them "
+                             f"to {PROFILES_FILE}")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="analyze the targets listed in FILE (lines of 'path | analysis type | model'), "
+                             "grouping work by model to minimize model loads")
+    parser.add_argument('--analyze', metavar='TARGET',
+                        help="analyze TARGET headlessly with --type and --model (a one-job --batch)")
+    parser.add_argument('--shard', metavar='I/N',
+                        help="with --analyze/--batch: analyze only shard I of N, split by estimated cost, and "
+                             "write the partial result to --output")
+    parser.add_argument('--output', metavar='FILE',
+                        help="partial result file for --shard (default: shard-I-of-N.json)")
+    parser.add_argument('--merge', nargs='+', metavar='PARTIAL',
+                        help="merge the partial results of all shards into the findings database, checking for "
+                             "missing or duplicate files; exits 1 if incomplete")
+    parser.add_argument('--report', metavar='FILE', help="with --merge: also write the combined report to FILE")
+    parser.add_argument('--ref', metavar='SPEC',
+                        help="analyze a tree-ish (branch, tag, commit) or a range such as main..feature "
+                             "straight from the git object database, without a checkout")
+    parser.add_argument('--repo', default='.', help="repository for --ref; bare clones work (default: .)")
+    parser.add_argument('--type', default='cleanup', choices=ANALYSIS_TYPES,
+                        help="analysis type for --analyze, --ref and --sample (default: cleanup)")
+    parser.add_argument('--model', default='granite-code:latest', help="model (default: granite-code:latest)")
+    parser.add_argument('--pre-commit', action='store_true',
+                        help="review the staged hunks of --repo within --budget seconds; exits 1 on "
+                             "high-severity findings (what the installed hook runs)")
+    parser.add_argument('--sample', metavar='TARGET',
+                        help="estimate issue rates of TARGET from a stratified sample analyzed within --budget "
+                             "seconds (default 600) and/or --sample-tokens; running it again extends the sample")
+    parser.add_argument('--sample-tokens', type=int, metavar='N', help="token budget for --sample")
+    parser.add_argument('--clones', metavar='TARGET',
+                        help="list near-duplicate functions and blocks in the repository of TARGET (no model needed)")
+    parser.add_argument('--budget', type=float, metavar='SECONDS',
+                        help="wall-clock budget for --pre-commit (default: 10) or --sample (default: 600)")
+    parser.add_argument('--install-hook', action='store_true',
+                        help="install a pre-commit hook running --pre-commit with --model and --budget in --repo")
+    parser.add_argument('--profile', nargs='?', const='', metavar='DIR',
+                        help="profile the run: per-stage times, sampled stacks (pstats and collapsed) and "
+                             f"tracemalloc snapshots, saved to DIR (default: under {PROFILE_DIR})")
+    parser.add_argument('--record', metavar='TAPE',
+                        help="record every exchange with the Ollama server (with timing) to TAPE")
+    parser.add_argument('--replay', metavar='TAPE',
+                        help="answer from TAPE instead of a model, for deterministic offline runs")
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='X',
+                        help="replay X times faster than recorded; 0 skips the delays (default: 1)")
+    parser.add_argument('--listen', metavar='HOST:PORT',
+                        help="with --record/--replay: only serve the stand-in on this address, e.g. for "
+                             "OLLAMA_HOST=HOST:PORT ./autofix.sh")
+    args = parser.parse_args()
+    
+    host = OLLAMA_HOST
+    tape_server = None
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.listen and not (args.record or args.replay):
+        parser.error("--listen needs --record or --replay")
+    if args.record or args.replay:
+        try:
+            tape = OllamaTape(args.replay).load() if args.replay else OllamaTape(args.record)
+            tape_server = TapeServer(tape, bool(args.replay), args.listen or '127.0.0.1:0', speed=args.replay_speed)
+        except (OSError, ValueError) as e:
+            print(f"Cannot use tape: {e}", file=sys.stderr)
+            return 2
+        if args.listen:
+            print(f"Serving on {tape_server.address}; run tools with OLLAMA_HOST={tape_server.address}. "
+                  "Ctrl-C stops.", file=sys.stderr)
+            try:
+                tape_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            print(tape_server.summary(), file=sys.stderr)
+            return 0
+        host = tape_server.start().address
+    # The GUI profiles per run (its checkbox); command-line modes profile the whole command
+    profiler = PipelineProfiler(args.profile or None).start() if args.profile is not None else None
+    try:
+        return run_command(args, host, start_server=not args.replay)
+    finally:
+        if profiler is not None:
+            print(profiler.finish(), file=sys.stderr)
+        if tape_server is not None:
+            tape_server.shutdown()
+            print(tape_server.summary(), file=sys.stderr)
+
+def run_command(args, host, start_server=True):
+    """Run the mode selected on the command line against the server at host"""
+    
+    if args.install_hook:
+        try:
+            hook = AnalysisEngine(host).install_pre_commit_hook(args.repo, args.model, args.budget or 10.0)
+        except Exception as e:
+            print(f"Cannot install hook: {e}", file=sys.stderr)
+            return 1
+        print(f"Installed {hook}")
+        return 0
+    
+    if args.pre_commit:
+        try:
+            return AnalysisEngine(host).run_pre_commit(args.repo, args.model, args.budget or 10.0)
+        except KeyboardInterrupt:
+            return 130
+        except Exception as e:
+            # Never block a commit because the checker itself failed
+            print(f"Pre-commit review skipped: {e}", file=sys.stderr)
+            return 0
+    
+    if args.clones:
+        if not os.path.exists(args.clones):
+            print(f"No such file or directory: {args.clones}", file=sys.stderr)
+            return 2
+        try:
+            AnalysisEngine(host).run_clone_report(args.clones, CancelToken())
+        except KeyboardInterrupt:
+            return 130
+        return 0
+    
+    if args.sample:
+        if not os.path.isdir(args.sample):
+            print(f"Not a directory: {args.sample}", file=sys.stderr)
+            return 2
+        seconds = args.budget
+        if seconds is None and not args.sample_tokens:
+            seconds = 600.0
+        try:
+            AnalysisEngine(host).run_sample(args.sample, args.type, args.model, CancelToken(),
+                                            seconds=seconds, max_tokens=args.sample_tokens)
+        except KeyboardInterrupt:
+            print("\nStopped. Sampled files are kept; run again to extend the sample.", file=sys.stderr)
+            return 130
+        return 0
+    
+    if args.ref:
+        try:
+            AnalysisEngine(host).run_tree_analysis(args.repo, args.ref, args.type, args.model, CancelToken())
+        except KeyboardInterrupt:
+            print("\nStopped. Results of finished files are in the findings database.", file=sys.stderr)
+            return 130
+        except Exception as e:
+            print(f"Ref analysis failed: {e}", file=sys.stderr)
+            return 1
+        return 0
+    
+    if args.merge:
+        try:
+            partials = []
+            for path in args.merge:
+                with open(path, 'r', encoding='utf-8') as f:
+                    partials.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Invalid partial result: {e}", file=sys.stderr)
+            return 2
+        return 0 if AnalysisEngine(host).merge_partials(partials, args.report) else 1
+    
+    if args.batch or args.analyze:
+        try:
+            if args.analyze:
+                jobs = [{'target': args.analyze, 'analysis_type': args.type, 'model': args.model}]
+            else:
+                with open(args.batch, 'r', encoding='utf-8') as f:
+                    jobs = parse_batch_spec(f.read())
+            shard = parse_shard(args.shard) if args.shard else None
+        except (OSError, ValueError) as e:
+            print(f"Invalid batch file or shard: {e}", file=sys.stderr)
+            return 2
+        try:
+            partial = AnalysisEngine(host).run_batch(jobs, CancelToken(), shard)
+        except KeyboardInterrupt:
+            print("\nStopped. Results of finished files are in the findings database.", file=sys.stderr)
+            return 130
+        if shard:
+            output = args.output or f"shard-{shard[0]}-of-{shard[1]}.json"
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(partial, f)
+            print(f"Partial result written to {output}")
+        return 0
+    
+    if args.calibrate:
+        try:
+            calibrate(OllamaClient(host, profiles=OptionProfiles()), args.calibrate)
+        except OllamaError as e:
+            print(f"Calibration failed: {e}", file=sys.stderr)
+            return 1
+        return 0
+    
     root = tk.Tk()
-    app = OllamaCodeCheckerGUI(root)
+    app = OllamaCodeCheckerGUI(root, host, start_server)
     root.mainloop()
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
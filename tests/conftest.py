@@ -0,0 +1,41 @@
+"""Shared fixtures: the checker module, loaded from ollama-gui-standalone.py.
+
+State paths (~/.ollama-code-checker) are resolved when the module is
+imported, so HOME points at a scratch directory before that happens.
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'ollama-gui-standalone.py')
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ollama-code-checker-tests-')
+os.environ.pop('OLLAMA_HOST', None)
+
+_spec = importlib.util.spec_from_file_location('ollama_gui_standalone', SCRIPT)
+checker_module = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = checker_module
+_spec.loader.exec_module(checker_module)
+
+
+@pytest.fixture
+def checker():
+    return checker_module
+
+
+@pytest.fixture
+def findings_db(checker, tmp_path):
+    return checker.FindingsDB(str(tmp_path / 'findings.db'))
+
+
+@pytest.fixture
+def engine(checker, tmp_path, monkeypatch):
+    """An AnalysisEngine with its own databases; no server is contacted"""
+    monkeypatch.setattr(checker.AnalysisEngine, 'write_output', lambda self, text, marker=None: None)
+    engine = checker.AnalysisEngine('127.0.0.1:9')
+    engine.findings_db = checker.FindingsDB(str(tmp_path / 'findings.db'))
+    return engine
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+
+def test_breaker_opens_after_threshold(checker):
+    breaker = checker.CircuitBreaker()
+    for _ in range(checker.CircuitBreaker.FAILURE_THRESHOLD - 1):
+        breaker.failure()
+    breaker.check('m')
+    breaker.failure()
+    with pytest.raises(checker.CircuitOpenError):
+        breaker.check('m')
+
+
+def test_breaker_allows_a_single_trial_after_cooldown(checker):
+    breaker = checker.CircuitBreaker()
+    for _ in range(checker.CircuitBreaker.FAILURE_THRESHOLD):
+        breaker.failure()
+    breaker.opened_at -= breaker.COOLDOWN + 1
+    breaker.check('m')  # The trial
+    with pytest.raises(checker.CircuitOpenError):
+        breaker.check('m')
+    breaker.success()
+    breaker.check('m')
+    breaker.check('m')
+
+
+def test_breaker_failed_trial_reopens(checker):
+    breaker = checker.CircuitBreaker()
+    for _ in range(checker.CircuitBreaker.FAILURE_THRESHOLD):
+        breaker.failure()
+    breaker.opened_at -= breaker.COOLDOWN + 1
+    breaker.check('m')
+    breaker.failure()
+    assert breaker.opened_at > time.monotonic() - 1
+    with pytest.raises(checker.CircuitOpenError):
+        breaker.check('m')
+
+
+def test_breaker_abandoned_trial_expires(checker):
+    breaker = checker.CircuitBreaker()
+    for _ in range(checker.CircuitBreaker.FAILURE_THRESHOLD):
+        breaker.failure()
+    breaker.opened_at -= 2 * breaker.COOLDOWN + 2
+    breaker.check('m')
+    breaker.trial_started -= breaker.COOLDOWN + 1
+    breaker.check('m')
@@ -0,0 +1,72 @@
+RESULT = """1. **Bug (high)** line 3: off by one
+2. **Style (low)** lines 7-9: long function
+- No line here, so not a finding
+"""
+
+
+def record(db, path, result=RESULT, content='x = 1\n'):
+    run_id = db.start_run('analysis', str(path.parent), 'errors', 'm')
+    path.write_text(content)
+    count = db.record_analysis(run_id, str(path), 'analyzed', result, 'errors')
+    db.finish_run(run_id)
+    return run_id, count
+
+
+def test_parse_findings(checker):
+    findings = checker.parse_findings(RESULT, 'errors')
+    assert [(f['line_start'], f['line_end'], f['severity']) for f in findings] == [(3, 3, 'high'), (7, 9, 'low')]
+    assert findings[0]['message'] == 'Bug (high) line 3: off by one'
+
+
+def test_query_filters(findings_db, tmp_path):
+    _, count = record(findings_db, tmp_path / 'a.py')
+    assert count == 2
+    assert len(findings_db.query()) == 2
+    assert [f['line_start'] for f in findings_db.query(severity='high')] == [3]
+    assert findings_db.query(category='style') == []
+
+
+def test_only_latest_analysis_counts(findings_db, tmp_path):
+    path = tmp_path / 'a.py'
+    record(findings_db, path)
+    record(findings_db, path, result="Looks fine.")
+    assert findings_db.query() == []
+    assert findings_db.work_list() == []
+
+
+def test_path_prefix_stops_at_separator(findings_db, tmp_path):
+    (tmp_path / 'repo').mkdir()
+    (tmp_path / 'repo2').mkdir()
+    record(findings_db, tmp_path / 'repo' / 'a.py')
+    record(findings_db, tmp_path / 'repo2' / 'b.py')
+    paths = {f['path'] for f in findings_db.query(path_prefix=str(tmp_path / 'repo'))}
+    assert paths == {str(tmp_path / 'repo' / 'a.py')}
+
+
+def test_path_prefix_escapes_like_wildcards(findings_db, tmp_path):
+    for name in ('a_b', 'axb', '100%', '100x'):
+        (tmp_path / name).mkdir()
+        record(findings_db, tmp_path / name / 'f.py')
+    assert findings_db.work_list(target=str(tmp_path / 'a_b')) == [str(tmp_path / 'a_b' / 'f.py')]
+    assert findings_db.work_list(target=str(tmp_path / '100%')) == [str(tmp_path / '100%' / 'f.py')]
+    assert set(findings_db.open_finding_counts(str(tmp_path))) == {
+        str(tmp_path / name / 'f.py') for name in ('a_b', 'axb', '100%', '100x')}
+
+
+def test_work_list_and_mark_fixed(findings_db, tmp_path):
+    run_id, _ = record(findings_db, tmp_path / 'a.py')
+    record(findings_db, tmp_path / 'b.py')
+    assert findings_db.work_list(run_id=run_id) == [str(tmp_path / 'a.py')]
+    findings_db.mark_fixed(str(tmp_path / 'a.py'))
+    assert findings_db.work_list() == [str(tmp_path / 'b.py')]
+    assert len(findings_db.query(include_resolved=True)) == 4
+
+
+def test_changed_since(findings_db, tmp_path):
+    path = tmp_path / 'a.py'
+    record(findings_db, path)
+    findings_db.conn.execute("UPDATE files SET analyzed_at = '2000-01-01T00:00:00'")
+    record(findings_db, path)  # Same content
+    assert findings_db.query(changed_since='2001-01-01') == []
+    record(findings_db, path, content='x = 2\n')
+    assert len(findings_db.query(changed_since='2001-01-01')) == 2
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def journal_dir(checker, tmp_path, monkeypatch):
+    path = tmp_path / 'runs'
+    monkeypatch.setattr(checker, 'JOURNAL_DIR', str(path))
+    return path
+
+
+def make_files(tmp_path, count):
+    files = []
+    for i in range(count):
+        path = tmp_path / f"f{i}.py"
+        path.write_text(f"x = {i}\n")
+        files.append(str(path))
+    return files
+
+
+def test_run_key_is_stable(checker):
+    key = checker.RunJournal.run_key('analysis', '.', 'errors', 'm')
+    assert key == checker.RunJournal.run_key('analysis', os.path.abspath('.'), 'errors', 'm')
+    assert key != checker.RunJournal.run_key('analysis', '.', 'style', 'm')
+
+
+def test_records_survive_reload(checker, journal_dir, tmp_path):
+    files = make_files(tmp_path, 3)
+    journal = checker.RunJournal.create('k1', 'analysis', str(tmp_path), 'errors', 'm', files)
+    journal.record(files[0], 'analyzed', 'ok')
+    journal.record(files[1], 'timeout')
+
+    found = checker.RunJournal.find_incomplete('k1')
+    assert found.files == files
+    assert found.is_done(files[0])
+    assert not found.is_done(files[1])  # Timeouts are retried
+    assert not found.is_done(files[2])
+
+
+def test_changed_file_is_not_done(checker, journal_dir, tmp_path):
+    files = make_files(tmp_path, 1)
+    journal = checker.RunJournal.create('k2', 'analysis', str(tmp_path), 'errors', 'm', files)
+    journal.record(files[0], 'analyzed', 'ok')
+    with open(files[0], 'a') as f:
+        f.write("y = 2\n")
+    assert not checker.RunJournal(journal.path).is_done(files[0])
+
+
+def test_torn_last_line_is_ignored(checker, journal_dir, tmp_path):
+    files = make_files(tmp_path, 2)
+    journal = checker.RunJournal.create('k3', 'analysis', str(tmp_path), 'errors', 'm', files)
+    journal.record(files[0], 'analyzed', 'ok')
+    with open(journal.path, 'a') as f:
+        f.write(json.dumps({'type': 'file', 'path': files[1], 'status': 'analyzed'})[:20])
+    reloaded = checker.RunJournal(journal.path)
+    assert list(reloaded.records) == [files[0]]
+
+
+def test_completed_journal_is_archived(checker, journal_dir, tmp_path):
+    files = make_files(tmp_path, 1)
+    journal = checker.RunJournal.create('k4', 'analysis', str(tmp_path), 'errors', 'm', files)
+    assert checker.RunJournal.latest_incomplete('analysis').path == journal.path
+    journal.record(files[0], 'analyzed', 'ok')
+    journal.mark_complete()
+    assert checker.RunJournal.find_incomplete('k4') is None
+    assert checker.RunJournal.latest_incomplete('analysis') is None
+    assert os.path.exists(journal.path)
@@ -0,0 +1,59 @@
+import pytest
+
+
+def stats(per_token, queued=0.0):
+    """Request stats as OllamaClient reports them, for 100 output tokens"""
+    eval_duration = per_token * 100 * 1e9
+    return {'eval_count': 100, 'eval_duration': eval_duration, 'load_duration': 0,
+            'total_duration': eval_duration, 'elapsed': eval_duration / 1e9 + queued}
+
+
+def finish(limiter, token, model='m', **kwargs):
+    started = limiter.acquire(token)
+    limiter.release(started, model, **kwargs)
+
+
+def test_limiter_grows_while_latency_is_flat(checker):
+    limiter = checker.AdaptiveLimiter(initial=1, maximum=4)
+    token = checker.CancelToken()
+    for _ in range(20):
+        finish(limiter, token, stats=stats(0.01))
+    assert int(limiter.limit) == 4
+
+
+def test_limiter_halves_on_latency_once_per_window(checker):
+    limiter = checker.AdaptiveLimiter(initial=4, maximum=8)
+    token = checker.CancelToken()
+    finish(limiter, token, stats=stats(0.01))
+    started = [limiter.acquire(token) for _ in range(3)]
+    for begun in started:
+        limiter.release(begun, 'm', stats(0.05))
+    assert int(limiter.limit) == 2  # Three slow requests from the same window: one decrease
+    assert 'latency' in limiter.summary()
+
+
+def test_limiter_backs_off_on_queueing_and_failures(checker):
+    limiter = checker.AdaptiveLimiter(initial=8, maximum=8)
+    token = checker.CancelToken()
+    finish(limiter, token, stats=stats(0.01, queued=5.0))
+    assert int(limiter.limit) == 4
+    finish(limiter, token, failure='timeout')
+    assert int(limiter.limit) == 2
+
+
+def test_limiter_ignores_model_loads(checker):
+    limiter = checker.AdaptiveLimiter(initial=2)
+    token = checker.CancelToken()
+    finish(limiter, token, stats=stats(0.01))
+    loading = dict(stats(0.5), load_duration=3e9)
+    finish(limiter, token, stats=loading)
+    assert int(limiter.limit) == 2
+
+
+def test_limiter_acquire_waits_for_a_slot(checker):
+    limiter = checker.AdaptiveLimiter(initial=1)
+    token = checker.CancelToken()
+    limiter.acquire(token)
+    token.cancel()
+    with pytest.raises(checker.Cancelled):
+        limiter.acquire(token)
@@ -0,0 +1,45 @@
+PYTHON = '''# Copyright 2024 Someone
+# Licensed under the MIT license
+
+import os
+
+
+def first(a):
+    # explain
+    return a + 1
+
+
+class Thing:
+    size = 3
+
+    @property
+    def area(self):
+        return self.size ** 2
+
+    def grow(self):
+        self.size += 1  # TODO: bound it
+'''
+
+
+def test_minify_drops_license_comments_and_blank_lines(checker):
+    rules = checker.MINIFY_RULES['errors']
+    text, line_map = checker.minify_source(PYTHON, 'x.py', rules)
+    lines = text.split('\n')
+    assert 'Copyright' not in text and '# explain' not in text
+    assert '# TODO: bound it' in text
+    assert '' not in lines[:-1]
+    assert len(lines) == len(line_map)
+    original = PYTHON.split('\n')
+    for minified, number in zip(lines, line_map):
+        assert minified.strip() == original[number - 1].strip()
+
+
+def test_minify_without_rules_is_identity(checker):
+    assert checker.minify_source(PYTHON, 'x.py', []) == (PYTHON, None)
+
+
+def test_remap_line_numbers(checker):
+    line_map = [4, 7, 9, 12]
+    text = "line 2: bad\nLines 1-3: worse\nline 40: past the end"
+    assert checker.remap_line_numbers(text, line_map) == "line 7: bad\nLines 4-9: worse\nline 40: past the end"
+    assert checker.remap_line_numbers(text, None) == text
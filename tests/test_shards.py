@@ -0,0 +1,66 @@
+import pytest
+
+
+def test_parse_shard(checker):
+    assert checker.parse_shard(' 2 / 3 ') == (2, 3)
+    for text in ('0/3', '4/3', '1-3', '', None):
+        with pytest.raises(ValueError):
+            checker.parse_shard(text)
+
+
+def test_assign_shards_is_balanced_and_deterministic(checker):
+    costs = {f"f{i}.py": cost for i, cost in enumerate([90, 10, 40, 40, 30, 30, 20, 20, 10, 10])}
+    assignment = checker.assign_shards(costs, 3)
+    assert set(assignment) == set(costs)
+    totals = [sum(cost for key, cost in costs.items() if assignment[key] == shard) for shard in (1, 2, 3)]
+    assert max(totals) - min(totals) <= 10
+    assert checker.assign_shards(dict(reversed(list(costs.items()))), 3) == assignment
+
+
+def test_assign_shards_more_shards_than_files(checker):
+    assert sorted(checker.assign_shards({'a': 5, 'b': 1}, 4).values()) == [1, 2]
+
+
+def partial(shard, paths, results):
+    return {
+        'jobs': [{'target': '/src', 'analysis_type': 'errors', 'model': 'm'}],
+        'shard': shard,
+        'manifest': {'0': sorted(paths)},
+        'results': [{'job': 0, 'path': path, 'status': 'analyzed', 'model': 'm', 'content_hash': 'h' + path,
+                     'result': f"- **Bug (high)** line 1: in {path}"} for path in results],
+    }
+
+
+def test_merge_partials_complete(engine, tmp_path):
+    paths = ['a.py', 'b.py', 'c.py']
+    report = tmp_path / 'report.md'
+    assert engine.merge_partials([partial([1, 2], paths, ['a.py', 'c.py']), partial([2, 2], paths, ['b.py'])],
+                                 str(report))
+    assert {f['path'] for f in engine.findings_db.query()} == {'/src/a.py', '/src/b.py', '/src/c.py'}
+    assert '## b.py (analyzed, m)' in report.read_text()
+
+
+def test_merge_partials_reports_missing_and_duplicates(engine):
+    paths = ['a.py', 'b.py', 'c.py']
+    assert not engine.merge_partials([partial([1, 2], paths, ['a.py']), partial([2, 2], paths, ['a.py', 'b.py'])])
+    assert not engine.merge_partials([partial([1, 2], paths, paths)])
+    assert not engine.merge_partials([partial([1, 2], paths, ['a.py']), partial([2, 2], paths[:2], ['b.py', 'c.py'])])
+
+
+def test_merge_partials_file_target(engine, tmp_path):
+    target = tmp_path / 'pkg' / 'mod.py'
+    target.parent.mkdir()
+    target.write_text("x = 1\n")
+    assert engine.relative_path(str(target), str(target)) == 'mod.py'
+    merged = partial([1, 1], ['mod.py'], ['mod.py'])
+    merged['jobs'][0]['target'] = str(target)
+    assert engine.merge_partials([merged])
+    assert [f['path'] for f in engine.findings_db.query()] == [str(target)]
+
+
+def test_merge_partials_does_not_invent_hashes(engine):
+    unhashed = partial([1, 1], ['a.py', 'b.py'], ['a.py', 'b.py'])
+    unhashed['results'][1]['content_hash'] = None
+    assert not engine.merge_partials([unhashed])
+    assert [f['path'] for f in engine.findings_db.query()] == ['/src/a.py']
+    assert engine.findings_db.conn.execute("SELECT COUNT(*) FROM files WHERE content_hash = 'unknown'").fetchone()[0] == 0
@@ -0,0 +1,35 @@
+import pytest
+
+
+def test_wilson_interval(checker):
+    low, high = checker.wilson_interval(5, 10)
+    assert low == pytest.approx(0.2366, abs=1e-4)
+    assert high == pytest.approx(0.7634, abs=1e-4)
+    assert checker.wilson_interval(0, 0) == (0.0, 1.0)
+    low, high = checker.wilson_interval(0, 20)
+    assert low == pytest.approx(0.0) and high == pytest.approx(0.1611, abs=1e-4)
+    assert checker.wilson_interval(20, 20)[1] == pytest.approx(1.0)
+
+
+def test_wilson_interval_narrows_with_samples(checker):
+    widths = [high - low for low, high in (checker.wilson_interval(n // 4, n) for n in (8, 80, 800))]
+    assert widths == sorted(widths, reverse=True)
+
+
+def test_stratified_mean_weights_strata_by_size(checker):
+    mean, half_width, coverage = checker.stratified_mean([(90, [1.0, 1.0]), (10, [5.0, 5.0])])
+    assert mean == pytest.approx(1.4)
+    assert half_width == 0.0
+    assert coverage == 1.0
+
+
+def test_stratified_mean_fully_sampled_stratum_has_no_error(checker):
+    assert checker.stratified_mean([(3, [1.0, 2.0, 6.0])])[1] == 0.0
+    assert checker.stratified_mean([(30, [1.0, 2.0, 6.0])])[1] > 0.0
+
+
+def test_stratified_mean_skips_unsampled_strata(checker):
+    mean, _, coverage = checker.stratified_mean([(30, [2.0, 4.0]), (10, [])])
+    assert mean == pytest.approx(3.0)
+    assert coverage == pytest.approx(0.75)
+    assert checker.stratified_mean([(5, [])]) == (0.0, 0.0, 0.0)
@@ -0,0 +1,43 @@
+def sanitize(checker, *chunks):
+    sanitizer = checker.StreamSanitizer()
+    return ''.join(sanitizer.feed(chunk) for chunk in chunks)
+
+
+def test_csi_and_spinner_are_removed(checker):
+    assert sanitize(checker, "\x1b[2K\x1b[1G⠋ ⠙ done\x1b[0m\n") == "  done\n"
+
+
+def test_sequences_split_across_chunks(checker):
+    assert sanitize(checker, "a\x1b", "[3", "1mb\x1b]0;ti", "tle\x07c") == "abc"
+
+
+def test_string_sequences_end_at_bel_or_st(checker):
+    assert sanitize(checker, "a\x1b]8;;http://x\x1b\\link\x1b]8;;\x07b") == "alinkb"
+    assert sanitize(checker, "a\x1bPq#0;2;0\x1b\\b") == "ab"
+
+
+def test_escape_with_intermediate_bytes(checker):
+    assert sanitize(checker, "a\x1b(Bb\x1b", "(", "0c") == "abc"
+
+
+def test_control_characters_except_newline_and_tab(checker):
+    assert sanitize(checker, "a\rb\x08c\td\n") == "abc\td\n"
+
+
+def test_clean_terminal_output_collapses_spaces_outside_code(engine):
+    text = "Found   an\t issue\n```\nx  =  1\n```\n"
+    assert engine.clean_terminal_output(text) == "Found an issue\n```\nx  =  1\n```"
+
+
+def test_code_block_stream_stops_at_closing_fence(checker):
+    stream = checker.CodeBlockStream()
+    assert not stream.feed("Here:\n```py")
+    assert not stream.feed("thon\nx = 1\n\x1b[0m")
+    assert stream.feed("y = 2\n```\nmore words\n")
+    assert stream.finish() == "x = 1\ny = 2"
+
+
+def test_code_block_stream_fence_without_newline(checker):
+    stream = checker.CodeBlockStream()
+    stream.feed("```\nx = 1\n```")
+    assert stream.finish() == "x = 1"
@@ -0,0 +1,108 @@
+"""Record a headless run against a stand-in Ollama server, then replay it
+offline: the end-to-end harness for the command-line modes."""
+import http.server
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ollama-gui-standalone.py')
+
+ANSWER = "1. **Bug (high)** line 1: suspicious"
+
+
+class FakeOllama(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.send_json({'models': [{'name': 'm'}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if self.path != '/api/generate' or body.get('keep_alive') == 0:
+            self.send_json({'done': True})
+            return
+        lines = [{'response': ANSWER, 'done': False},
+                 {'response': '', 'done': True, 'load_duration': 0, 'eval_count': 10, 'eval_duration': int(1e8),
+                  'prompt_eval_count': 50, 'prompt_eval_duration': int(1e8), 'total_duration': int(2e8)}]
+        data = b''.join(json.dumps(line).encode('utf-8') + b'\n' for line in lines)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def fake_ollama():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def run_checker(home, host, *args):
+    env = dict(os.environ, HOME=str(home), OLLAMA_HOST=host)
+    return subprocess.run([sys.executable, SCRIPT, *args], env=env, capture_output=True, text=True, timeout=120)
+
+
+def test_request_key_ignores_sampling_options(checker):
+    body = {'model': 'm', 'prompt': 'p', 'options': {'num_thread': 4}}
+    key = checker.OllamaTape.request_key('POST', '/api/generate', json.dumps(body).encode())
+    body['options'] = {'num_thread': 8}
+    assert checker.OllamaTape.request_key('POST', '/api/generate', json.dumps(body).encode()) == key
+    body['prompt'] = 'q'
+    assert checker.OllamaTape.request_key('POST', '/api/generate', json.dumps(body).encode()) != key
+
+
+def test_tape_round_trip_and_repeat(checker, tmp_path):
+    path = str(tmp_path / 'tape.gz')
+    tape = checker.OllamaTape(path)
+    tape.append({'key': 'k', 'status': 200, 'chunks': [[0, 'first']]})
+    tape.append({'key': 'k', 'status': 200, 'chunks': [[0, 'second']]})
+    loaded = checker.OllamaTape(path).load()
+    assert [loaded.lookup('k')['chunks'][0][1] for _ in range(3)] == ['first', 'second', 'second']
+    assert loaded.lookup('other') is None
+    assert (loaded.hits, loaded.misses) == (3, 1)
+
+
+def test_replayed_analysis_matches_recording(tmp_path, fake_ollama):
+    source = tmp_path / 'src'
+    source.mkdir()
+    (source / 'a.py').write_text("def f(x):\n    return x + 1\n\n\ndef g(y):\n    return y * 2\n")
+    (source / 'b.py').write_text("def h():\n    pass\n")
+    tape = str(tmp_path / 'tape.gz')
+    command = ['--analyze', str(source), '--type', 'errors', '--model', 'm']
+
+    recorded = run_checker(tmp_path / 'home-record', fake_ollama, '--record', tape, *command)
+    assert recorded.returncode == 0, recorded.stderr
+    assert f"Recorded to {tape}" in recorded.stderr
+
+    # OLLAMA_HOST points where nothing listens: every answer has to come from the tape
+    replayed = run_checker(tmp_path / 'home-replay', '127.0.0.1:9', '--replay', tape, '--replay-speed', '0', *command)
+    assert replayed.returncode == 0, replayed.stderr
+    assert ", 0 not on the tape" in replayed.stderr
+    for name in ('a.py', 'b.py'):
+        assert f"Results for {name}" in replayed.stdout
+
+    def findings(output):
+        return sorted(line for line in output.splitlines() if 'suspicious' in line)
+
+    assert findings(replayed.stdout) == findings(recorded.stdout)
+    assert len(findings(replayed.stdout)) == 2
@@ -0,0 +1,34 @@
+import subprocess
+
+
+def git(repo, *args):
+    return subprocess.run(['git', '-C', str(repo), *args], check=True, capture_output=True, text=True).stdout.strip()
+
+
+def test_ref_results_leave_working_tree_findings_alone(checker, engine, tmp_path):
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    git(repo, 'init', '-q')
+    (repo / 'a.py').write_text("def f():\n    return 1\n")
+    git(repo, 'add', 'a.py')
+    git(repo, '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-m', 'a')
+    (repo / 'a.py').write_text("def f():\n    return 2\n")  # The checkout moves on
+    db = engine.findings_db
+
+    run_id = db.start_run('analysis', str(repo), 'errors', 'm')
+    db.record_analysis(run_id, str(repo / 'a.py'), 'analyzed', "- **Bug (high)** line 2: checkout", 'errors')
+    # The committed blob was analyzed before, so the ref run needs no model
+    blob = git(repo, 'rev-parse', 'HEAD:a.py')
+    run_id = db.start_run('analysis', str(tmp_path / 'elsewhere'), 'errors', 'm')
+    db.record_analysis(run_id, str(tmp_path / 'elsewhere' / 'a.py'), 'analyzed',
+                       "- **Bug (low)** line 1: committed", 'errors', content_hash=blob)
+    work_list = db.work_list(target=str(repo))
+    findings = db.query(path_prefix=str(repo))
+
+    engine.run_tree_analysis(str(repo), 'HEAD', 'errors', 'm', checker.CancelToken())
+
+    assert db.work_list(target=str(repo)) == work_list == [str(repo / 'a.py')]
+    assert db.query(path_prefix=str(repo)) == findings
+    assert db.open_finding_counts(str(repo)) == {str(repo / 'a.py'): 1}
+    ref_findings = db.query(path_prefix=f"{repo}@HEAD")
+    assert [(f['path'], f['message']) for f in ref_findings] == [(f"{repo}@HEAD/a.py", "Bug (low) line 1: committed")]
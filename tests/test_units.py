@@ -0,0 +1,81 @@
+PYTHON = '''# Copyright 2024 Someone
+# Licensed under the MIT license
+
+import os
+
+
+def first(a):
+    # explain
+    return a + 1
+
+
+class Thing:
+    size = 3
+
+    @property
+    def area(self):
+        return self.size ** 2
+
+    def grow(self):
+        self.size += 1  # TODO: bound it
+'''
+
+JAVASCRIPT = '''const limit = 3;
+
+function add(a, b) {
+  return a + b;
+}
+
+class Box {
+  open() {
+    return true;
+  }
+}
+'''
+
+
+def test_truncate_source_reports_first_unseen_line(checker):
+    content = '\n'.join(f"line{i:02}" for i in range(1, 11))  # 6 characters and a newline each
+    line_map = list(range(101, 111))
+    assert checker.truncate_source(content, line_map, limit=len(content)) == (content, line_map, None)
+    cut_content, cut_map, cut = checker.truncate_source(content, line_map, limit=24)
+    assert cut_content == content[:24]
+    assert cut_map == [101, 102, 103, 104]
+    assert cut == 104  # The fourth line is only partly there
+    assert checker.truncate_source(content, None, limit=24)[2] == 4
+
+
+def test_code_units_python(checker):
+    units = dict(checker.code_units('x.py', PYTHON))
+    assert units['first'] == [7, 8, 9]
+    assert units['Thing.area'] == [15, 16, 17]  # Starts at the decorator
+    assert units['Thing.grow'] == [19, 20]
+    assert 12 in units['<module>'] and 8 not in units['<module>']
+    assert sorted(line for numbers in units.values() for line in numbers) == list(range(1, 22))
+
+
+def test_code_units_unparsable_python_is_one_unit(checker):
+    assert checker.code_units('x.py', "def broken(:\n    pass\n") == [('<module>', [1, 2, 3])]
+
+
+def test_code_units_brace_language(checker):
+    units = dict(checker.code_units('x.js', JAVASCRIPT))
+    assert units['add'] == [3, 4, 5]
+    assert units['<module>'][0] == 1
+
+
+def test_unit_keys_follow_definitions_not_positions(checker):
+    keys = {name: key for name, _, key in checker.unit_keys('x.py', PYTHON, 'errors', 'm')}
+    moved = PYTHON.replace("import os\n", "import os\nimport sys\n\n\n").replace("return a + 1", "return a  +  1")
+    moved_keys = {name: key for name, _, key in checker.unit_keys('x.py', moved, 'errors', 'm')}
+    assert moved_keys['first'] == keys['first']
+    assert moved_keys['Thing.grow'] == keys['Thing.grow']
+    assert moved_keys['<module>'] != keys['<module>']
+    other_model = {name: key for name, _, key in checker.unit_keys('x.py', PYTHON, 'errors', 'n')}
+    assert other_model['first'] != keys['first']
+    assert checker.unit_keys('x.py', "x = 1\n", 'errors', 'm') is None
+
+
+def test_unit_results_round_trip(findings_db):
+    findings_db.store_unit_results({'k1': [{'start': 1}], 'k2': []})
+    assert findings_db.unit_results(['k1', 'k2', 'k3']) == {'k1': [{'start': 1}], 'k2': []}